@@ -3,12 +3,16 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
 # local imports
 from config import app_config
+from app import database
+from app.assets import asset_manifest
+from app.instrumentation import sql_instrumentation
+from app.passwords import password_hasher
+from app.replicas import RoutingSQLAlchemy, replica_router
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 
 
@@ -18,7 +22,12 @@ def create_app(config_name):
     app.config.from_pyfile('config.py')
 
     Bootstrap(app)
+    database.init_app(app)
+    replica_router.init_app(app)
     db.init_app(app)
+    password_hasher.init_app(app)
+    sql_instrumentation.init_app(app)
+    asset_manifest.init_app(app)
     login_manager.init_app(app)
     login_manager.login_message = "You must be logged in to access this page."
     login_manager.login_view = "auth.login"
@@ -26,7 +35,8 @@ def create_app(config_name):
     # Migrate DB
     migrate = Migrate(app, db)
 
-    from app import models
+    from app import models, awards, catalog, fragments, identity, jobs, search, sheets
+    fragments.fragment_cache.init_app(app)
 
     # Register blueprints here
     from .admin import admin as admin_blueprint
@@ -38,4 +48,11 @@ def create_app(config_name):
     from .home import home as home_blueprint
     app.register_blueprint(home_blueprint)
 
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api')
+
+    # Register CLI commands here
+    from . import commands
+    commands.init_app(app)
+
     return app
\ No newline at end of file
@@ -1,11 +1,12 @@
 # Imports
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, HiddenField
+from flask_wtf.file import FileField
+from wtforms import IntegerField, StringField, SubmitField, HiddenField, TextAreaField
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, Length, NumberRange, Optional
 
 # Local Imports
-from ..models import Character, Role
+from ..models import Attribute, AwardType, Character, Role
 
 
 class CharacterForm(FlaskForm):
@@ -36,3 +37,33 @@ class UserAssignForm(FlaskForm):
                             get_label="name")
     submit = SubmitField('Submit')
 
+
+class BulkAwardForm(FlaskForm):
+    """
+    Form for admin to grant the same award to a roster of characters
+    """
+    roster = TextAreaField('Character ids, or a CSV with a character_id column')
+    roster_file = FileField('Roster CSV')
+    award_type = QuerySelectField(query_factory=lambda: AwardType.query.order_by(AwardType.name).all(),
+                                  get_label="name")
+    amount = IntegerField('Amount', validators=[DataRequired()])
+    reason = StringField('Reason', validators=[DataRequired(), Length(max=512)])
+    preview = SubmitField('Preview')
+    submit = SubmitField('Grant')
+
+
+class AttributeRankForm(FlaskForm):
+    """
+    Form for admin to set or remove a character's rank in an attribute
+    """
+    attribute = QuerySelectField(query_factory=lambda: Attribute.query.order_by(Attribute.attribute_name).all(),
+                                 get_label="attribute_name")
+    rank = IntegerField('Rank, blank to remove the attribute', validators=[Optional(), NumberRange(min=0)])
+    comments = StringField('Comments', validators=[Length(max=1024)])
+    submit = SubmitField('Set Rank')
+
+
+class ActionForm(FlaskForm):
+    """
+    Form with no fields behind a single action button, so the post carries a CSRF token
+    """
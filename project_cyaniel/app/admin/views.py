@@ -1,10 +1,32 @@
-from flask import abort, flash, redirect, render_template, url_for
+import datetime
+import os
+
+from flask import abort, current_app, flash, jsonify, redirect, render_template, request, Response, \
+    stream_with_context, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from . import admin
-from .forms import CharacterForm, RoleForm, UserAssignForm
+from .forms import ActionForm, AttributeRankForm, BulkAwardForm, CharacterForm, RoleForm, UserAssignForm
 from .. import db
-from ..models import Character, Role, User
+from ..awards import BulkAwardError, grant_bulk_award, parse_roster
+from ..catalog import get_catalog
+from ..database import pool_stats
+from ..downloads import send_download
+from ..eligibility import advancement_choices, character_ranks
+from ..exports import FORMATS, stream_export
+from ..fragments import CHARACTERS_VERSION, ROLES_VERSION, USERS_VERSION, fragment_cache, fragment_versions
+from ..history import history_query, ranks_as_of, set_attribute_rank
+from ..instrumentation import sql_instrumentation
+from ..jobs import TASKS, cancel_job, enqueue, export_path, retry_job, status_counts
+from ..models import AttributeChange, Bucket, BucketTicket, Character, Job, JobStatus, Role, TicketStatus, User
+from ..pagination import paginate_request
+from ..passwords import password_hasher
+from ..prerequisites import PrerequisiteCycleError, get_prerequisite_graph
+from ..replicas import replica_router, use_primary
+from ..search import KINDS, SearchUnavailable, highlight, search
+from ..sheets import get_sheet_or_404
+from ..tickets import bucket_counts, claim_next_ticket, close_ticket, queue_query, release_ticket
 
 
 def check_admin():
@@ -25,11 +47,56 @@ def list_characters():
     List all characters
     """
     check_admin()
+    fragment_versions((CHARACTERS_VERSION,))
+
+    query = Character.query
+    name = request.args.get('q', '').strip()
+    if name:
+        # a prefix match can still use ix_characters_character_name
+        query = query.filter(Character.character_name.startswith(name, autoescape=True))
 
-    characters = Character.query.all()
+    characters = paginate_request(query,
+                                  sorts={'name': Character.character_name, 'id': Character.id},
+                                  default_sort='name', id_column=Character.id)
 
     return render_template('admin/characters/characters.html',
-                           characters=characters, title="Characters")
+                           characters=characters, q=name, action_form=ActionForm(), title="Characters")
+
+
+@admin.route('/characters/export.<format>')
+@login_required
+def export_characters(format):
+    """
+    Stream every character with their attributes as CSV or NDJSON
+    """
+    check_admin()
+
+    if format not in FORMATS:
+        abort(404)
+
+    response = Response(stream_with_context(stream_export(format)), mimetype=FORMATS[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=characters.{}'.format(format)
+    return response
+
+
+@admin.route('/characters/export.<format>/background', methods=['POST'])
+@login_required
+def queue_character_export(format):
+    """
+    Write the character export to a file in a background job
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    if format not in FORMATS:
+        abort(404)
+
+    job_id = enqueue('export_characters', {'format': format}, user_id=current_user.id)
+    flash('The export is being written in the background.')
+
+    # redirect to the job page
+    return redirect(url_for('admin.job', id=job_id))
 
 
 @admin.route('/characters/add', methods=['GET', 'POST'])
@@ -53,7 +120,7 @@ def add_character():
     form = CharacterForm()
     if form.validate_on_submit():
         character = Character(character_name=form.character_name.data,
-                              user=current_user)
+                              user_id=current_user.id)
 
         try:
             # add characters to the database
@@ -83,7 +150,8 @@ def edit_character(id):
 
     add_character = False
 
-    character = Character.query.get_or_404(id)
+    sheet = get_sheet_or_404(id, 'staff_review')
+    character = sheet.character
     form = CharacterForm(obj=character)
     if form.validate_on_submit():
         character.character_name = form.character_name.data
@@ -95,13 +163,88 @@ def edit_character(id):
         return redirect(url_for('admin.list_characters'))
 
     form.character_name.data = character.character_name
+    # staff see every option; character generation lists only when asked for
+    chargen = request.args.get('chargen') == '1'
+    ranks = sheet.ranks()
+    advancement = advancement_choices(id, chargen=chargen, staff=True, ranks=ranks)
+    held = set(attribute_id for attribute_id, rank in ranks.items() if rank is None or rank > 0)
+    missing = {}
+    unlocks = {}
+    try:
+        graph = get_prerequisite_graph()
+    except PrerequisiteCycleError as error:
+        current_app.logger.error('Prerequisites unavailable: %s', error)
+        flash('Prerequisites cannot be checked: {}'.format(error))
+    else:
+        for attribute_id in held:
+            missing[attribute_id] = [graph.name(node) for node in
+                                     graph.missing_prerequisites(attribute_id, held - {attribute_id})]
+            unlocks[attribute_id] = len(graph.unlocks(attribute_id))
     return render_template('admin/characters/character.html', action="Edit",
                            add_character=add_character, form=form,
-                           character=character, title="Edit Character")
+                           character=character, sheet=sheet, advancement=advancement, chargen=chargen,
+                           attributes=get_catalog().attributes, ranks=ranks, missing=missing, unlocks=unlocks,
+                           title="Edit Character")
+
+
+@admin.route('/characters/<int:id>/history', methods=['GET', 'POST'])
+@login_required
+def character_history(id):
+    """
+    Show a character's attribute changes and its ranks as of a past date, and set ranks
+    """
+    check_admin()
+
+    character = Character.query.get_or_404(id)
+    form = AttributeRankForm()
+    if form.validate_on_submit():
+        attribute = form.attribute.data
+        if set_attribute_rank(id, attribute.id, form.rank.data, current_user.id, form.comments.data or None):
+            flash('You have set {} to {}.'.format(attribute.attribute_name,
+                                                 'none' if form.rank.data is None else form.rank.data))
+        else:
+            flash('{} was already at that rank.'.format(attribute.attribute_name))
+        if form.rank.data:
+            # staff may grant anything, but are told when the sheet now skips a prerequisite
+            held = [attribute_id for attribute_id, rank in character_ranks(id).items()
+                    if attribute_id != attribute.id and (rank is None or rank > 0)]
+            try:
+                graph = get_prerequisite_graph()
+            except PrerequisiteCycleError as error:
+                current_app.logger.error('Prerequisites unavailable: %s', error)
+                flash('Prerequisites cannot be checked: {}'.format(error))
+            else:
+                missing = graph.missing_prerequisites(attribute.id, held)
+                if missing:
+                    flash('{} requires {}, which this character does not have.'.format(
+                        attribute.attribute_name, ', '.join(str(graph.name(node)) for node in missing)))
+
+        return redirect(url_for('admin.character_history', id=id))
+
+    as_of = request.args.get('as_of', '').strip()
+    past_ranks = None
+    if as_of:
+        try:
+            # a date means the end of that day
+            when = datetime.datetime.strptime(as_of, '%Y-%m-%d') + datetime.timedelta(days=1, microseconds=-1)
+        except ValueError:
+            abort(400)
+        ranks = ranks_as_of(id, when)
+        if ranks is not None:
+            attributes = get_catalog().attributes
+            past_ranks = sorted(((attributes.get(attribute_id).name if attribute_id in attributes
+                                  else '#{}'.format(attribute_id), rank) for attribute_id, rank in ranks.items()))
+
+    changes = paginate_request(history_query(id), sorts={'changed': AttributeChange.changed_on},
+                               default_sort='changed', id_column=AttributeChange.id, default_direction='desc')
+
+    return render_template('admin/characters/history.html', character=character, form=form, as_of=as_of,
+                           past_ranks=past_ranks, changes=changes, title='Attribute History')
 
 
 @admin.route('/characters/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
+@use_primary
 def delete_character(id):
     """
     Delete a characters from the database
@@ -124,13 +267,22 @@ def delete_character(id):
 @admin.route('/roles')
 @login_required
 def list_roles():
-    check_admin()
     """
     List all roles
     """
-    roles = Role.query.all()
+    check_admin()
+    fragment_versions((ROLES_VERSION, USERS_VERSION))
+
+    query = Role.query
+    name = request.args.get('q', '').strip()
+    if name:
+        query = query.filter(Role.name.startswith(name, autoescape=True))
+
+    roles = paginate_request(query,
+                             sorts={'name': Role.name, 'id': Role.id},
+                             default_sort='name', id_column=Role.id)
     return render_template('admin/roles/roles.html',
-                           roles=roles, title='Roles')
+                           roles=roles, q=name, title='Roles')
 
 
 @admin.route('/roles/add', methods=['GET', 'POST'])
@@ -195,6 +347,7 @@ def edit_role(id):
 
 @admin.route('/roles/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
+@use_primary
 def delete_role(id):
     """
     Delete a role from the database
@@ -221,10 +374,19 @@ def list_users():
     List all users
     """
     check_admin()
+    fragment_versions((USERS_VERSION, ROLES_VERSION, CHARACTERS_VERSION))
+
+    query = User.query
+    email = request.args.get('q', '').strip()
+    if email:
+        # a prefix match can still use ix_users_email
+        query = query.filter(User.email.startswith(email, autoescape=True))
 
-    users = User.query.all()
+    users = paginate_request(query,
+                             sorts={'email': User.email, 'id': User.id},
+                             default_sort='id', id_column=User.id)
     return render_template('admin/users/users.html',
-                           users=users, title='Users')
+                           users=users, q=email, title='Users')
 
 
 @admin.route('/users/assign/<int:id>', methods=['GET', 'POST'])
@@ -254,4 +416,343 @@ def assign_user(id):
 
     return render_template('admin/users/user.html',
                            user=user, form=form,
-                           title='Assign User')
\ No newline at end of file
+                           title='Assign User')
+
+# Award Views
+
+@admin.route('/awards/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_award():
+    """
+    Preview or grant one award to every character of a roster
+    """
+    check_admin()
+
+    form = BulkAwardForm()
+    result = None
+    if form.validate_on_submit():
+        dry_run = form.preview.data
+        try:
+            character_ids = parse_roster(form.roster.data or '')
+            if form.roster_file.data:
+                character_ids += parse_roster(form.roster_file.data.read().decode('utf-8-sig'))
+            # always a dry run here, the grant itself runs as a background job
+            result = grant_bulk_award(character_ids, form.award_type.data.id, form.amount.data,
+                                      form.reason.data, dry_run=True)
+        except BulkAwardError as error:
+            flash(str(error))
+        else:
+            if not dry_run and result.missing:
+                flash('Unknown characters: {}'.format(', '.join(str(id) for id in result.missing)))
+            elif not dry_run:
+                job_id = enqueue('bulk_award', {'character_ids': [grant.character_id for grant in result.grants],
+                                                'award_type_id': result.award_type.id, 'amount': result.amount,
+                                                'reason': result.reason}, user_id=current_user.id)
+                flash('Granting {0} {1} to {2} characters in the background.'.format(
+                    result.amount, result.award_type.name, len(result.grants)))
+
+                # redirect to the job page
+                return redirect(url_for('admin.job', id=job_id))
+
+    return render_template('admin/awards/bulk.html', form=form, result=result, title='Bulk Awards')
+
+
+# Ticket Queue Views
+
+TICKET_STATUSES = {'open': TicketStatus.OPEN, 'claimed': TicketStatus.CLAIMED, 'closed': TicketStatus.CLOSED}
+
+
+@admin.route('/buckets')
+@login_required
+def list_buckets():
+    """
+    List all ticket buckets with their ticket counts
+    """
+    check_admin()
+
+    buckets = Bucket.query.order_by(Bucket.name).all()
+    return render_template('admin/tickets/buckets.html', buckets=buckets, counts=bucket_counts(),
+                           action_form=ActionForm(), TicketStatus=TicketStatus, title='Ticket Queues')
+
+
+@admin.route('/buckets/<int:id>')
+@login_required
+def bucket_queue(id):
+    """
+    List the tickets of a bucket in one status, oldest first
+    """
+    check_admin()
+
+    bucket = Bucket.query.get_or_404(id)
+    status = request.args.get('status', 'open')
+    if status not in TICKET_STATUSES:
+        abort(400)
+
+    tickets = paginate_request(queue_query(id, TICKET_STATUSES[status]),
+                               sorts={'created': BucketTicket.created_on},
+                               default_sort='created', id_column=BucketTicket.id)
+
+    return render_template('admin/tickets/queue.html', bucket=bucket, tickets=tickets, status=status,
+                           statuses=TICKET_STATUSES, action_form=ActionForm(), TicketStatus=TicketStatus,
+                           title=bucket.name)
+
+
+@admin.route('/buckets/<int:id>/claim', methods=['POST'])
+@login_required
+def claim_ticket(id):
+    """
+    Assign the oldest open ticket of a bucket to the current user
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    Bucket.query.get_or_404(id)
+    ticket_id = claim_next_ticket(id, current_user.id)
+    if ticket_id is None:
+        flash('There are no open tickets left in this queue.')
+    else:
+        flash('You have claimed ticket #{}.'.format(ticket_id))
+
+    return redirect(url_for('admin.bucket_queue', id=id, status='claimed'))
+
+
+@admin.route('/tickets/<int:id>/release', methods=['POST'])
+@login_required
+def unclaim_ticket(id):
+    """
+    Put a ticket claimed by the current user back into its queue
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    ticket = BucketTicket.query.get_or_404(id)
+    if release_ticket(id, current_user.id):
+        flash('You have released ticket #{}.'.format(id))
+    else:
+        flash('Only the staff member who claimed a ticket can release it.')
+
+    return redirect(url_for('admin.bucket_queue', id=ticket.bucket_id, status='claimed'))
+
+
+@admin.route('/tickets/<int:id>/close', methods=['POST'])
+@login_required
+def resolve_ticket(id):
+    """
+    Close a ticket claimed by the current user
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    ticket = BucketTicket.query.get_or_404(id)
+    if close_ticket(id, current_user.id):
+        flash('You have closed ticket #{}.'.format(id))
+    else:
+        flash('Only the staff member who claimed a ticket can close it.')
+
+    return redirect(url_for('admin.bucket_queue', id=ticket.bucket_id, status='claimed'))
+
+
+# Search Views
+
+@admin.route('/search')
+@login_required
+def search_records():
+    """
+    Full-text search across characters, notes, items, attributes and tickets
+    """
+    check_admin()
+
+    query = request.args.get('q', '').strip()
+    kinds = [kind for kind in request.args.getlist('kind') if kind in KINDS]
+    results = []
+    if query:
+        try:
+            results = search(query, kinds or None)
+        except SearchUnavailable as error:
+            flash(str(error))
+
+    return render_template('admin/search.html', query=query, kinds=kinds, results=results,
+                           search_kinds=KINDS, highlight=highlight, action_form=ActionForm(), title='Search')
+
+
+@admin.route('/search/reindex', methods=['POST'])
+@login_required
+def queue_reindex():
+    """
+    Rebuild the search index in a background job
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    job_id = enqueue('reindex_search', user_id=current_user.id)
+    flash('The search index is being rebuilt in the background.')
+
+    # redirect to the job page
+    return redirect(url_for('admin.job', id=job_id))
+
+
+# Job Views
+
+JOB_STATUSES = {'queued': JobStatus.QUEUED, 'running': JobStatus.RUNNING, 'succeeded': JobStatus.SUCCEEDED,
+                'failed': JobStatus.FAILED, 'cancelled': JobStatus.CANCELLED}
+
+
+@admin.route('/jobs')
+@login_required
+def list_jobs():
+    """
+    List background jobs in one status, newest first
+    """
+    check_admin()
+
+    status = request.args.get('status', 'queued')
+    if status not in JOB_STATUSES:
+        abort(400)
+
+    jobs = paginate_request(Job.query.options(joinedload(Job.created_by))
+                            .filter(Job.status == JOB_STATUSES[status]),
+                            sorts={'created': Job.created_on},
+                            default_sort='created', id_column=Job.id, default_direction='desc')
+
+    return render_template('admin/jobs/jobs.html', jobs=jobs, status=status, statuses=JOB_STATUSES,
+                           counts=status_counts(), tasks=TASKS, JobStatus=JobStatus, action_form=ActionForm(),
+                           title='Jobs')
+
+
+@admin.route('/jobs/snapshot', methods=['POST'])
+@login_required
+def queue_snapshot():
+    """
+    Write an offline snapshot for check-in devices in a background job
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    job_id = enqueue('write_snapshot', user_id=current_user.id)
+    flash('The snapshot is being written in the background.')
+
+    # redirect to the job page
+    return redirect(url_for('admin.job', id=job_id))
+
+
+@admin.route('/jobs/<int:id>')
+@login_required
+def job(id):
+    """
+    Show a background job with its arguments, result and last error
+    """
+    check_admin()
+
+    job = Job.query.get_or_404(id)
+    return render_template('admin/jobs/job.html', job=job, task=TASKS.get(job.name),
+                           download=export_path(job) is not None, action_form=ActionForm(), JobStatus=JobStatus,
+                           title='Job')
+
+
+@admin.route('/jobs/<int:id>/download')
+@login_required
+def download_job_file(id):
+    """
+    Download the file written by a finished export or snapshot job
+    """
+    check_admin()
+
+    path = export_path(Job.query.get_or_404(id))
+    if path is None:
+        abort(404)
+    return send_download(path, os.path.basename(path))
+
+
+@admin.route('/jobs/<int:id>/retry', methods=['POST'])
+@login_required
+def requeue_job(id):
+    """
+    Queue a failed or cancelled job again
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    if retry_job(id):
+        flash('The job has been queued again.')
+    else:
+        flash('Only failed or cancelled jobs can be retried.')
+
+    # redirect to the job page
+    return redirect(url_for('admin.job', id=id))
+
+
+@admin.route('/jobs/<int:id>/cancel', methods=['POST'])
+@login_required
+def stop_job(id):
+    """
+    Cancel a job that has not started yet
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    if cancel_job(id):
+        flash('The job has been cancelled.')
+    else:
+        flash('The job has already started.')
+
+    # redirect to the job page
+    return redirect(url_for('admin.job', id=id))
+
+
+# Instrumentation Views
+
+def instrumentation_report():
+    return {
+        'enabled': current_app.config.get('SQL_INSTRUMENTATION', False),
+        'endpoints': sql_instrumentation.summary(),
+        'password_hashing': password_hasher.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'connection_pool': pool_stats(db.engine),
+        'replicas': replica_router.status(current_app),
+    }
+
+
+@admin.route('/instrumentation')
+@login_required
+def instrumentation():
+    """
+    Show per-endpoint query counts, DB time and possible N+1 patterns
+    """
+    check_admin()
+
+    return render_template('admin/instrumentation.html', report=instrumentation_report(),
+                           action_form=ActionForm(), title='Instrumentation')
+
+
+@admin.route('/instrumentation.json')
+@login_required
+def instrumentation_json():
+    """
+    Export the instrumentation report as JSON
+    """
+    check_admin()
+
+    return jsonify(instrumentation_report())
+
+
+@admin.route('/instrumentation/reset', methods=['POST'])
+@login_required
+def reset_instrumentation():
+    """
+    Discard the recorded samples
+    """
+    check_admin()
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    sql_instrumentation.reset()
+    flash('Instrumentation samples have been reset.')
+
+    return redirect(url_for('admin.instrumentation'))
@@ -0,0 +1,6 @@
+# Imports
+from flask import Blueprint
+
+api = Blueprint('api', __name__)
+
+from . import views
@@ -0,0 +1,112 @@
+from functools import wraps
+
+from flask import abort, jsonify
+from flask_login import current_user
+
+from . import api
+from ..catalog import CATALOG_VERSION, get_catalog
+from ..conditional import is_fresh, make_etag, not_modified, set_validators
+from ..sheets import load_character_sheet, sheet_stamp, stamp_last_modified
+from ..versions import get_version
+
+
+# Read API for check-in clients
+#
+# Every response carries an ETag and Last-Modified computed from cheap
+# change markers, and a conditional GET for an unchanged resource is
+# answered with 304 before anything is loaded.
+
+
+def api_login_required(view):
+    """
+    Answer 401 instead of redirecting to the login page
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(403)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+
+def sheet_to_dict(sheet):
+    character = sheet.character
+    awards = {}
+    for award in character.awards:
+        awards[award.award_type.name] = awards.get(award.award_type.name, 0) + award.amount
+    return {
+        'id': character.id,
+        'name': character.character_name,
+        'created': _date(character.create_date),
+        'last_update': _date(character.last_update),
+        'player': {'id': character.user.id, 'user_name': character.user.user_name},
+        'attributes': [{'id': entry.attribute.id,
+                        'name': entry.attribute.attribute_name,
+                        'type': entry.attribute.attribute_type.name,
+                        'rank': entry.rank} for entry in sheet.attributes],
+        'awards': awards,
+        'items': [{'id': entry.item.id, 'name': entry.item.item_name, 'quantity': entry.quantity}
+                  for entry in character.items],
+        'notes': [{'id': note.id, 'title': note.title, 'body': note.body} for note in character.notes],
+    }
+
+
+@api.route('/characters/<int:id>')
+@api_login_required
+def character_sheet(id):
+    """
+    A character sheet, readable by its player and by admins
+    """
+    stamp = sheet_stamp(id)
+    if stamp is None:
+        abort(404)
+    if stamp.user_id != current_user.id and not current_user.is_admin:
+        abort(403)
+
+    etag = make_etag('sheet', stamp)
+    last_modified = stamp_last_modified(stamp)
+    if is_fresh(etag):
+        return not_modified(etag, last_modified)
+
+    sheet = load_character_sheet(id, 'full_sheet')
+    if sheet is None:
+        abort(404)
+    return set_validators(jsonify(sheet_to_dict(sheet)), etag, last_modified)
+
+
+@api.route('/catalog')
+@api_login_required
+def catalog():
+    """
+    Attribute types, attributes, items and advancement lists
+    """
+    version = get_version(CATALOG_VERSION)
+    etag = make_etag('catalog', version)
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    catalog = get_catalog()
+    item_dates = [item.last_update for item in catalog.items if item.last_update is not None]
+    response = jsonify({
+        'version': catalog.version,
+        'attribute_types': [entry._asdict() for entry in catalog.attribute_types],
+        'attributes': [entry._asdict() for entry in catalog.attributes],
+        'items': [dict(entry._asdict(), last_update=_date(entry.last_update)) for entry in catalog.items],
+        'advancement_lists': [dict(entry._asdict(), options=[
+            dict(option._asdict(), requirements=[requirement._asdict() for requirement in option.requirements])
+            for option in catalog.list_options(entry.id)]) for entry in catalog.advancement_lists],
+    })
+    return set_validators(response, make_etag('catalog', catalog.version),
+                          max(item_dates) if item_dates else None)
@@ -0,0 +1,288 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+
+from flask import current_app, request, send_from_directory
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it only gzip copies are written
+    brotli = None
+
+
+# Static asset build
+#
+# flask build-assets copies everything under app/static into static/dist with
+# a content hash in each file name, so the files can be cached forever, and
+# writes a manifest of original -> hashed names. Text assets get gzip and,
+# when the brotli package is installed, brotli copies next to them. Images get
+# resized WebP and JPEG/PNG variants for srcset and for the stylesheet, which
+# serves the smaller variants to narrow screens through media queries. With
+# a manifest in place url_for('static') points at the hashed names, and the
+# static view serves the precompressed copies to browsers that accept them.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+DEFAULT_WIDTHS = (480, 960, 1600)
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.ico', '.map')
+IMAGES = ('.jpg', '.jpeg', '.png')
+JPEG_QUALITY = 80
+WEBP_QUALITY = 80
+# hashed files never change, so browsers may keep them for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_css_url = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_css_rule = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_css_declaration = re.compile(r'([\w-]+)\s*:\s*([^;]*url\([^;]*)(;|$)')
+
+
+def _hashed_name(path, content):
+    stem, ext = posixpath.splitext(path)
+    return '{0}.{1}{2}'.format(stem, hashlib.sha256(content).hexdigest()[:HASH_LENGTH], ext)
+
+
+def _write(output, name, content):
+    path = os.path.join(output, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as asset_file:
+        asset_file.write(content)
+    return path
+
+
+def _compress(path, content):
+    """
+    Write precompressed copies of a text asset, returning their sizes by encoding
+    """
+    sizes = {}
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(compressed) < len(content):
+        with open(path + '.gz', 'wb') as gzip_file:
+            gzip_file.write(compressed)
+        sizes['gzip'] = len(compressed)
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            with open(path + '.br', 'wb') as brotli_file:
+                brotli_file.write(compressed)
+            sizes['br'] = len(compressed)
+    return sizes
+
+
+def _image_variants(source_path, name, widths, output):
+    """
+    Write resized WebP and JPEG (or PNG, for images with transparency) variants of an image
+
+    Returns a list of {width, format, file, size} dicts, narrowest first.
+    """
+    from PIL import Image
+
+    variants = []
+    with Image.open(source_path) as image:
+        image.load()
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        fallback = 'png' if has_alpha else 'jpeg'
+        stem = posixpath.splitext(name)[0]
+        for width in sorted(set(width for width in widths if width < image.width) | {image.width}):
+            resized = image if width == image.width else \
+                image.resize((width, max(1, round(image.height * width / float(image.width)))), Image.LANCZOS)
+            for image_format in ('webp', fallback):
+                if image_format == 'jpeg':
+                    resized = resized.convert('RGB')
+                    options = {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+                elif image_format == 'webp':
+                    options = {'quality': WEBP_QUALITY, 'method': 6}
+                else:
+                    options = {'optimize': True}
+                content = _encode_image(resized, image_format, options)
+                ext = '.jpg' if image_format == 'jpeg' else '.' + image_format
+                variant = _hashed_name('{0}-{1}w{2}'.format(stem, width, ext), content)
+                _write(output, variant, content)
+                variants.append({'width': width, 'format': image_format, 'file': variant, 'size': len(content)})
+    return variants
+
+
+def _encode_image(image, image_format, options):
+    buffer = BytesIO()
+    image.save(buffer, image_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def _variant_url(css_name, variant_file):
+    return posixpath.relpath(variant_file, posixpath.dirname(css_name))
+
+
+def _rewrite_css(name, css, files, variants):
+    """
+    Point the url()s of a stylesheet at hashed files
+
+    Images with variants get their largest fallback variant, an image-set()
+    that prefers WebP, and one media query per narrower variant.
+    """
+    media_queries = {}
+
+    def resolve(url):
+        if url.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return None
+        return posixpath.normpath(posixpath.join(posixpath.dirname(name), url.split('?')[0].split('#')[0]))
+
+    def declarations(prop, value, image, width=None):
+        by_format = {}
+        for variant in variants[image]:
+            if width is None or variant['width'] == width:
+                by_format[variant['format']] = variant['file']
+        fallback = by_format.get('jpeg') or by_format.get('png')
+        fallback_value = _css_url.sub('url({})'.format(_variant_url(name, fallback)), value)
+        image_set = 'image-set(url({0}) type("image/webp"), url({1}) type("image/{2}"))'.format(
+            _variant_url(name, by_format['webp']), _variant_url(name, fallback),
+            'jpeg' if 'jpeg' in by_format else 'png')
+        return '{0}: {1}; {0}: {2}'.format(prop, fallback_value, _css_url.sub(image_set, value))
+
+    def rewrite_rule(match):
+        selector, body = match.group(1), match.group(2)
+
+        def rewrite_declaration(declaration):
+            prop, value, end = declaration.group(1), declaration.group(2).strip(), declaration.group(3)
+            urls = [resolve(url.group(2)) for url in _css_url.finditer(value)]
+            if len(urls) == 1 and urls[0] in variants:
+                image = urls[0]
+                widths = sorted(set(variant['width'] for variant in variants[image]))
+                for width in widths[:-1]:
+                    media_queries.setdefault(width, []).append('{0} {{ {1}; }}'.format(
+                        selector.strip(), declarations(prop, value, image, width)))
+                return declarations(prop, value, image, widths[-1]) + end
+            return declaration.group(0)
+
+        return selector + '{' + _css_declaration.sub(rewrite_declaration, body) + '}'
+
+    def rewrite_url(match):
+        path = resolve(match.group(2))
+        if path in files:
+            return 'url({})'.format(_variant_url(name, files[path]))
+        return match.group(0)
+
+    css = _css_rule.sub(rewrite_rule, css)
+    css = _css_url.sub(rewrite_url, css)
+    for width in sorted(media_queries, reverse=True):
+        css += '\n@media (max-width: {0}px) {{\n    {1}\n}}\n'.format(width, '\n    '.join(media_queries[width]))
+    return css
+
+
+def build_assets(static_folder, widths=DEFAULT_WIDTHS):
+    """
+    Build static/dist and its manifest from the files under static_folder
+
+    Returns a list of (original name, hashed name, size, {encoding: size})
+    tuples, image variants included.
+    """
+    output = os.path.join(static_folder, DIST)
+    sources = []
+    for directory, directories, names in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(output):
+            directories[:] = []
+            continue
+        directories[:] = [name for name in directories
+                          if os.path.abspath(os.path.join(directory, name)) != os.path.abspath(output)]
+        for file_name in sorted(names):
+            path = os.path.join(directory, file_name)
+            sources.append((os.path.relpath(path, static_folder).replace(os.sep, '/'), path))
+
+    files = {}
+    variants = {}
+    report = []
+    # stylesheets last, so the images they reference already have hashed names
+    for name, path in sorted(sources, key=lambda source: (source[0].endswith('.css'), source[0])):
+        with open(path, 'rb') as source_file:
+            content = source_file.read()
+        ext = posixpath.splitext(name)[1].lower()
+        if ext == '.css':
+            content = _rewrite_css(name, content.decode('utf-8'), files, variants).encode('utf-8')
+        hashed = _hashed_name(name, content)
+        written = _write(output, hashed, content)
+        files[name] = hashed
+        report.append((name, hashed, len(content), _compress(written, content) if ext in COMPRESSIBLE else {}))
+        if ext in IMAGES:
+            variants[name] = _image_variants(path, name, widths, output)
+            report.extend((name, variant['file'], variant['size'], {}) for variant in variants[name])
+
+    manifest_path = os.path.join(output, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump({'files': files, 'variants': variants}, manifest_file, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return report
+
+
+class AssetManifest(object):
+    """
+    Maps static file names to their fingerprinted copies in static/dist
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.variants = {}
+
+    def init_app(self, app):
+        app.extensions['asset_manifest'] = self
+        app.add_template_global(self.srcset, 'asset_srcset')
+        if not app.config.get('USE_ASSET_MANIFEST', False):
+            return
+        self.load(os.path.join(app.static_folder, DIST, MANIFEST))
+        app.url_defaults(self._fingerprint)
+        app.view_functions['static'] = self._static_view
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.files = manifest.get('files', {})
+        self.variants = manifest.get('variants', {})
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static':
+            hashed = self.files.get(values.get('filename'))
+            if hashed is not None:
+                values['filename'] = '{0}/{1}'.format(DIST, hashed)
+
+    def _static_view(self, filename):
+        if not filename.startswith(DIST + '/'):
+            return current_app.send_static_file(filename)
+
+        folder = current_app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] > 0:
+                try:
+                    response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+                except NotFound:
+                    continue
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(folder, filename, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def srcset(self, filename, image_format=None):
+        """
+        A srcset attribute value listing the variants of an image in one format, '' without a build
+        """
+        entries = []
+        for variant in self.variants.get(filename, ()):
+            if image_format is None and variant['format'] != 'webp' or variant['format'] == image_format:
+                url = '{0}{1}/{2}/{3}'.format(request.script_root, current_app.static_url_path, DIST,
+                                              variant['file'])
+                entries.append('{0} {1}w'.format(url, variant['width']))
+        return ', '.join(entries)
+
+
+asset_manifest = AssetManifest()
@@ -5,6 +5,7 @@ from . import auth
 from .forms import LoginForm, RegistrationForm
 from .. import db
 from ..models import User
+from ..passwords import PasswordHasherBusy
 
 
 @auth.route('/register', methods=['GET', 'POST'])
@@ -15,17 +16,22 @@ def register():
     """
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User(email=form.email.data,
-                    user_name=form.user_name.data,
-                    first_name=form.first_name.data,
-                    last_name=form.last_name.data,
-                    birth_month=form.birth_month.data,
-                    birth_day=form.birth_day.data,
-                    birth_year=form.birth_year.data,
-                    phone=form.phone.data,
-                    emergency_contact_name=form.emergency_contact_number.data,
-                    emergency_contact_number=form.emergency_contact_number.data,
-                    password=form.password.data)
+        try:
+            user = User(email=form.email.data,
+                        user_name=form.user_name.data,
+                        first_name=form.first_name.data,
+                        last_name=form.last_name.data,
+                        birth_month=form.birth_month.data,
+                        birth_day=form.birth_day.data,
+                        birth_year=form.birth_year.data,
+                        phone=form.phone.data,
+                        emergency_contact_name=form.emergency_contact_number.data,
+                        emergency_contact_number=form.emergency_contact_number.data,
+                        password=form.password.data)
+        except PasswordHasherBusy:
+            flash('Registration is very busy right now, please try again in a moment.')
+            return render_template('auth/register.html', form=form, title='Register')
+
         # add user to the database
         db.session.add(user)
         db.session.commit()
@@ -46,8 +52,17 @@ def login():
         # check whether user exists in the database and whether
         # the password entered matches the password in the database
         user = User.query.filter_by(email=form.email.data).first()
-        if user is not None and user.verify_password(
-                form.password.data):
+        try:
+            verified = user is not None and user.verify_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('Login is very busy right now, please try again in a moment.')
+            return render_template('auth/login.html', form=form, title='Login')
+
+        if verified:
+            # save a password hash upgraded to the current hash parameters
+            if db.session.is_modified(user):
+                db.session.commit()
+
             # log employee in
             login_user(user)
 
@@ -0,0 +1,273 @@
+import csv
+import datetime
+import io
+from collections import namedtuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import AwardBalance, AwardLog, AwardType, Character
+
+
+# Award balances
+#
+# award_logs is an append-only ledger. award_balances keeps its running total
+# per (user, character, award type) so "how much XP does this character have"
+# is one indexed read. Balances are adjusted in the same transaction as the
+# ledger rows; reconcile_award_balances rebuilds them from scratch. Deleting
+# a character deletes its balances, and its award logs, which the ORM detaches
+# from it, count towards the player's own balance.
+
+_KEY_FIELDS = ('user_id', 'character_id', 'award_type_id')
+
+# rows per IN list, small enough for SQLite's default bound parameter limit
+CHUNK_SIZE = 400
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _balance_filter(table, user_id, character_id, award_type_id):
+    return (table.c.user_id == user_id) & (table.c.character_key == (character_id or 0)) & \
+        (table.c.award_type_id == award_type_id)
+
+
+def _upsert(connection, table):
+    # two transactions creating the same balance both add to it, neither fails or duplicates it
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+        return insert.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.character_key, table.c.award_type_id],
+            set_={'balance': table.c.balance + insert.excluded.balance, 'last_update': insert.excluded.last_update})
+    if dialect == 'mysql':
+        insert = mysql.insert(table)
+        return insert.on_duplicate_key_update(balance=table.c.balance + insert.inserted.balance,
+                                              last_update=insert.inserted.last_update)
+    return None
+
+
+def apply_award_deltas(connection, deltas):
+    """
+    Add amounts to balances from a {(user_id, character_id, award_type_id): amount} dict
+
+    Missing balance rows are created. Use this after writing award logs with
+    bulk statements that bypass the ORM. Every balance is adjusted with one
+    INSERT ... ON CONFLICT (ON DUPLICATE KEY on MySQL) run as an executemany,
+    so concurrent grants to a new balance add up rather than racing to create it.
+    """
+    table = AwardBalance.__table__
+    now = datetime.datetime.utcnow()
+    # sorted so concurrent grants lock the same rows in the same order
+    rows = [{'user_id': user_id, 'character_id': character_id, 'character_key': character_id or 0,
+             'award_type_id': award_type_id, 'balance': amount, 'last_update': now}
+            for (user_id, character_id, award_type_id), amount
+            in sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1] or 0, item[0][2])) if amount]
+    if not rows:
+        return
+
+    statement = _upsert(connection, table)
+    if statement is not None:
+        connection.execute(statement, rows)
+        return
+    # other databases: the unique index turns a racing insert into an IntegrityError
+    for row in rows:
+        result = connection.execute(table.update()
+                                    .where(_balance_filter(table, row['user_id'], row['character_id'],
+                                                           row['award_type_id']))
+                                    .values(balance=table.c.balance + row['balance'], last_update=now))
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+def _previous(state, field):
+    history = state.attrs[field].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), field)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_award_logs(session, flush_context):
+    deltas = {}
+
+    def add(key, amount):
+        deltas[key] = deltas.get(key, 0) + (amount or 0)
+
+    for instance in session.new:
+        if isinstance(instance, AwardLog):
+            add(tuple(getattr(instance, field) for field in _KEY_FIELDS), instance.amount)
+
+    for instance in session.deleted:
+        if isinstance(instance, AwardLog):
+            state = inspect(instance)
+            add(tuple(_previous(state, field) for field in _KEY_FIELDS), -(_previous(state, 'amount') or 0))
+
+    # the ledger is append-only, but corrections to a row are still carried over
+    for instance in session.dirty:
+        if isinstance(instance, AwardLog) and session.is_modified(instance):
+            state = inspect(instance)
+            add(tuple(_previous(state, field) for field in _KEY_FIELDS), -(_previous(state, 'amount') or 0))
+            add(tuple(getattr(instance, field) for field in _KEY_FIELDS), instance.amount)
+
+    # the balances of a deleted character went with it
+    deleted = set(instance.id for instance in session.deleted if isinstance(instance, Character))
+    deltas = dict((key, amount) for key, amount in deltas.items() if key[1] not in deleted)
+
+    if any(deltas.values()):
+        apply_award_deltas(session.connection(), deltas)
+
+
+@event.listens_for(Character, 'before_delete')
+def _delete_balances(mapper, connection, target):
+    table = AwardBalance.__table__
+    connection.execute(table.delete().where(table.c.character_id == target.id))
+
+
+def character_balances(character_id):
+    """
+    Map award type id to the current total awarded to a character
+    """
+    table = AwardBalance.__table__
+    # awards logged under another player still count towards the character
+    rows = db.session.execute(select([table.c.award_type_id, func.sum(table.c.balance)])
+                              .where(table.c.character_id == character_id)
+                              .group_by(table.c.award_type_id))
+    return dict(rows.fetchall())
+
+
+def character_balance(character_id, award_type_id):
+    """
+    The current total of one award type for a character
+    """
+    table = AwardBalance.__table__
+    return db.session.execute(select([func.sum(table.c.balance)])
+                              .where((table.c.character_id == character_id) &
+                                     (table.c.award_type_id == award_type_id))).scalar() or 0
+
+
+def player_balances(user_id):
+    """
+    Map award type id to the current total of player-wide awards, such as glory, for a user
+    """
+    table = AwardBalance.__table__
+    # character_key rather than character_id IS NULL, so the lookup stays on the unique index
+    rows = db.session.execute(select([table.c.award_type_id, table.c.balance])
+                              .where((table.c.user_id == user_id) & (table.c.character_key == 0)))
+    return dict(rows.fetchall())
+
+
+def reconcile_award_balances(commit=True):
+    """
+    Rebuild every balance from the award log with one set-based statement
+
+    Returns the number of balance rows written.
+    """
+    balances = AwardBalance.__table__
+    logs = AwardLog.__table__
+
+    totals = select([logs.c.user_id, logs.c.character_id, func.coalesce(logs.c.character_id, 0),
+                     logs.c.award_type_id, func.sum(logs.c.amount), func.max(logs.c.award_date)]) \
+        .group_by(logs.c.user_id, logs.c.character_id, logs.c.award_type_id)
+
+    db.session.execute(balances.delete())
+    result = db.session.execute(balances.insert().from_select(
+        ['user_id', 'character_id', 'character_key', 'award_type_id', 'balance', 'last_update'], totals))
+    if commit:
+        db.session.commit()
+    return result.rowcount
+
+
+# Bulk awards
+#
+# Post-event grants give the same award to a whole roster. The roster is
+# resolved with one query per CHUNK_SIZE characters, the ledger rows go in
+# with a single executemany and balances are adjusted in the same
+# transaction. A dry run resolves and reports without writing anything.
+
+class BulkAwardError(ValueError):
+    """
+    Raised when a roster or grant is invalid
+    """
+
+
+AwardGrant = namedtuple('AwardGrant', ['character_id', 'character_name', 'user_id'])
+BulkAwardResult = namedtuple('BulkAwardResult', ['award_type', 'amount', 'reason', 'grants', 'missing',
+                                                 'duplicates', 'dry_run'])
+
+
+def parse_roster(text):
+    """
+    Read character ids from a CSV with a character_id (or id) column, or from
+    ids separated by commas, spaces or new lines
+    """
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    header = [cell.strip().lower() for cell in rows[0]] if rows else []
+    column = next((header.index(name) for name in ('character_id', 'id') if name in header), None)
+    if column is None:
+        values = text.replace(',', ' ').split()
+    else:
+        values = [row[column].strip() if column < len(row) else '' for row in rows[1:]]
+
+    character_ids = []
+    for value in values:
+        try:
+            character_ids.append(int(value))
+        except ValueError:
+            raise BulkAwardError('"{}" is not a character id'.format(value))
+    return character_ids
+
+
+def grant_bulk_award(character_ids, award_type_id, amount, reason, award_date=None, dry_run=False, commit=True):
+    """
+    Grant the same award to every character of a roster in one transaction
+
+    Nothing is written when any character does not exist. Returns a
+    BulkAwardResult; with dry_run it only reports what would be granted.
+    """
+    award_type = AwardType.query.get(award_type_id)
+    if award_type is None:
+        raise BulkAwardError('Unknown award type: {}'.format(award_type_id))
+    if not amount:
+        raise BulkAwardError('Amount must not be zero')
+
+    unique_ids = []
+    seen = set()
+    duplicates = []
+    for character_id in character_ids:
+        if character_id in seen:
+            duplicates.append(character_id)
+        else:
+            seen.add(character_id)
+            unique_ids.append(character_id)
+
+    characters = Character.__table__
+    found = {}
+    for chunk in _chunks(unique_ids):
+        for row in db.session.execute(select([characters.c.id, characters.c.character_name, characters.c.user_id])
+                                      .where(characters.c.id.in_(chunk))):
+            found[row[0]] = AwardGrant(*row)
+    grants = [found[character_id] for character_id in unique_ids if character_id in found]
+    missing = [character_id for character_id in unique_ids if character_id not in found]
+
+    result = BulkAwardResult(award_type, amount, reason, grants, missing, duplicates, dry_run)
+    if dry_run:
+        return result
+    if missing:
+        raise BulkAwardError('Unknown characters: {}'.format(', '.join(str(id) for id in missing)))
+    if not grants:
+        raise BulkAwardError('The roster is empty')
+
+    award_date = award_date or datetime.datetime.utcnow()
+    db.session.execute(AwardLog.__table__.insert(), [
+        {'user_id': grant.user_id, 'character_id': grant.character_id, 'award_type_id': award_type.id,
+         'award_date': award_date, 'amount': amount, 'reason': reason} for grant in grants])
+    apply_award_deltas(db.session.connection(),
+                       dict(((grant.user_id, grant.character_id, award_type.id), amount) for grant in grants))
+    if commit:
+        db.session.commit()
+    return result
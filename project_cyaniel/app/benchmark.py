@@ -0,0 +1,201 @@
+import json
+import time
+
+from flask import current_app, url_for
+from sqlalchemy import func, select
+
+from . import db
+from .instrumentation import count_queries, percentile
+from .jobs import export_path
+from .models import BucketTicket, Character, Job, JobStatus, Role, User, character_attributes, ticket_comments
+
+
+# Route benchmarks
+#
+# Drives every GET route of the app's blueprints through the test client as
+# a logged-in admin and records latency and query counts per endpoint. Run it
+# against a database filled by flask generate-data, save the results as a
+# baseline, and later runs report the endpoints that got slower or started
+# issuing more queries.
+
+# routes that change data when requested
+UNSAFE_ENDPOINTS = ('auth.logout',)
+UNSAFE_PREFIXES = ('delete_', 'reset_')
+
+# url argument or endpoint keyword -> sample name, the first match wins;
+# admins cannot be edited, so user routes get a regular player
+ARGUMENT_SAMPLES = (
+    ('character', 'character'),
+    ('role', 'role'),
+    ('user', 'player'),
+    ('bucket', 'bucket'),
+    ('ticket', 'ticket'),
+    ('download_job', 'export_job'),
+    ('job', 'job'),
+    ('format', 'format'),
+)
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when the database has nothing to benchmark against, or a route has an argument without a sample
+    """
+
+
+def sample_ids():
+    """
+    Pick the rows routes are benchmarked with
+
+    The admin is who the benchmark logs in as, the character is the one with
+    the largest sheet, the bucket and ticket are the ones with the most
+    tickets and comments. Jobs only exist once one was queued, and the export
+    job only once an export ran, so their samples may be None.
+    """
+    admin = db.session.execute(select([func.min(User.id)]).where(User.is_admin.is_(True))).scalar()
+    if admin is None:
+        raise BenchmarkError('No admin user found, run flask generate-data first')
+    character = db.session.execute(select([character_attributes.c.character_id])
+                                   .group_by(character_attributes.c.character_id)
+                                   .order_by(func.count().desc()).limit(1)).scalar()
+    if character is None:
+        character = db.session.execute(select([func.max(Character.id)])).scalar()
+    tickets = BucketTicket.__table__
+    export_jobs = Job.query.filter(Job.name == 'export_characters', Job.status == JobStatus.SUCCEEDED) \
+        .order_by(Job.id.desc()).limit(10).all()
+    return {
+        'user': admin,
+        'player': db.session.execute(select([func.max(User.id)]).where(User.is_admin.is_(False))).scalar(),
+        'character': character,
+        'role': db.session.execute(select([func.max(Role.id)])).scalar(),
+        'bucket': db.session.execute(select([tickets.c.bucket_id]).group_by(tickets.c.bucket_id)
+                                     .order_by(func.count().desc()).limit(1)).scalar(),
+        'ticket': db.session.execute(select([ticket_comments.c.ticket_id]).group_by(ticket_comments.c.ticket_id)
+                                     .order_by(func.count().desc()).limit(1)).scalar(),
+        'job': db.session.execute(select([func.max(Job.id)])).scalar(),
+        'export_job': next((job.id for job in export_jobs if export_path(job) is not None), None),
+        'format': 'csv',
+    }
+
+
+def _sample_for(endpoint, argument):
+    name = argument[:-3] if argument.endswith('_id') else argument
+    if argument == 'id':
+        name = endpoint.rsplit('.', 1)[-1]
+    for keyword, sample in ARGUMENT_SAMPLES:
+        if keyword in name:
+            return sample
+    return None
+
+
+def benchmark_routes(app, samples):
+    """
+    List (endpoint, url) for every safe GET route, and the endpoints skipped because a sample has no row
+
+    Raises BenchmarkError for a route with an argument ARGUMENT_SAMPLES does not cover.
+    """
+    routes = []
+    skipped = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.endpoint):
+            endpoint = rule.endpoint
+            view = endpoint.rsplit('.', 1)[-1]
+            if '.' not in endpoint or view == 'static' or 'GET' not in rule.methods or \
+                    endpoint in UNSAFE_ENDPOINTS or view.startswith(UNSAFE_PREFIXES):
+                continue
+            values = {}
+            for argument in rule.arguments:
+                sample = _sample_for(endpoint, argument)
+                if sample is None:
+                    raise BenchmarkError('No sample for the {0} argument of {1}, add one to ARGUMENT_SAMPLES'
+                                         .format(argument, endpoint))
+                if samples.get(sample) is None:
+                    break
+                values[argument] = samples[sample]
+            else:
+                routes.append((endpoint, url_for(endpoint, **values)))
+                continue
+            skipped.append(endpoint)
+    return routes, skipped
+
+
+def _request(client, url):
+    response = client.get(url)
+    # streamed exports only run their queries as the body is read
+    response.get_data()
+    response.close()
+    return response
+
+
+def run_benchmark(iterations=20, blueprints=None):
+    """
+    Request every route iterations times after one warm-up request
+
+    Returns a (results, skipped) pair, results mapping endpoint to its url,
+    status, query count and latency percentiles in milliseconds.
+    """
+    app = current_app._get_current_object()
+    samples = sample_ids()
+    routes, skipped = benchmark_routes(app, samples)
+    if blueprints:
+        routes = [(endpoint, url) for endpoint, url in routes if endpoint.split('.', 1)[0] in blueprints]
+        skipped = [endpoint for endpoint in skipped if endpoint.split('.', 1)[0] in blueprints]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(samples['user'])
+        session['_fresh'] = True
+
+    results = {}
+    for endpoint, url in routes:
+        response = _request(client, url)
+        durations = []
+        queries = []
+        for n in range(iterations):
+            with count_queries() as counter:
+                started = time.time()
+                response = _request(client, url)
+                durations.append((time.time() - started) * 1000)
+            queries.append(counter.count)
+        durations.sort()
+        results[endpoint] = {
+            'url': url,
+            'status': response.status_code,
+            'queries': max(queries) if queries else 0,
+            'p50_ms': round(percentile(durations, 0.5), 2),
+            'p95_ms': round(percentile(durations, 0.95), 2),
+        }
+    return results, skipped
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, tolerance=0.25, slack_ms=2.0):
+    """
+    List the regressions of results against a baseline
+
+    Any increase in query count is a regression. A median latency above the
+    baseline by more than tolerance and slack_ms is too; the slack keeps
+    timer noise on very fast routes from failing the comparison.
+    """
+    regressions = []
+    for endpoint, result in sorted(results.items()):
+        previous = baseline.get(endpoint)
+        if previous is None:
+            continue
+        if result['status'] != previous['status']:
+            regressions.append('{0}: status {1}, was {2}'.format(endpoint, result['status'], previous['status']))
+        if result['queries'] > previous['queries']:
+            regressions.append('{0}: {1} queries, was {2}'.format(endpoint, result['queries'], previous['queries']))
+        limit = previous['p50_ms'] * (1 + tolerance) + slack_ms
+        if result['p50_ms'] > limit:
+            regressions.append('{0}: p50 {1:.1f} ms, was {2:.1f} ms'.format(
+                endpoint, result['p50_ms'], previous['p50_ms']))
+    return regressions
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from flask import current_app, g, has_app_context, has_request_context
+
+from . import db
+from .models import AdvancementList, AdvancementListAttribute, Attribute, AttributeType, Items, \
+    advancement_list_requirements
+from .versions import get_version, track_versions
+
+
+# Rules catalog cache
+#
+# Attributes, attribute types, items and advancement lists only change a few
+# times a season. Each worker loads them once into immutable tuples keyed by id
+# and by name, and reloads only when the "catalog" data version moves. The
+# version is read at most once per request.
+
+CATALOG_VERSION = 'catalog'
+
+for _model in (Attribute, AttributeType, Items, AdvancementList, AdvancementListAttribute):
+    track_versions(_model, CATALOG_VERSION)
+
+AttributeTypeEntry = namedtuple('AttributeTypeEntry', ['id', 'name'])
+AttributeEntry = namedtuple('AttributeEntry', ['id', 'name', 'description', 'attribute_type_id'])
+ItemEntry = namedtuple('ItemEntry', ['id', 'name', 'description', 'item_attr', 'last_update'])
+AdvancementListEntry = namedtuple('AdvancementListEntry', ['id', 'name', 'is_chargen_only', 'is_staff_only',
+                                                           'option_ids'])
+AdvancementOptionEntry = namedtuple('AdvancementOptionEntry', ['id', 'advancement_list_id', 'attribute_id',
+                                                               'is_staff_only', 'is_free_with_requirements',
+                                                               'requirements'])
+RequirementEntry = namedtuple('RequirementEntry', ['attribute_id', 'rank'])
+
+
+class CatalogTable(object):
+    """
+    An immutable set of catalog entries indexed by id and by name
+    """
+
+    def __init__(self, entries, name_field='name'):
+        self.by_id = MappingProxyType(OrderedDict((entry.id, entry) for entry in entries))
+        if name_field is None:
+            self.by_name = MappingProxyType({})
+        else:
+            self.by_name = MappingProxyType(dict((getattr(entry, name_field), entry) for entry in entries))
+
+    def get(self, id):
+        return self.by_id.get(id)
+
+    def named(self, name):
+        return self.by_name.get(name)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, id):
+        return id in self.by_id
+
+
+class Catalog(object):
+    """
+    A snapshot of the rules catalog at one data version
+    """
+
+    def __init__(self, version, attribute_types, attributes, items, advancement_lists, advancement_options):
+        self.version = version
+        self.attribute_types = attribute_types
+        self.attributes = attributes
+        self.items = items
+        self.advancement_lists = advancement_lists
+        self.advancement_options = advancement_options
+
+    def list_options(self, list_id):
+        """
+        The options of one advancement list, in id order
+        """
+        advancement_list = self.advancement_lists.get(list_id)
+        if advancement_list is None:
+            return ()
+        return tuple(self.advancement_options.get(id) for id in advancement_list.option_ids)
+
+
+def load_catalog():
+    """
+    Read the whole catalog from the database
+    """
+    version = get_version(CATALOG_VERSION)
+
+    attribute_types = CatalogTable([AttributeTypeEntry(*row) for row in db.session.query(
+        AttributeType.id, AttributeType.name).order_by(AttributeType.id)])
+
+    attributes = CatalogTable([AttributeEntry(*row) for row in db.session.query(
+        Attribute.id, Attribute.attribute_name, Attribute.description, Attribute.attribute_type_id)
+        .order_by(Attribute.id)])
+
+    items = CatalogTable([ItemEntry(*row) for row in db.session.query(
+        Items.id, Items.item_name, Items.description, Items.item_attr, Items.last_update)
+        .order_by(Items.id)])
+
+    requirements = {}
+    for option_id, attribute_id, rank in db.session.query(
+            advancement_list_requirements.c.advancement_list_attribute_id,
+            advancement_list_requirements.c.attribute_requirement_id,
+            advancement_list_requirements.c.requirement_rank):
+        if option_id is not None and attribute_id is not None:
+            requirements.setdefault(option_id, []).append(RequirementEntry(attribute_id, rank))
+
+    option_ids = {}
+    options = []
+    for row in db.session.query(AdvancementListAttribute.id,
+                                AdvancementListAttribute.advancement_list_id,
+                                AdvancementListAttribute.attribute_id,
+                                AdvancementListAttribute.is_staff_only,
+                                AdvancementListAttribute.is_free_with_requirements) \
+            .order_by(AdvancementListAttribute.id):
+        option_ids.setdefault(row.advancement_list_id, []).append(row.id)
+        options.append(AdvancementOptionEntry(row.id, row.advancement_list_id, row.attribute_id,
+                                              bool(row.is_staff_only), bool(row.is_free_with_requirements),
+                                              tuple(requirements.get(row.id, ()))))
+    advancement_options = CatalogTable(options, name_field=None)
+
+    advancement_lists = CatalogTable([AdvancementListEntry(row.id, row.name, bool(row.is_chargen_only),
+                                                           bool(row.is_staff_only), tuple(option_ids.get(row.id, ())))
+                                      for row in db.session.query(AdvancementList.id,
+                                                                  AdvancementList.name,
+                                                                  AdvancementList.is_chargen_only,
+                                                                  AdvancementList.is_staff_only)
+                                     .order_by(AdvancementList.id)])
+
+    return Catalog(version, attribute_types, attributes, items, advancement_lists, advancement_options)
+
+
+_catalog = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_version():
+    """
+    Read the catalog version, skipping the read if it was checked less than
+    CATALOG_CHECK_INTERVAL seconds ago
+    """
+    global _checked_at
+
+    interval = current_app.config.get('CATALOG_CHECK_INTERVAL', 0) if has_app_context() else 0
+    now = time.time()
+    if _catalog is not None and interval and now - _checked_at < interval:
+        return _catalog.version
+    _checked_at = now
+    return get_version(CATALOG_VERSION)
+
+
+def get_catalog():
+    """
+    Return the catalog for this worker, reloading it if another process changed it
+    """
+    global _catalog
+
+    if has_request_context() and 'catalog' in g:
+        return g.catalog
+
+    catalog = _catalog
+    version = _current_version()
+    if catalog is None or catalog.version != version:
+        with _lock:
+            catalog = _catalog
+            if catalog is None or catalog.version != version:
+                catalog = load_catalog()
+                _catalog = catalog
+
+    if has_request_context():
+        g.catalog = catalog
+    return catalog
+
+
+def clear_catalog():
+    """
+    Forget the loaded catalog so the next get_catalog call reloads it
+    """
+    global _catalog
+
+    with _lock:
+        _catalog = None
@@ -0,0 +1,327 @@
+import json
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import assets, awards, benchmark, exports, history, jobs, queryplans, search, seed, snapshots, synthetic
+from .models import AwardType, JobStatus
+
+
+# Flask CLI commands, registered on the app in create_app
+
+
+@click.command('seed-catalog')
+@click.option('--file', 'path', default=seed.DEFAULT_CATALOG_FILE, show_default=True,
+              type=click.Path(exists=True, dir_okay=False), help='Declarative catalog data file.')
+@with_appcontext
+def seed_catalog(path):
+    """
+    Seed attribute types, attributes and advancement lists from a catalog file
+    """
+    started = time.time()
+    try:
+        report = seed.seed_catalog(seed.load_catalog_file(path))
+    except seed.SeedError as error:
+        raise click.ClickException(str(error))
+    for stage, count, seconds in report:
+        click.echo('{0:<26} {1:>5} inserted  {2:8.1f} ms'.format(stage, count, seconds * 1000))
+    click.echo('Catalog seeded in {0:.1f} ms'.format((time.time() - started) * 1000))
+
+
+@click.command('reconcile-award-balances')
+@with_appcontext
+def reconcile_award_balances():
+    """
+    Rebuild the award balance table from the award log
+    """
+    started = time.time()
+    count = awards.reconcile_award_balances()
+    click.echo('Rebuilt {0} award balances in {1:.1f} ms'.format(count, (time.time() - started) * 1000))
+
+
+@click.command('grant-awards')
+@click.argument('character_ids', nargs=-1, type=int)
+@click.option('--csv', 'csv_file', type=click.File(encoding='utf-8-sig'),
+              help='Roster CSV with a character_id column, or one id per line.')
+@click.option('--award-type', required=True, help='Award type name, such as Experience.')
+@click.option('--amount', required=True, type=int)
+@click.option('--reason', required=True)
+@click.option('--dry-run', is_flag=True, help='Only show what would be granted.')
+@with_appcontext
+def grant_awards(character_ids, csv_file, award_type, amount, reason, dry_run):
+    """
+    Grant the same award to every character of a roster in one transaction
+    """
+    award_type_row = AwardType.query.filter_by(name=award_type).first()
+    if award_type_row is None:
+        raise click.ClickException('Unknown award type: {}'.format(award_type))
+
+    started = time.time()
+    try:
+        roster = list(character_ids)
+        if csv_file is not None:
+            roster += awards.parse_roster(csv_file.read())
+        result = awards.grant_bulk_award(roster, award_type_row.id, amount, reason, dry_run=dry_run)
+    except awards.BulkAwardError as error:
+        raise click.ClickException(str(error))
+
+    if result.duplicates:
+        click.echo('Listed more than once, granted once: {}'.format(', '.join(map(str, result.duplicates))))
+    if dry_run:
+        for grant in result.grants:
+            click.echo('{0:>8}  {1}'.format(grant.character_id, grant.character_name))
+        if result.missing:
+            click.echo('Unknown characters: {}'.format(', '.join(map(str, result.missing))))
+        click.echo('Would grant {0} {1} to {2} characters'.format(amount, award_type_row.name, len(result.grants)))
+    else:
+        click.echo('Granted {0} {1} to {2} characters in {3:.1f} ms'.format(
+            amount, award_type_row.name, len(result.grants), (time.time() - started) * 1000))
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print the plan of every statement.')
+@with_appcontext
+def check_query_plans(verbose):
+    """
+    EXPLAIN the app's key queries and fail if any of them scans a whole table
+    """
+    try:
+        checks, skipped = queryplans.check_query_plans()
+    except queryplans.QueryPlansUnavailable as error:
+        raise click.ClickException(str(error))
+    failures = [check for check in checks if check.full_scans]
+    for check in checks:
+        if verbose or check.full_scans:
+            status = 'FULL SCAN of {}'.format(', '.join(check.full_scans)) if check.full_scans else 'ok'
+            click.echo('{0}: {1}\n  {2}\n    {3}'.format(check.query, status, ' '.join(check.statement.split()),
+                                                       '\n    '.join(check.plan)))
+    for name in skipped:
+        click.echo('{}: skipped, no sample rows to run against'.format(name))
+    click.echo('Checked {0} statements from {1} key queries, {2} skipped'.format(
+        len(checks), len(queryplans.KEY_QUERIES) - len(skipped), len(skipped)))
+    if failures:
+        raise click.ClickException('{} statements fall back to a full table scan'.format(len(failures)))
+
+
+@click.command('generate-data')
+@click.option('--users', default=200, show_default=True, help='Players to add.')
+@click.option('--characters', default=500, show_default=True, help='Characters to add.')
+@click.option('--skills', default=40, show_default=True, help='Mean attributes per character.')
+@click.option('--awards', default=30, show_default=True, help='Mean award log rows per character.')
+@click.option('--items', default=10, show_default=True, help='Mean inventory rows per character.')
+@click.option('--tickets', default=300, show_default=True, help='Tickets to add.')
+@click.option('--comments', default=4, show_default=True, help='Mean comments per ticket.')
+@click.option('--seed', type=int, help='Random seed for a reproducible data set.')
+@with_appcontext
+def generate_data(users, characters, skills, awards, items, tickets, comments, seed):
+    """
+    Fill the database with synthetic players, characters and tickets for benchmarking
+    """
+    started = time.time()
+    try:
+        report = synthetic.generate_data(users=users, characters=characters, skills=skills, awards=awards,
+                                         items=items, tickets=tickets, comments=comments, seed=seed)
+    except synthetic.SyntheticDataError as error:
+        raise click.ClickException(str(error))
+    for table, count, seconds in report:
+        click.echo('{0:<28} {1:>8} rows  {2:8.1f} ms'.format(table, count, seconds * 1000))
+    click.echo('Generated in {0:.1f} ms, log in as the first new player with password "{1}"'.format(
+        (time.time() - started) * 1000, synthetic.DEFAULT_PASSWORD))
+
+
+@click.command('benchmark')
+@click.option('--iterations', default=20, show_default=True, help='Timed requests per route.')
+@click.option('--blueprint', 'blueprints', multiple=True, help='Only benchmark these blueprints.')
+@click.option('--baseline', 'baseline_path', type=click.Path(dir_okay=False),
+              help='Baseline file, defaults to benchmark_baseline.json in the instance folder.')
+@click.option('--save-baseline', is_flag=True, help='Store the results as the new baseline.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed relative p50 slowdown.')
+@with_appcontext
+def run_benchmark(iterations, blueprints, baseline_path, save_baseline, tolerance):
+    """
+    Time every GET route and compare latency and query counts against a baseline
+    """
+    baseline_path = baseline_path or os.path.join(current_app.instance_path, 'benchmark_baseline.json')
+    try:
+        results, skipped = benchmark.run_benchmark(iterations, blueprints)
+    except benchmark.BenchmarkError as error:
+        raise click.ClickException(str(error))
+
+    click.echo('{0:<32} {1:>6} {2:>8} {3:>10} {4:>10}'.format('endpoint', 'status', 'queries', 'p50 ms', 'p95 ms'))
+    for endpoint, result in sorted(results.items()):
+        click.echo('{0:<32} {status:>6} {queries:>8} {p50_ms:>10.1f} {p95_ms:>10.1f}'.format(endpoint, **result))
+    for endpoint in skipped:
+        click.echo('{}: skipped, no row to request it with'.format(endpoint))
+    if skipped:
+        raise click.ClickException('{} routes could not be benchmarked, see above'.format(len(skipped)))
+
+    if save_baseline:
+        benchmark.save_baseline(baseline_path, results)
+        click.echo('Baseline saved to {}'.format(baseline_path))
+    elif os.path.exists(baseline_path):
+        regressions = benchmark.compare(results, benchmark.load_baseline(baseline_path), tolerance)
+        for regression in regressions:
+            click.echo(regression)
+        if regressions:
+            raise click.ClickException('{} regressions against {}'.format(len(regressions), baseline_path))
+        click.echo('No regressions against {}'.format(baseline_path))
+    else:
+        click.echo('No baseline at {}, run with --save-baseline to create one'.format(baseline_path))
+
+
+@click.command('reindex-search')
+@click.option('--kind', 'kinds', multiple=True, type=click.Choice(list(search.KINDS)),
+              help='Only re-index these kinds of documents.')
+@click.option('--since', type=click.DateTime(), help='Only re-index rows changed at or after this UTC time.')
+@click.option('--batch-size', default=search.BATCH_SIZE, show_default=True, help='Rows per committed batch.')
+@with_appcontext
+def reindex_search(kinds, since, batch_size):
+    """
+    Build the full-text search index, or bring it up to date with rows changed since a date
+    """
+    started = time.time()
+    try:
+        report = search.reindex(kinds or None, since, batch_size)
+    except search.SearchUnavailable as error:
+        raise click.ClickException(str(error))
+    for kind, count in report:
+        click.echo('{0:<12} {1:>8} documents'.format(kind, count))
+    click.echo('Re-indexed in {0:.1f} ms'.format((time.time() - started) * 1000))
+
+
+@click.command('export-characters')
+@click.option('--format', 'format', type=click.Choice(sorted(exports.FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='File to write, stdout by default.')
+@click.option('--chunk-size', default=exports.CHUNK_SIZE, show_default=True, help='Rows fetched per round trip.')
+@with_appcontext
+def export_characters(format, output, chunk_size):
+    """
+    Write every character with their attributes as CSV or NDJSON
+    """
+    for line in exports.stream_export(format, chunk_size):
+        output.write(line)
+
+
+@click.command('snapshot')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--since-snapshot', 'base_path', type=click.Path(exists=True, dir_okay=False),
+              help='Write a delta on top of this snapshot instead of a full snapshot.')
+@with_appcontext
+def write_snapshot(output, base_path):
+    """
+    Write an offline SQLite snapshot of players, characters and the catalog, or a delta since an older one
+    """
+    started = time.time()
+    since = catalog_version = None
+    try:
+        if base_path:
+            since, catalog_version = snapshots.delta_base(snapshots.read_info(base_path))
+        report = snapshots.write_snapshot(output, since, catalog_version)
+    except snapshots.SnapshotError as error:
+        raise click.ClickException(str(error))
+    for table, count in report:
+        click.echo('{0:<22} {1:>8} rows'.format(table, count))
+    click.echo('Wrote {0} ({1:.1f} kB) in {2:.1f} ms'.format(
+        output, os.path.getsize(output) / 1024.0, (time.time() - started) * 1000))
+
+
+@click.command('apply-snapshot-delta')
+@click.argument('snapshot', type=click.Path(exists=True, dir_okay=False))
+@click.argument('delta', type=click.Path(exists=True, dir_okay=False))
+def apply_snapshot_delta(snapshot, delta):
+    """
+    Bring an offline snapshot up to date with a delta
+    """
+    try:
+        info = snapshots.apply_delta(snapshot, delta)
+    except snapshots.SnapshotError as error:
+        raise click.ClickException(str(error))
+    click.echo('{} is now current as of {}'.format(snapshot, info['generated_at']))
+
+
+@click.command('snapshot-attribute-history')
+@with_appcontext
+def snapshot_attribute_history():
+    """
+    Snapshot every character's attribute ranks, so past sheets rebuild from a short tail of changes
+    """
+    started = time.time()
+    count = history.snapshot_all()
+    click.echo('Took {0} snapshots in {1:.1f} ms'.format(count, (time.time() - started) * 1000))
+
+
+@click.command('build-assets')
+@click.option('--widths', default=','.join(map(str, assets.DEFAULT_WIDTHS)), show_default=True,
+              help='Comma separated widths of the resized image variants.')
+@with_appcontext
+def build_assets(widths):
+    """
+    Write fingerprinted, precompressed static files and image variants to static/dist
+    """
+    try:
+        widths = tuple(int(width) for width in widths.split(',') if width.strip())
+    except ValueError:
+        raise click.BadParameter('widths must be comma separated numbers', param_hint='--widths')
+    started = time.time()
+    report = assets.build_assets(current_app.static_folder, widths)
+    for name, hashed, size, compressed in report:
+        click.echo('{0:<48} {1:>9} B  {2}'.format(hashed, size, '  '.join(
+            '{0} {1} B'.format(encoding, compressed_size) for encoding, compressed_size in sorted(compressed.items()))))
+    if assets.brotli is None:
+        click.echo('brotli is not installed, only gzip copies were written')
+    click.echo('Built {0} files in {1:.1f} ms'.format(len(report), (time.time() - started) * 1000))
+
+
+@click.command('run-jobs')
+@click.option('--threads', default=None, type=click.IntRange(1),
+              help='Jobs run at once, JOB_WORKER_THREADS by default.')
+@click.option('--once', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+@with_appcontext
+def run_jobs(threads, once):
+    """
+    Run queued background jobs until interrupted
+    """
+    app = current_app._get_current_object()
+    threads = threads or app.config.get('JOB_WORKER_THREADS', 2)
+    worker = jobs.Worker(app, threads=threads, once=once)
+    click.echo('Worker {0} running jobs on {1} threads'.format(worker.name, threads))
+    for job_id, status in worker.run():
+        click.echo('Job {0:>6} {1}'.format(job_id, JobStatus.NAMES.get(status, 'Lost its lease')))
+
+
+@click.command('enqueue-job')
+@click.argument('name', type=click.Choice(sorted(jobs.TASKS)))
+@click.option('--payload', default='{}', show_default=True, help='Keyword arguments of the task as JSON.')
+@click.option('--priority', type=int, help='Higher runs first, the task\'s priority by default.')
+@with_appcontext
+def enqueue_job(name, payload, priority):
+    """
+    Queue a background job for flask run-jobs
+    """
+    try:
+        payload = json.loads(payload)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='--payload')
+    if not isinstance(payload, dict):
+        raise click.BadParameter('must be a JSON object', param_hint='--payload')
+    click.echo('Queued job {}'.format(jobs.enqueue(name, payload, priority=priority)))
+
+
+def init_app(app):
+    app.cli.add_command(seed_catalog)
+    app.cli.add_command(reconcile_award_balances)
+    app.cli.add_command(grant_awards)
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(generate_data)
+    app.cli.add_command(run_benchmark)
+    app.cli.add_command(reindex_search)
+    app.cli.add_command(export_characters)
+    app.cli.add_command(write_snapshot)
+    app.cli.add_command(apply_snapshot_delta)
+    app.cli.add_command(snapshot_attribute_history)
+    app.cli.add_command(build_assets)
+    app.cli.add_command(run_jobs)
+    app.cli.add_command(enqueue_job)
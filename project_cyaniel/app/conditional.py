@@ -0,0 +1,56 @@
+import datetime
+import hashlib
+
+from flask import current_app, request
+
+
+# Conditional GET
+#
+# Views that can tell whether a resource changed without building it compute
+# an ETag and Last-Modified first and return not_modified() when the client's
+# copy is current. HTTP dates have a resolution of one second. A resource
+# with an ETag is only fresh by If-None-Match: its ETag also covers changes
+# no date records, such as a catalog rename showing up in a sheet.
+
+
+def make_etag(*parts):
+    """
+    A strong ETag value from the repr of the values that version a resource
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _utc(date):
+    if date.tzinfo is None:
+        return date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def is_fresh(etag=None, last_modified=None):
+    """
+    Whether the request's If-None-Match, or If-Modified-Since without an etag, says the client has this version
+    """
+    if etag is not None:
+        return bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return _utc(last_modified).replace(microsecond=0) <= _utc(request.if_modified_since)
+    return False
+
+
+def set_validators(response, etag, last_modified=None, cache_control='private, no-cache'):
+    """
+    Add ETag, Last-Modified and Cache-Control headers to a response
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _utc(last_modified)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified(etag, last_modified=None, cache_control='private, no-cache'):
+    """
+    An empty 304 response carrying the validators
+    """
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified, cache_control)
@@ -0,0 +1,216 @@
+import re
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# Database engine and connection pool
+#
+# Every config class sets the pool through the DATABASE_* settings below.
+# create_app validates them and turns them into SQLALCHEMY_ENGINE_OPTIONS, so
+# a typo or a negative pool size fails at startup rather than under load. All
+# file databases, SQLite included, use InstrumentedQueuePool, which records
+# how long checkouts wait for a connection. Postgres and MySQL connections get
+# a per-session statement timeout. SQLite connections get
+# DATABASE_SQLITE_PRAGMAS instead: WAL lets readers work while a write is in
+# progress, which is plenty for a small chapter running on one machine.
+
+# setting -> (type, minimum)
+POOL_SETTINGS = {
+    'DATABASE_POOL_SIZE': (int, 1),
+    'DATABASE_MAX_OVERFLOW': (int, 0),
+    'DATABASE_POOL_TIMEOUT': ((int, float), 0),
+    'DATABASE_POOL_RECYCLE': (int, -1),
+    'DATABASE_STATEMENT_TIMEOUT': ((int, float), 0),
+}
+# pragma -> allowed values, None for any non-negative integer
+SQLITE_PRAGMAS = {
+    'journal_mode': ('delete', 'truncate', 'persist', 'memory', 'wal', 'off'),
+    'synchronous': ('off', 'normal', 'full', 'extra'),
+    'temp_store': ('default', 'file', 'memory'),
+    'foreign_keys': ('on', 'off'),
+    'busy_timeout': None,
+    'cache_size': None,
+    'mmap_size': None,
+    'wal_autocheckpoint': None,
+}
+
+_in_memory = re.compile(r'^(|:memory:|file::memory:.*)$')
+
+
+class EngineConfigError(ValueError):
+    """
+    Raised by create_app when the database settings of a config class are invalid
+    """
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that counts checkouts, timeouts and the time spent waiting for a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._waiting = threading.local()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        # QueuePool._do_get calls itself when it loses a race for an overflow slot
+        if getattr(self._waiting, 'active', False):
+            return super(InstrumentedQueuePool, self)._do_get()
+        self._waiting.active = True
+        started = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._waiting.active = False
+            waited = time.time() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def recreate(self):
+        # dispose() and pre-ping invalidation swap in a fresh pool, the counters carry over
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_time, pool.max_wait = self.wait_time, self.max_wait
+        return pool
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'idle': self.checkedin(),
+                # negative while the pool has not opened all of its size yet
+                'overflow': max(0, self.overflow()),
+                'max_overflow': self._max_overflow,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_avg': self.wait_time * 1000 / self.checkouts if self.checkouts else 0.0,
+                'wait_ms_max': self.max_wait * 1000,
+            }
+
+
+def _check_setting(config, name):
+    types, minimum = POOL_SETTINGS[name]
+    value = config.get(name)
+    if isinstance(value, bool) or not isinstance(value, types) or value < minimum:
+        raise EngineConfigError('{0} must be a number of at least {1}, got {2!r}'.format(name, minimum, value))
+    return value
+
+
+def sqlite_pragmas(config):
+    """
+    The validated DATABASE_SQLITE_PRAGMAS as a list of (pragma, value) pairs
+    """
+    pragmas = config.get('DATABASE_SQLITE_PRAGMAS') or {}
+    if not isinstance(pragmas, dict):
+        raise EngineConfigError('DATABASE_SQLITE_PRAGMAS must be a dict, got {!r}'.format(pragmas))
+    validated = []
+    for pragma, value in sorted(pragmas.items()):
+        if pragma not in SQLITE_PRAGMAS:
+            raise EngineConfigError('Unsupported SQLite pragma {0!r}, expected one of {1}'.format(
+                pragma, ', '.join(sorted(SQLITE_PRAGMAS))))
+        allowed = SQLITE_PRAGMAS[pragma]
+        if allowed is None:
+            # cache_size takes negative values, meaning KiB rather than pages
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0 and pragma != 'cache_size':
+                raise EngineConfigError('SQLite pragma {0} must be an integer, got {1!r}'.format(pragma, value))
+        elif str(value).lower() not in allowed:
+            raise EngineConfigError('SQLite pragma {0} must be one of {1}, got {2!r}'.format(
+                pragma, ', '.join(allowed), value))
+        else:
+            value = str(value).lower()
+        validated.append((pragma, value))
+    return validated
+
+
+def _pragma_hook(pragmas):
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas:
+                cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+        finally:
+            cursor.close()
+
+    return apply_pragmas
+
+
+def engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DATABASE_* settings of a config
+
+    Options already in SQLALCHEMY_ENGINE_OPTIONS are kept unless a setting
+    overrides them. Raises EngineConfigError for missing, mistyped or out of
+    range settings.
+    """
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if not uri:
+        raise EngineConfigError('SQLALCHEMY_DATABASE_URI is not set')
+    url = make_url(uri)
+    settings = dict((name, _check_setting(config, name)) for name in POOL_SETTINGS)
+    pre_ping = config.get('DATABASE_POOL_PRE_PING')
+    if not isinstance(pre_ping, bool):
+        raise EngineConfigError('DATABASE_POOL_PRE_PING must be True or False, got {!r}'.format(pre_ping))
+
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    connect_args = dict(options.get('connect_args', {}))
+    timeout_ms = int(settings['DATABASE_STATEMENT_TIMEOUT'] * 1000)
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        pragmas = sqlite_pragmas(config)
+        if pragmas:
+            options['pool_events'] = list(options.get('pool_events', ())) + [(_pragma_hook(pragmas), 'connect')]
+        if _in_memory.match(url.database or ''):
+            # Flask-SQLAlchemy keeps in-memory databases on a single shared connection
+            return options
+        # pooled connections move between threads, one thread uses them at a time
+        connect_args['check_same_thread'] = False
+    elif timeout_ms and backend == 'postgresql':
+        connect_args['options'] = '{0} -c statement_timeout={1}'.format(
+            connect_args.get('options', ''), timeout_ms).strip()
+    elif timeout_ms and backend == 'mysql':
+        # MySQL only bounds SELECTs, there is no timeout for writes
+        connect_args['init_command'] = 'SET SESSION max_execution_time = {}'.format(timeout_ms)
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    options.update({
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': settings['DATABASE_POOL_SIZE'],
+        'max_overflow': settings['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': settings['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': settings['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': pre_ping,
+    })
+    return options
+
+
+def init_app(app):
+    """
+    Validate the database settings of app and set its SQLALCHEMY_ENGINE_OPTIONS, before db.init_app
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+
+def pool_stats(engine):
+    """
+    Checkout and overflow counts of an engine's pool, None for pools that are not instrumented
+    """
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        return engine.pool.stats()
+    return None
@@ -0,0 +1,19 @@
+import inspect
+
+from flask import send_file
+
+
+# File downloads
+#
+# send_file names the saved file with download_name from Flask 2.0 on, and
+# with attachment_filename before it.
+
+_NAME_ARGUMENT = 'download_name' if 'download_name' in inspect.signature(send_file).parameters \
+    else 'attachment_filename'
+
+
+def send_download(path_or_file, name, mimetype=None):
+    """
+    Send a file as an attachment saved under the given name
+    """
+    return send_file(path_or_file, mimetype=mimetype, as_attachment=True, **{_NAME_ARGUMENT: name})
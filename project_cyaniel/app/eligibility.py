@@ -0,0 +1,196 @@
+import threading
+from collections import namedtuple
+
+from . import db
+from .catalog import get_catalog
+from .models import character_attributes
+
+
+# Advancement eligibility engine
+#
+# Every advancement list is compiled from the cached rules catalog into a
+# requirement index: each attribute that appears as a requirement gets a bit,
+# and each option stores the mask of attributes it needs. Checking a character
+# against a list is then one query for the character's ranks and a mask test
+# per option.
+
+EligibleOption = namedtuple('EligibleOption', ['option_id', 'attribute_id', 'is_free'])
+
+
+class _IndexedOption(object):
+    """
+    A compiled AdvancementListAttribute
+    """
+
+    __slots__ = ('id', 'attribute_id', 'is_staff_only', 'is_free_with_requirements',
+                 'mask', 'ranked')
+
+    def __init__(self, id, attribute_id, is_staff_only, is_free_with_requirements):
+        self.id = id
+        self.attribute_id = attribute_id
+        self.is_staff_only = is_staff_only
+        self.is_free_with_requirements = is_free_with_requirements
+        # bits of every required attribute
+        self.mask = 0
+        # (attribute id, rank) pairs that need more than just holding the attribute
+        self.ranked = ()
+
+
+class ListRequirementIndex(object):
+    """
+    The precomputed requirements of every option in one advancement list
+    """
+
+    def __init__(self, list_id, is_chargen_only, is_staff_only, options, requirements, version=None):
+        self.list_id = list_id
+        self.version = version
+        self.is_chargen_only = is_chargen_only
+        self.is_staff_only = is_staff_only
+        self.bits = {}
+
+        by_id = {}
+        for option in options:
+            by_id[option.id] = option
+
+        ranked = {}
+        for option_id, attribute_id, rank in requirements:
+            option = by_id.get(option_id)
+            if option is None or attribute_id is None:
+                continue
+            bit = self.bits.setdefault(attribute_id, 1 << len(self.bits))
+            option.mask |= bit
+            if rank is not None and rank > 1:
+                ranked.setdefault(option_id, []).append((attribute_id, rank))
+
+        for option_id, pairs in ranked.items():
+            by_id[option_id].ranked = tuple(pairs)
+
+        self.options = tuple(options)
+
+    def held_mask(self, ranks):
+        """
+        Build the mask of required attributes a character holds from an attribute id -> rank map
+        """
+        mask = 0
+        for attribute_id, rank in ranks.items():
+            bit = self.bits.get(attribute_id)
+            if bit is not None and (rank is None or rank > 0):
+                mask |= bit
+        return mask
+
+    def eligible(self, ranks, chargen=False, staff=False):
+        """
+        Return the EligibleOptions open to a character with the given ranks
+        """
+        if self.is_chargen_only and not chargen:
+            return []
+        if self.is_staff_only and not staff:
+            return []
+
+        held = self.held_mask(ranks)
+        eligible = []
+        for option in self.options:
+            if option.is_staff_only and not staff:
+                continue
+            if option.mask & ~held:
+                continue
+            if any((ranks.get(attribute_id) or 0) < rank for attribute_id, rank in option.ranked):
+                continue
+            eligible.append(EligibleOption(option.id, option.attribute_id,
+                                           option.is_free_with_requirements and option.mask != 0))
+        return eligible
+
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def build_list_index(list_id, catalog=None):
+    """
+    Compile the requirement index for an advancement list, or return None if it does not exist
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    advancement_list = catalog.advancement_lists.get(list_id)
+    if advancement_list is None:
+        return None
+
+    options = []
+    requirements = []
+    for option in catalog.list_options(list_id):
+        options.append(_IndexedOption(option.id, option.attribute_id, option.is_staff_only,
+                                      option.is_free_with_requirements))
+        requirements.extend((option.id, requirement.attribute_id, requirement.rank)
+                            for requirement in option.requirements)
+
+    return ListRequirementIndex(advancement_list.id, advancement_list.is_chargen_only,
+                                advancement_list.is_staff_only, options, requirements,
+                                version=catalog.version)
+
+
+def get_list_index(list_id):
+    """
+    Return the requirement index for a list, compiling it when the catalog changes
+    """
+    catalog = get_catalog()
+    index = _index_cache.get(list_id)
+    if index is None or index.version != catalog.version:
+        index = build_list_index(list_id, catalog)
+        with _index_lock:
+            if index is None:
+                _index_cache.pop(list_id, None)
+            else:
+                _index_cache[list_id] = index
+    return index
+
+
+def clear_index_cache(list_id=None):
+    """
+    Drop compiled indexes so they are rebuilt on next use
+    """
+    with _index_lock:
+        if list_id is None:
+            _index_cache.clear()
+        else:
+            _index_cache.pop(list_id, None)
+
+
+def character_ranks(character_id):
+    """
+    Fetch a character's attribute id -> rank map in one query
+    """
+    rows = db.session.query(character_attributes.c.attribute_id, character_attributes.c.rank) \
+        .filter(character_attributes.c.character_id == character_id)
+    return dict(rows)
+
+
+def eligible_options(character_id, list_id, chargen=False, staff=False, ranks=None):
+    """
+    List the options of an advancement list a character may currently pick
+
+    chargen includes lists only available during character generation, staff
+    includes staff only lists and options. Pass ranks to reuse a map already
+    fetched with character_ranks when checking several lists.
+    """
+    index = get_list_index(list_id)
+    if index is None:
+        return []
+    if ranks is None:
+        ranks = character_ranks(character_id)
+    return index.eligible(ranks, chargen=chargen, staff=staff)
+
+
+def advancement_choices(character_id, chargen=False, staff=False, ranks=None):
+    """
+    List (AdvancementListEntry, [EligibleOption]) for every advancement list with an option open to a character
+
+    The character's ranks are fetched once for all lists, or not at all when given.
+    """
+    if ranks is None:
+        ranks = character_ranks(character_id)
+    choices = []
+    for advancement_list in get_catalog().advancement_lists:
+        options = eligible_options(character_id, advancement_list.id, chargen=chargen, staff=staff, ranks=ranks)
+        if options:
+            choices.append((advancement_list, options))
+    return choices
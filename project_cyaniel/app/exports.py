@@ -0,0 +1,114 @@
+import csv
+import json
+from itertools import groupby
+
+from sqlalchemy import select
+
+from . import db
+from .models import Attribute, Character, User, character_attributes
+from .replicas import read_connection
+
+
+# Character exports
+#
+# Logistics takes a dump of every character and their skills before each
+# event. The export is one query over characters joined to their attributes,
+# ordered by character, read through a server-side cursor a chunk at a time
+# and grouped back into one record per character as it streams. Only one
+# chunk and one character are ever held in memory, whatever the population.
+
+CHUNK_SIZE = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CSV_COLUMNS = ('character_id', 'character_name', 'user_id', 'user_name', 'create_date', 'last_update', 'attributes')
+
+
+def _export_query():
+    characters = Character.__table__
+    users = User.__table__
+    attributes = Attribute.__table__
+    return select([characters.c.id, characters.c.character_name, characters.c.user_id, users.c.user_name,
+                   characters.c.create_date, characters.c.last_update,
+                   attributes.c.id.label('attribute_id'), attributes.c.attribute_name,
+                   character_attributes.c.rank]) \
+        .select_from(characters
+                     .join(users, users.c.id == characters.c.user_id)
+                     .outerjoin(character_attributes, character_attributes.c.character_id == characters.c.id)
+                     .outerjoin(attributes, attributes.c.id == character_attributes.c.attribute_id)) \
+        .order_by(characters.c.id, character_attributes.c.attribute_id)
+
+
+def _rows(chunk_size):
+    connection = read_connection(db.session).execution_options(stream_results=True)
+    result = connection.execute(_export_query())
+    try:
+        while True:
+            chunk = result.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for row in chunk:
+                yield row
+    finally:
+        result.close()
+
+
+def iter_characters(chunk_size=CHUNK_SIZE):
+    """
+    Yield one dict per character, with its attributes as a list of {id, name, rank} dicts
+    """
+    for character_id, rows in groupby(_rows(chunk_size), key=lambda row: row.id):
+        rows = list(rows)
+        first = rows[0]
+        attributes = [{'id': row.attribute_id, 'name': row.attribute_name, 'rank': row.rank}
+                      for row in rows if row.attribute_id is not None]
+        yield {
+            'character_id': character_id,
+            'character_name': first.character_name,
+            'user_id': first.user_id,
+            'user_name': first.user_name,
+            'create_date': first.create_date.isoformat() if first.create_date else None,
+            'last_update': first.last_update.isoformat() if first.last_update else None,
+            'attributes': attributes,
+        }
+
+
+class _Line(object):
+    """
+    A file-like object csv.writer writes to that hands back what was written
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(chunk_size=CHUNK_SIZE):
+    """
+    Yield the export as CSV lines, attributes flattened to "name=rank" pairs separated by semicolons
+    """
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_COLUMNS)
+    for character in iter_characters(chunk_size):
+        attributes = '; '.join('{}={}'.format(attribute['name'], attribute['rank'])
+                               for attribute in character['attributes'])
+        yield writer.writerow([character[column] for column in CSV_COLUMNS[:-1]] + [attributes])
+
+
+def stream_ndjson(chunk_size=CHUNK_SIZE):
+    """
+    Yield the export as one JSON document per line
+    """
+    for character in iter_characters(chunk_size):
+        yield json.dumps(character, sort_keys=True) + '\n'
+
+
+def stream_export(format, chunk_size=CHUNK_SIZE):
+    """
+    Yield the character export in one of FORMATS
+    """
+    if format == 'csv':
+        return stream_csv(chunk_size)
+    if format == 'ndjson':
+        return stream_ndjson(chunk_size)
+    raise ValueError('Unknown export format {}'.format(format))
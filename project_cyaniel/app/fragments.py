@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .models import Character, Role, User
+from .versions import get_versions, track_versions
+
+
+# Template fragment cache
+#
+# Templates wrap expensive blocks in {% call cache_fragment(name, key...,
+# versions=(...)) %}. The rendered HTML is kept per process, keyed by the
+# fragment name, its key values and the current value of every data version
+# it depends on, so a write to a tracked table makes every fragment built
+# from it miss on the next request. Versions are read once per request and
+# re-read after a commit. Views call fragment_versions before querying the
+# data their fragments show: read after it, a version bumped in between would
+# store stale rows under the new version. FRAGMENT_CACHE_SIZE bounds the
+# entries, 0 disables the cache.
+
+CHARACTERS_VERSION = 'characters'
+ROLES_VERSION = 'roles'
+USERS_VERSION = 'users'
+
+track_versions(Character, CHARACTERS_VERSION)
+track_versions(Role, ROLES_VERSION)
+track_versions(User, USERS_VERSION)
+
+
+class FragmentCache(object):
+    """
+    A bounded, thread safe LRU map of rendered fragments with hit and miss counts per fragment name
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def init_app(self, app):
+        app.extensions['fragment_cache'] = self
+        app.add_template_global(cache_fragment)
+
+    def get(self, name, key):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            html = self._entries.get(key)
+            if html is None:
+                counts[1] += 1
+                return None
+            self._entries.move_to_end(key)
+            counts[0] += 1
+            return html
+
+    def put(self, key, html, max_size):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counts.clear()
+
+    def stats(self):
+        """
+        Map each fragment name to its hits, misses and hit rate
+        """
+        with self._lock:
+            stats = {}
+            for name, (hits, misses) in sorted(self._counts.items()):
+                stats[name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': hits / float(hits + misses) if hits + misses else 0.0,
+                }
+            entries = len(self._entries)
+        return {'entries': entries, 'fragments': stats}
+
+
+fragment_cache = FragmentCache()
+
+
+def fragment_versions(names):
+    """
+    The current values of the named data versions, read at most once per request
+    """
+    versions = g.setdefault('fragment_versions', {})
+    missing = [name for name in names if name not in versions]
+    if missing:
+        versions.update(get_versions(missing))
+    return tuple(versions[name] for name in names)
+
+
+def cache_fragment(name, *key, **options):
+    """
+    Render the body of a {% call %} block once per key and data versions
+
+    Takes the names of the data versions the fragment depends on as
+    versions=(...), and the call block body as caller.
+    """
+    caller = options['caller']
+    max_size = current_app.config.get('FRAGMENT_CACHE_SIZE', 0)
+    if not max_size:
+        return caller()
+
+    versions = tuple(options.get('versions', ()))
+    cache_key = (name, key, versions, fragment_versions(versions))
+    html = fragment_cache.get(name, cache_key)
+    if html is None:
+        html = caller()
+        fragment_cache.put(cache_key, html, max_size)
+    return html
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_fragment_versions(session):
+    if has_request_context():
+        g.pop('fragment_versions', None)
@@ -0,0 +1,197 @@
+import datetime
+import json
+
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import joinedload
+
+from . import db
+from .models import AttributeChange, AttributeSnapshot, Character, character_attributes
+from .replicas import read_connection
+
+
+# Attribute history
+#
+# Rank changes go through set_attribute_rank, which overwrites the row in
+# character_attributes and appends the old and new rank to attribute_changes.
+# Every character's history starts with a snapshot of its ranks, and another
+# is taken after every SNAPSHOT_INTERVAL changes, so rebuilding a sheet at a
+# past date reads one snapshot and replays at most that many changes.
+# The log is append-only for as long as its character exists: deleting a
+# character deletes its changes and snapshots with it. Kept without their
+# character, they would be read as the history of any later character that
+# is given the same id, which SQLite and MySQL before 8.0 can hand out again.
+
+SNAPSHOT_INTERVAL = 25
+CHUNK_SIZE = 1000
+
+
+def current_ranks(character_id, connection=None):
+    """
+    Map attribute id to rank for the attributes a character holds now
+    """
+    executor = connection if connection is not None else db.session
+    return dict(executor.execute(select([character_attributes.c.attribute_id, character_attributes.c.rank])
+                                 .where(character_attributes.c.character_id == character_id)).fetchall())
+
+
+def _last_change_id(connection, character_id):
+    changes = AttributeChange.__table__
+    return connection.execute(select([func.max(changes.c.id)])
+                              .where(changes.c.character_id == character_id)).scalar() or 0
+
+
+def take_snapshot(character_id, connection=None):
+    """
+    Store a character's current ranks as a snapshot and return its id
+    """
+    connection = connection if connection is not None else db.session.connection()
+    result = connection.execute(AttributeSnapshot.__table__.insert().values(
+        character_id=character_id, taken_on=datetime.datetime.utcnow(),
+        last_change_id=_last_change_id(connection, character_id),
+        ranks=json.dumps(current_ranks(character_id, connection), sort_keys=True)))
+    return result.inserted_primary_key[0]
+
+
+def _latest_snapshot(connection, character_id, when=None):
+    snapshots = AttributeSnapshot.__table__
+    query = select([snapshots.c.taken_on, snapshots.c.last_change_id, snapshots.c.ranks]) \
+        .where(snapshots.c.character_id == character_id)
+    if when is not None:
+        query = query.where(snapshots.c.taken_on <= when)
+    return connection.execute(query.order_by(snapshots.c.taken_on.desc(), snapshots.c.id.desc()).limit(1)).first()
+
+
+def set_attribute_rank(character_id, attribute_id, rank, user_id=None, comments=None, commit=True):
+    """
+    Set a character's rank in an attribute and log the change, a rank of None removing the attribute
+
+    Returns the AttributeChange id, or None when the rank was already set.
+    """
+    connection = db.session.connection()
+    snapshot = _latest_snapshot(connection, character_id)
+    if snapshot is None:
+        # the history of a character starts with the ranks it had before its first logged change
+        take_snapshot(character_id, connection)
+        snapshot = _latest_snapshot(connection, character_id)
+
+    held = and_(character_attributes.c.character_id == character_id,
+                character_attributes.c.attribute_id == attribute_id)
+    row = connection.execute(select([character_attributes.c.rank]).where(held)).first()
+    old_rank = row.rank if row is not None else None
+    if row is not None and old_rank == rank or row is None and rank is None:
+        return None
+
+    now = datetime.datetime.utcnow()
+    if rank is None:
+        connection.execute(character_attributes.delete().where(held))
+    elif row is None:
+        connection.execute(character_attributes.insert().values(character_id=character_id, attribute_id=attribute_id,
+                                                                rank=rank, last_modified=now, comments=comments))
+    else:
+        values = {'rank': rank, 'last_modified': now}
+        if comments is not None:
+            values['comments'] = comments
+        connection.execute(character_attributes.update().where(held).values(**values))
+
+    changes = AttributeChange.__table__
+    change_id = connection.execute(changes.insert().values(
+        character_id=character_id, attribute_id=attribute_id, old_rank=old_rank, new_rank=rank,
+        changed_by_id=user_id, changed_on=now, comments=comments)).inserted_primary_key[0]
+    # removals leave no last_modified behind, so the sheet's change markers move through the character
+    characters = Character.__table__
+    connection.execute(characters.update().where(characters.c.id == character_id).values(last_update=now))
+
+    pending = connection.execute(select([func.count()]).where((changes.c.character_id == character_id) &
+                                                              (changes.c.changed_on >= snapshot.taken_on) &
+                                                              (changes.c.id > snapshot.last_change_id))).scalar()
+    if pending >= SNAPSHOT_INTERVAL:
+        take_snapshot(character_id, connection)
+
+    if commit:
+        db.session.commit()
+    return change_id
+
+
+@event.listens_for(Character, 'before_delete')
+def _delete_history(mapper, connection, target):
+    # the rows reference the character, so they go before it does
+    for table in (AttributeChange.__table__, AttributeSnapshot.__table__):
+        connection.execute(table.delete().where(table.c.character_id == target.id))
+
+
+def ranks_as_of(character_id, when):
+    """
+    Rebuild a character's attribute ranks as they were at a datetime
+
+    Returns None when the character's history starts after when.
+    """
+    connection = read_connection(db.session)
+    snapshot = _latest_snapshot(connection, character_id, when)
+    if snapshot is None:
+        return None
+
+    ranks = dict((int(attribute_id), rank) for attribute_id, rank in json.loads(snapshot.ranks).items())
+    changes = AttributeChange.__table__
+    for attribute_id, new_rank in connection.execute(
+            select([changes.c.attribute_id, changes.c.new_rank])
+            .where((changes.c.character_id == character_id) &
+                   (changes.c.changed_on >= snapshot.taken_on) &
+                   (changes.c.changed_on <= when) &
+                   (changes.c.id > snapshot.last_change_id))
+            .order_by(changes.c.changed_on, changes.c.id)):
+        if new_rank is None:
+            ranks.pop(attribute_id, None)
+        else:
+            ranks[attribute_id] = new_rank
+    return ranks
+
+
+def history_query(character_id):
+    """
+    The change log of one character, for paginating newest first
+    """
+    return AttributeChange.query.options(joinedload(AttributeChange.attribute),
+                                         joinedload(AttributeChange.changed_by)) \
+        .filter(AttributeChange.character_id == character_id)
+
+
+def snapshot_all(batch_size=CHUNK_SIZE, commit=True):
+    """
+    Take a snapshot of every character, a batch of characters at a time
+
+    Run it before the first logged change to record where every sheet
+    started, and periodically afterwards. Returns the number of snapshots.
+    """
+    changes = AttributeChange.__table__
+    characters = Character.__table__
+    now = datetime.datetime.utcnow()
+    count = 0
+    last_id = 0
+    while True:
+        character_ids = [row[0] for row in db.session.execute(
+            select([characters.c.id]).where(characters.c.id > last_id).order_by(characters.c.id).limit(batch_size))]
+        if not character_ids:
+            break
+        last_id = character_ids[-1]
+
+        ranks = dict((character_id, {}) for character_id in character_ids)
+        for character_id, attribute_id, rank in db.session.execute(
+                select([character_attributes.c.character_id, character_attributes.c.attribute_id,
+                        character_attributes.c.rank])
+                .where(character_attributes.c.character_id.in_(character_ids))):
+            ranks[character_id][attribute_id] = rank
+        last_change_ids = dict(db.session.execute(
+            select([changes.c.character_id, func.max(changes.c.id)])
+            .where(changes.c.character_id.in_(character_ids))
+            .group_by(changes.c.character_id)).fetchall())
+
+        db.session.execute(AttributeSnapshot.__table__.insert(), [{
+            'character_id': character_id,
+            'taken_on': now,
+            'last_change_id': last_change_ids.get(character_id, 0),
+            'ranks': json.dumps(ranks[character_id], sort_keys=True),
+        } for character_id in character_ids])
+        count += len(character_ids)
+        if commit:
+            db.session.commit()
+    return count
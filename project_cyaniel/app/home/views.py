@@ -1,9 +1,15 @@
 # Imports
 from flask import abort, render_template
 from flask_login import current_user, login_required
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 
 # Local Imports
 from . import home
+from .. import db
+from ..models import BucketTicket, TicketStatus, User, ticket_comments
+from ..pagination import paginate_request
+from ..tickets import get_ticket_access
 
 
 @home.route('/')
@@ -30,4 +36,43 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
 
-    return render_template('home/admin_dashboard.html', title="Dashboard")
\ No newline at end of file
+    return render_template('home/admin_dashboard.html', title="Dashboard")
+
+
+@home.route('/tickets')
+@login_required
+def list_tickets():
+    """
+    List the tickets the current user may read, newest first
+    """
+    access = get_ticket_access()
+    query = access.filter(BucketTicket.query.options(joinedload(BucketTicket.bucket),
+                                                     joinedload(BucketTicket.assignee)))
+    tickets = paginate_request(query, sorts={'created': BucketTicket.created_on},
+                               default_sort='created', id_column=BucketTicket.id, default_direction='desc')
+
+    return render_template('home/tickets.html', tickets=tickets, access=access,
+                           TicketStatus=TicketStatus, title="Tickets")
+
+
+@home.route('/tickets/<int:id>')
+@login_required
+def ticket(id):
+    """
+    Show a ticket and its comments to a user who may read it
+    """
+    access = get_ticket_access()
+    if not access.can_read(id):
+        abort(403)
+
+    ticket = BucketTicket.query.options(joinedload(BucketTicket.bucket), joinedload(BucketTicket.creator),
+                                        joinedload(BucketTicket.assignee)).get_or_404(id)
+    comments = db.session.execute(select([ticket_comments.c.comment, ticket_comments.c.created_on,
+                                          User.__table__.c.user_name])
+                                  .select_from(ticket_comments.outerjoin(
+                                      User.__table__, User.__table__.c.id == ticket_comments.c.author_id))
+                                  .where(ticket_comments.c.ticket_id == id)
+                                  .order_by(ticket_comments.c.created_on)).fetchall()
+
+    return render_template('home/ticket.html', ticket=ticket, comments=comments, access=access,
+                           TicketStatus=TicketStatus, title=ticket.title)
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db, login_manager
+from .models import Role, User, user_roles
+
+
+# Identity cache
+#
+# Flask-Login reloads the user on every authenticated request. The loader
+# below serves a detached snapshot of the user's core fields and role names
+# from a short-lived per-process cache instead, so steady-state page views need
+# no identity query. Commits touching a user or role evict the affected
+# entries; IDENTITY_CACHE_TTL bounds how stale other workers can be.
+
+
+class Identity(UserMixin):
+    """
+    A read-only snapshot of the logged-in user
+
+    Views that need to change the user should load it with get_user().
+    """
+
+    def __init__(self, id, email, user_name, first_name, last_name, is_admin, role_names):
+        self.id = id
+        self.email = email
+        self.user_name = user_name
+        self.first_name = first_name
+        self.last_name = last_name
+        self.is_admin = is_admin
+        self.role_names = frozenset(role_names)
+
+    @classmethod
+    def from_user(cls, user, role_names=None):
+        if role_names is None:
+            role_names = [role.name for role in user.roles]
+        return cls(user.id, user.email, user.user_name, user.first_name, user.last_name,
+                   bool(user.is_admin), role_names)
+
+    def has_role(self, name):
+        return name in self.role_names
+
+    def get_user(self):
+        """
+        Load the full User row for this identity
+        """
+        return User.query.get(self.id)
+
+    def __repr__(self):
+        return '<Identity: {}>'.format(self.user_name)
+
+
+class IdentityCache(object):
+    """
+    A bounded, thread safe user id -> Identity map whose entries expire after ttl seconds
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, identity, ttl, max_size):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.time() + ttl, identity)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def fetch_identity(user_id):
+    """
+    Load a user and their role names in one query, or return None
+    """
+    # flat outer joins rather than joinedload, which nests the role join in a
+    # way SQLite materializes by scanning all of user_roles
+    rows = db.session.query(User, Role.name) \
+        .outerjoin(user_roles, user_roles.c.user_id == User.id) \
+        .outerjoin(Role, Role.id == user_roles.c.role_id) \
+        .filter(User.id == user_id) \
+        .all()
+    if not rows:
+        return None
+    return Identity.from_user(rows[0][0], [name for user, name in rows if name is not None])
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if not ttl:
+        return fetch_identity(user_id)
+
+    identity = identity_cache.get(user_id)
+    if identity is None:
+        identity = fetch_identity(user_id)
+        if identity is not None:
+            identity_cache.put(user_id, identity, ttl, current_app.config.get('IDENTITY_CACHE_SIZE', 10000))
+    return identity
+
+
+# Eviction happens after commit, so a rolled back change never drops a valid entry
+
+_CLEAR_ALL = object()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_identity_changes(session, flush_context):
+    changed = session.info.setdefault('identity_changes', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User) and instance.id is not None:
+            changed.add(instance.id)
+        elif isinstance(instance, Role) and instance not in session.new:
+            changed.add(_CLEAR_ALL)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_identities(session):
+    changed = session.info.pop('identity_changes', None)
+    if not changed:
+        return
+    if _CLEAR_ALL in changed:
+        identity_cache.clear()
+    else:
+        identity_cache.evict(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_identity_changes(session):
+    session.info.pop('identity_changes', None)
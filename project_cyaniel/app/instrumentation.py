@@ -0,0 +1,228 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# SQL instrumentation
+#
+# Listens on every Engine so counters work regardless of which engine or bind
+# a statement ends up on. count_queries / query_budget count statements for a
+# block of code; with SQL_INSTRUMENTATION on, every request also records its
+# query count, DB time and repeated statements (N+1 patterns) per endpoint.
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a block of code issues more SQL statements than it is allowed
+    """
+
+    def __init__(self, name, budget, statements):
+        self.name = name
+        self.budget = budget
+        self.statements = statements
+        super(QueryBudgetExceeded, self).__init__(
+            '{0} issued {1} queries, budget is {2}:\n{3}'.format(
+                name, len(statements), budget, '\n'.join(statements)))
+
+
+class QueryCounter(object):
+    """
+    Collects the statements executed while it is active
+    """
+
+    def __init__(self):
+        self.statements = []
+        # (statement, parameters, executemany) as passed to the DBAPI cursor
+        self.executions = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def _active_counters():
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    return _local.counters
+
+
+_whitespace = re.compile(r'\s+')
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_placeholder_lists = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)')
+
+
+def fingerprint(statement):
+    """
+    Normalize a statement so the same query with different parameters compares equal
+    """
+    statement = _whitespace.sub(' ', statement).strip()
+    statement = _literals.sub('?', statement)
+    return _placeholder_lists.sub('(?)', statement)
+
+
+class RequestMetrics(object):
+    """
+    The SQL activity of a single request
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+
+    def repeated(self, threshold):
+        return [(statement, count) for statement, count in self.fingerprints.most_common()
+                if count >= threshold]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in _active_counters():
+        counter.statements.append(statement)
+        counter.executions.append((statement, parameters, executemany))
+    if context is not None:
+        context.query_started = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None and has_request_context():
+        metrics = g.get('sql_metrics')
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_time += time.time() - started
+            metrics.fingerprints[fingerprint(statement)] += 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the SQL statements executed on this thread inside the with block
+    """
+    counter = QueryCounter()
+    counters = _active_counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+@contextmanager
+def query_budget(name, budget, enforce=True):
+    """
+    Fail with QueryBudgetExceeded if the with block issues more than budget queries
+
+    With enforce=False the block is still counted but never fails.
+    """
+    with count_queries() as counter:
+        yield counter
+    if enforce and counter.count > budget:
+        raise QueryBudgetExceeded(name, budget, counter.statements)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, int(math.ceil(fraction * len(values))) - 1))
+    return values[index]
+
+
+class EndpointStats(object):
+    """
+    A bounded window of request samples for one endpoint
+    """
+
+    def __init__(self, endpoint, size):
+        self.endpoint = endpoint
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+        self.repeated = Counter()
+
+    def add(self, duration, queries, db_time, repeated):
+        self.requests += 1
+        self.samples.append((duration, queries, db_time))
+        for statement, count in repeated:
+            self.repeated[statement] += 1
+
+    def summary(self):
+        durations = sorted(sample[0] * 1000 for sample in self.samples)
+        queries = sorted(sample[1] for sample in self.samples)
+        db_times = sorted(sample[2] * 1000 for sample in self.samples)
+        summary = {'endpoint': self.endpoint, 'requests': self.requests, 'samples': len(self.samples)}
+        for name, values in (('duration_ms', durations), ('queries', queries), ('db_ms', db_times)):
+            summary[name] = dict(('p{}'.format(p), percentile(values, p / 100.0)) for p in (50, 90, 99))
+            summary[name]['max'] = values[-1] if values else 0
+        summary['n_plus_one'] = [{'statement': statement, 'requests': count}
+                                 for statement, count in self.repeated.most_common(10)]
+        return summary
+
+
+class SQLInstrumentation(object):
+    """
+    Records per-request SQL metrics for every endpoint of an app
+    """
+
+    def __init__(self, app=None):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self.sample_size = 500
+        self.repeat_threshold = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['sql_instrumentation'] = self
+        if not app.config.get('SQL_INSTRUMENTATION', False):
+            return
+        self.sample_size = app.config.get('SQL_INSTRUMENTATION_SAMPLES', self.sample_size)
+        self.repeat_threshold = app.config.get('SQL_REPEAT_THRESHOLD', self.repeat_threshold)
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        g.sql_metrics = RequestMetrics()
+
+    def _finish(self, exception=None):
+        metrics = g.pop('sql_metrics', None)
+        if metrics is None or request.endpoint in (None, 'static'):
+            return
+
+        repeated = metrics.repeated(self.repeat_threshold)
+        for statement, count in repeated:
+            current_app.logger.warning('Possible N+1 in %s: %d x %s', request.endpoint, count, statement)
+
+        with self._lock:
+            stats = self.endpoints.get(request.endpoint)
+            if stats is None:
+                stats = self.endpoints[request.endpoint] = EndpointStats(request.endpoint, self.sample_size)
+            stats.add(time.time() - metrics.started, metrics.queries, metrics.db_time, repeated)
+
+    def summary(self):
+        """
+        Percentiles for every recorded endpoint, busiest first
+        """
+        with self._lock:
+            summaries = [stats.summary() for stats in self.endpoints.values()]
+        return sorted(summaries, key=lambda summary: summary['requests'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+
+
+sql_instrumentation = SQLInstrumentation()
@@ -0,0 +1,425 @@
+import datetime
+import json
+import os
+import signal
+import socket
+import threading
+import traceback
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import db
+from .awards import BulkAwardError, grant_bulk_award
+from .exports import FORMATS, stream_export
+from .models import Job, JobStatus
+from .search import SearchUnavailable, reindex
+from .snapshots import delta_base, write_snapshot
+
+
+# Background jobs
+#
+# Slow work is queued as rows in the jobs table and run by flask run-jobs,
+# outside the request that asked for it. A job names a registered task and
+# carries its keyword arguments as JSON. Workers take the highest priority due
+# job the same way staff claim tickets: candidate rows are locked with FOR
+# UPDATE SKIP LOCKED where the backend supports it, and the claim itself is a
+# compare-and-set UPDATE, so any number of worker threads and processes can
+# share one queue. A claimed job holds a lease that its worker renews while it
+# runs. The job is queued again when the lease runs out, so jobs left behind
+# by a crashed worker are picked up by another one. A failed job is retried
+# with exponential backoff until it reaches its max_attempts. A task raises
+# JobError for failures that retrying will not fix.
+#
+# A task's writes and the job's final status are committed together, so a
+# job that does its work in one transaction, such as a bulk award, is never
+# applied twice.
+
+CLAIM_CANDIDATES = 5
+# longest retry backoff, in seconds
+MAX_RETRY_DELAY = 3600
+# characters of traceback kept on a failed job
+MAX_ERROR_LENGTH = 4000
+EXPORT_FOLDER = 'exports'
+# tasks whose result names a file they wrote to EXPORT_FOLDER
+FILE_TASKS = ('export_characters', 'write_snapshot')
+
+Task = namedtuple('Task', 'name function max_attempts priority description')
+
+TASKS = {}
+
+
+class JobError(Exception):
+    """
+    Raised by a task for a failure that retrying will not fix
+    """
+
+
+def task(name, max_attempts=3, priority=0):
+    """
+    Register a function as the task run by jobs of this name
+
+    The function is called with the Job and the job's payload as keyword
+    arguments. It must not commit its own transaction unless its work is
+    safe to repeat. Its return value is stored on the job as JSON.
+    """
+    def register(function):
+        description = (function.__doc__ or '').strip().split('\n')[0]
+        TASKS[name] = Task(name, function, max_attempts, priority, description)
+        return function
+    return register
+
+
+def enqueue(name, payload=None, priority=None, run_after=None, user_id=None, commit=True):
+    """
+    Queue a job for the named task and return its id
+    """
+    if name not in TASKS:
+        raise JobError('Unknown task: {}'.format(name))
+    registered = TASKS[name]
+    job = Job(name=name, payload=json.dumps(payload or {}, sort_keys=True),
+              priority=registered.priority if priority is None else priority,
+              max_attempts=registered.max_attempts, created_by_id=user_id,
+              run_after=run_after or datetime.datetime.utcnow())
+    db.session.add(job)
+    db.session.flush()
+    if commit:
+        db.session.commit()
+    return job.id
+
+
+def _lease():
+    return datetime.timedelta(seconds=current_app.config.get('JOB_LEASE', 300))
+
+
+def due_jobs(now, limit=CLAIM_CANDIDATES):
+    """
+    Select the ids of the queued jobs due at now, highest priority first, locking them where supported
+    """
+    jobs = Job.__table__
+    return select([jobs.c.id]) \
+        .where((jobs.c.status == JobStatus.QUEUED) & (jobs.c.run_after <= now)) \
+        .order_by(jobs.c.priority.desc(), jobs.c.run_after, jobs.c.id) \
+        .limit(limit) \
+        .with_for_update(skip_locked=True)
+
+
+def claim_next_job(worker, commit=True):
+    """
+    Mark the next due job as running for a worker and return its id, or None if nothing is due
+    """
+    jobs = Job.__table__
+    now = datetime.datetime.utcnow()
+    candidates = due_jobs(now)
+
+    claimed = None
+    while claimed is None:
+        connection = db.session.connection()
+        job_ids = [row[0] for row in connection.execute(candidates)]
+        if not job_ids:
+            break
+        for job_id in job_ids:
+            result = connection.execute(jobs.update()
+                                        .where((jobs.c.id == job_id) & (jobs.c.status == JobStatus.QUEUED))
+                                        .values(status=JobStatus.RUNNING, attempts=jobs.c.attempts + 1,
+                                                locked_by=worker, locked_until=now + _lease(),
+                                                started_on=now, finished_on=None))
+            if result.rowcount == 1:
+                claimed = job_id
+                break
+
+    if commit:
+        db.session.commit()
+    return claimed
+
+
+def _retry_delay(attempts):
+    delay = current_app.config.get('JOB_RETRY_DELAY', 30) * 2 ** max(0, attempts - 1)
+    return datetime.timedelta(seconds=min(delay, MAX_RETRY_DELAY))
+
+
+def _finish(connection, job_id, worker, values):
+    jobs = Job.__table__
+    result = connection.execute(jobs.update()
+                                .where((jobs.c.id == job_id) & (jobs.c.status == JobStatus.RUNNING) &
+                                       (jobs.c.locked_by == worker))
+                                .values(locked_by=None, locked_until=None, **values))
+    return result.rowcount == 1
+
+
+def run_job(job_id, worker):
+    """
+    Run a job claimed by worker and record how it ended, returning its new status
+    """
+    job = Job.query.get(job_id)
+    registered = TASKS.get(job.name)
+    now = datetime.datetime.utcnow
+    try:
+        if registered is None:
+            raise JobError('Unknown task: {}'.format(job.name))
+        result = registered.function(job, **json.loads(job.payload))
+        values = {'status': JobStatus.SUCCEEDED, 'result': json.dumps(result, sort_keys=True, default=str),
+                  'error': None, 'finished_on': now()}
+        if _finish(db.session.connection(), job_id, worker, values):
+            db.session.commit()
+            return JobStatus.SUCCEEDED
+        # the lease ran out and another worker took the job, its work is discarded
+        db.session.rollback()
+        current_app.logger.warning('Job %s lost its lease to another worker, rolled back', job_id)
+        return None
+    except Exception as error:
+        db.session.rollback()
+        current_app.logger.exception('Job %s (%s) failed', job_id, job.name)
+        message = traceback.format_exc()[-MAX_ERROR_LENGTH:]
+        retryable = not isinstance(error, JobError)
+
+    jobs = Job.__table__
+    attempts, max_attempts = db.session.execute(select([jobs.c.attempts, jobs.c.max_attempts])
+                                                .where(jobs.c.id == job_id)).first()
+    if not retryable or attempts >= max_attempts:
+        values = {'status': JobStatus.FAILED, 'error': message, 'finished_on': now()}
+    else:
+        values = {'status': JobStatus.QUEUED, 'error': message, 'run_after': now() + _retry_delay(attempts)}
+    _finish(db.session.connection(), job_id, worker, values)
+    db.session.commit()
+    return values['status']
+
+
+def extend_leases(job_ids, workers):
+    """
+    Renew the leases of jobs still running on these workers
+    """
+    jobs = Job.__table__
+    with db.engine.begin() as connection:
+        connection.execute(jobs.update()
+                           .where(jobs.c.id.in_(job_ids) & (jobs.c.status == JobStatus.RUNNING) &
+                                  jobs.c.locked_by.in_(workers))
+                           .values(locked_until=datetime.datetime.utcnow() + _lease()))
+
+
+def requeue_expired(commit=True):
+    """
+    Queue again the running jobs whose lease ran out, failing those out of attempts
+
+    Returns the number of jobs requeued or failed.
+    """
+    jobs = Job.__table__
+    now = datetime.datetime.utcnow()
+    expired = (jobs.c.status == JobStatus.RUNNING) & (jobs.c.locked_until < now)
+    requeued = db.session.execute(jobs.update()
+                                  .where(expired & (jobs.c.attempts < jobs.c.max_attempts))
+                                  .values(status=JobStatus.QUEUED, locked_by=None, locked_until=None,
+                                          run_after=now, error='The worker running this job stopped'))
+    failed = db.session.execute(jobs.update()
+                                .where(expired)
+                                .values(status=JobStatus.FAILED, locked_by=None, locked_until=None,
+                                        finished_on=now, error='The worker running this job stopped'))
+    if commit:
+        db.session.commit()
+    return requeued.rowcount + failed.rowcount
+
+
+def retry_job(job_id, commit=True):
+    """
+    Queue a failed or cancelled job again with fresh attempts, returning whether it was queued
+    """
+    jobs = Job.__table__
+    result = db.session.execute(jobs.update()
+                                .where((jobs.c.id == job_id) &
+                                       jobs.c.status.in_((JobStatus.FAILED, JobStatus.CANCELLED)))
+                                .values(status=JobStatus.QUEUED, attempts=0, error=None, finished_on=None,
+                                        run_after=datetime.datetime.utcnow()))
+    if commit:
+        db.session.commit()
+    return result.rowcount == 1
+
+
+def cancel_job(job_id, commit=True):
+    """
+    Cancel a job that has not started yet, returning whether it was cancelled
+    """
+    jobs = Job.__table__
+    result = db.session.execute(jobs.update()
+                                .where((jobs.c.id == job_id) & (jobs.c.status == JobStatus.QUEUED))
+                                .values(status=JobStatus.CANCELLED, finished_on=datetime.datetime.utcnow()))
+    if commit:
+        db.session.commit()
+    return result.rowcount == 1
+
+
+def status_counts():
+    """
+    Map job status to the number of jobs in it
+    """
+    jobs = Job.__table__
+    return dict(db.session.execute(select([jobs.c.status, func.count()]).group_by(jobs.c.status)).fetchall())
+
+
+class Worker(object):
+    """
+    Runs queued jobs on a pool of threads until stopped, or until the queue is empty with once
+    """
+
+    def __init__(self, app, threads=1, once=False):
+        self.app = app
+        self.threads = threads
+        self.once = once
+        self.name = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.stopping = threading.Event()
+        # worker thread name -> job id it is running
+        self.running = {}
+        # (job id, status) pairs, only kept with once as a long running worker would grow it forever
+        self.finished = []
+
+    def _work(self, index):
+        worker = '{0}:{1}'.format(self.name, index)[:64]
+        poll_interval = self.app.config.get('JOB_POLL_INTERVAL', 2)
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    if index == 0:
+                        requeue_expired()
+                    job_id = claim_next_job(worker)
+                except Exception:
+                    # a lost race for SQLite's write lock or the database going away, try again later
+                    self.app.logger.exception('Worker %s could not claim a job', worker)
+                    db.session.rollback()
+                    job_id = None
+                if job_id is not None:
+                    self.running[worker] = job_id
+                    try:
+                        status = run_job(job_id, worker)
+                        if self.once:
+                            self.finished.append((job_id, status))
+                    except Exception:
+                        # recording the outcome failed, the job is queued again once its lease runs out
+                        self.app.logger.exception('Worker %s could not finish job %s', worker, job_id)
+                        db.session.rollback()
+                    finally:
+                        del self.running[worker]
+                        db.session.remove()
+                    continue
+            if self.once:
+                return
+            self.stopping.wait(poll_interval)
+
+    def _heartbeat(self):
+        interval = self.app.config.get('JOB_LEASE', 300) / 3.0
+        while not self.stopping.wait(interval):
+            running = dict(self.running)
+            if not running:
+                continue
+            with self.app.app_context():
+                try:
+                    extend_leases(list(running.values()), list(running))
+                except Exception:
+                    # the leases are renewed on the next beat, well before they run out
+                    self.app.logger.exception('Worker %s could not extend the leases of its jobs', self.name)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run(self):
+        """
+        Work until stopped, returning a list of (job id, status) pairs for the jobs run with once
+        """
+        threads = [threading.Thread(target=self._work, args=(index,), name='job-worker-{}'.format(index))
+                   for index in range(self.threads)]
+        heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        for thread in threads:
+            thread.start()
+        heartbeat.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # running jobs finish, no new ones start
+            self.stop()
+            for thread in threads:
+                thread.join()
+        self.stop()
+        return self.finished
+
+
+# Tasks
+
+@task('bulk_award', max_attempts=3, priority=10)
+def bulk_award_task(job, character_ids, award_type_id, amount, reason):
+    """
+    Grant one award to every character of a roster
+    """
+    try:
+        result = grant_bulk_award(character_ids, award_type_id, amount, reason, commit=False)
+    except BulkAwardError as error:
+        raise JobError(str(error))
+    return {'award_type': result.award_type.name, 'amount': result.amount, 'granted': len(result.grants),
+            'duplicates': result.duplicates}
+
+
+@task('export_characters', max_attempts=3)
+def export_characters_task(job, format='csv'):
+    """
+    Write every character with their attributes to a file in the instance folder
+    """
+    if format not in FORMATS:
+        raise JobError('Unknown export format: {}'.format(format))
+    file_name = 'characters-{0}.{1}'.format(job.id, format)
+    path = _export_file(file_name)
+    lines = 0
+    with open(path + '.tmp', 'w', encoding='utf-8', newline='') as export_file:
+        for line in stream_export(format):
+            export_file.write(line)
+            lines += 1
+    os.replace(path + '.tmp', path)
+    return {'file': file_name, 'format': format, 'lines': lines, 'size': os.path.getsize(path)}
+
+
+@task('write_snapshot', max_attempts=3)
+def write_snapshot_task(job, generated_at=None, catalog_version=0):
+    """
+    Write an offline snapshot for check-in devices, or a delta on top of the snapshot generated at a time
+    """
+    since = None
+    if generated_at is not None:
+        try:
+            since, catalog_version = delta_base({'generated_at': generated_at, 'catalog_version': catalog_version})
+        except (TypeError, ValueError):
+            raise JobError('generated_at must be an ISO timestamp with microseconds and catalog_version a number')
+    file_name = '{0}-{1}.sqlite'.format('delta' if since else 'snapshot', job.id)
+    path = _export_file(file_name)
+    report = write_snapshot(path, since, catalog_version)
+    return {'file': file_name, 'delta': since is not None, 'rows': dict(report), 'size': os.path.getsize(path)}
+
+
+def _export_file(file_name):
+    folder = os.path.join(current_app.instance_path, EXPORT_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, file_name)
+
+
+def export_path(job):
+    """
+    The file written by a finished export or snapshot job, None when there is none
+    """
+    if job.name not in FILE_TASKS or job.status != JobStatus.SUCCEEDED or not job.result:
+        return None
+    path = os.path.join(current_app.instance_path, EXPORT_FOLDER, json.loads(job.result)['file'])
+    return path if os.path.exists(path) else None
+
+
+@task('reindex_search', max_attempts=2, priority=-10)
+def reindex_search_task(job, kinds=None, since=None):
+    """
+    Build the full-text search index, or bring it up to date with rows changed since a date
+    """
+    if since is not None:
+        since = datetime.datetime.strptime(since, '%Y-%m-%dT%H:%M:%S')
+    try:
+        # commits a batch at a time, re-indexing is safe to repeat
+        return dict(reindex(kinds, since))
+    except SearchUnavailable as error:
+        raise JobError(str(error))
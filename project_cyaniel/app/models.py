@@ -1,6 +1,8 @@
+import datetime
+
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, login_manager
+from app import db
+from app.passwords import PASSWORD_HASH_LENGTH, PasswordHasherBusy, password_hasher
 
 
 # Project Cyaniel Models
@@ -9,14 +11,18 @@ character_attributes = db.Table('character_attributes',
                                 db.Column('character_id', db.Integer, db.ForeignKey('characters.id')),
                                 db.Column('attribute_id', db.Integer, db.ForeignKey('attributes.id')),
                                 db.Column('rank', db.Integer),
-                                db.Column('last_modified', db.DateTime),
-                                db.Column('comments', db.String(1024))
+                                db.Column('last_modified', db.DateTime, default=datetime.datetime.utcnow),
+                                db.Column('comments', db.String(1024)),
+                                db.Index('ix_character_attributes_character_attribute',
+                                         'character_id', 'attribute_id')
                                 )
 
 
 user_roles = db.Table("user_roles",
                       db.Column('user_id', db.Integer, db.ForeignKey('users.id')),
-                      db.Column('role_id', db.Integer, db.ForeignKey('roles.id'))
+                      db.Column('role_id', db.Integer, db.ForeignKey('roles.id')),
+                      db.Index('ix_user_roles_user_role', 'user_id', 'role_id'),
+                      db.Index('ix_user_roles_role_id', 'role_id')
                       )
 
 """
@@ -27,21 +33,28 @@ advancement_list_requirements = db.Table('advancement_list_requirements',
                                                    db.ForeignKey('advancement_list_attributes.id')),
                                          db.Column('attribute_requirement_id', db.Integer,
                                                    db.ForeignKey('attributes.id')),
-                                         db.Column('requirement_rank', db.Integer)
+                                         db.Column('requirement_rank', db.Integer),
+                                         db.Index('ix_advancement_list_requirements_option_attribute',
+                                                  'advancement_list_attribute_id', 'attribute_requirement_id'),
+                                         db.Index('ix_advancement_list_requirements_attribute_id',
+                                                  'attribute_requirement_id')
                                          )
 
 ticket_comments = db.Table('ticket_comments',
                            db.Column('ticket_id', db.Integer, db.ForeignKey('bucket_tickets.id')),
                            db.Column('author_id', db.Integer, db.ForeignKey('users.id')),
                            db.Column('comment', db.String(1024)),
-                           db.Column('created_on', db.DateTime)
+                           db.Column('created_on', db.DateTime),
+                           db.Index('ix_ticket_comments_ticket_created', 'ticket_id', 'created_on')
                            )
 
 ticket_access_lists = db.Table('ticket_access_lists',
                                db.Column('ticket_id', db.Integer, db.ForeignKey('bucket_tickets.id')),
                                db.Column('user_id', db.Integer, db.ForeignKey('users.id')),
                                db.Column('can_write', db.Boolean),
-                               db.Column('can_read', db.Boolean)
+                               db.Column('can_read', db.Boolean),
+                               db.Index('ix_ticket_access_lists_ticket_user', 'ticket_id', 'user_id'),
+                               db.Index('ix_ticket_access_lists_user_id', 'user_id')
                                )
 
 
@@ -66,8 +79,8 @@ class User(UserMixin, db.Model):
     join_date = db.Column(db.DateTime)
     emergency_contact_name = db.Column(db.String(60))
     emergency_contact_number = db.Column(db.String(20))
-    password_hash = db.Column(db.String(128), nullable=False)
-    last_update = db.Column(db.DateTime)
+    password_hash = db.Column(db.String(PASSWORD_HASH_LENGTH), nullable=False)
+    last_update = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     roles = db.relationship("Role", secondary=user_roles)
     characters = db.relationship("Character", back_populates="user")
@@ -85,24 +98,29 @@ class User(UserMixin, db.Model):
         """
         Set password to a hashed password
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
         """
         Check if hashed password matches actual password
+
+        A matching password stored with outdated hash parameters is rehashed,
+        the caller is responsible for committing the change. When the hasher
+        is busy the rehash waits for a later login.
         """
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            try:
+                self.password = password
+            except PasswordHasherBusy:
+                pass
+        return True
 
     def __repr__(self):
         return '<User: {}>'.format(self.username)
 
 
-# Set up user_loader
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
 class AwardLog(db.Model):
     """
     A log table that tracks various point awards to characters or users.
@@ -111,6 +129,10 @@ class AwardLog(db.Model):
     """
 
     __tablename__ = 'award_logs'
+    __table_args__ = (
+        db.Index('ix_award_logs_character_type_date', 'character_id', 'award_type_id', 'award_date'),
+        db.Index('ix_award_logs_user_type_date', 'user_id', 'award_type_id', 'award_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -128,6 +150,35 @@ class AwardLog(db.Model):
         return 'Award ({0}): {1}'.format(self.award_type.name, self.amount)
 
 
+class AwardBalance(db.Model):
+    """
+    The running total of the award log per user, character and award type.
+
+    Maintained as award logs are written; player-wide awards have no character.
+    character_key is the character id, or 0 for player-wide awards, so the
+    unique index also covers them (NULLs never collide in a unique index).
+    """
+
+    __tablename__ = 'award_balances'
+    __table_args__ = (
+        db.Index('ix_award_balances_user_character_key_type', 'user_id', 'character_key', 'award_type_id',
+                 unique=True),
+        db.Index('ix_award_balances_character_type', 'character_id', 'award_type_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True)
+    character_key = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    award_type_id = db.Column(db.Integer, db.ForeignKey('award_types.id'), nullable=False)
+    award_type = db.relationship("AwardType")
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    last_update = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Award Balance ({0}): {1}>'.format(self.award_type_id, self.balance)
+
+
 class AwardType(db.Model):
     """
     A table specifying some kind of point-value award able to be granted to users or characters.
@@ -165,10 +216,10 @@ class Character(db.Model):
     __tablename__ = 'characters'
 
     id = db.Column(db.Integer, primary_key=True)
-    character_name = db.Column(db.String(60), nullable=False)
+    character_name = db.Column(db.String(60), nullable=False, index=True)
     create_date = db.Column(db.DateTime)
-    last_update = db.Column(db.DateTime)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_update = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     user = db.relationship("User", back_populates="characters")
     attributes = db.relationship("Attribute", secondary=character_attributes)
     awards = db.relationship("AwardLog", back_populates='character')
@@ -215,9 +266,10 @@ class Inventory(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, nullable=False)
-    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False, index=True)
     character = db.relationship("Character", back_populates='items')
     item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
+    item = db.relationship("Items")
 
     def __repr__(self):
         return '<Inventory: {}>'.format(self.name)
@@ -234,7 +286,7 @@ class Items(db.Model):
     item_name = db.Column(db.String(200), nullable=False, unique=True)
     description = db.Column(db.Text(200))
     item_attr = db.Column(db.Text(200))
-    last_update = db.Column(db.DateTime)
+    last_update = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return '<Item: {}>'.format(self.name)
@@ -250,13 +302,63 @@ class CharacterNotes(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     body = db.Column(db.Text(500))
-    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False, index=True)
     character = db.relationship("Character", back_populates='notes')
 
     def __repr__(self):
         return '<Character Note: {}>'.format(self.name)
 
 
+class AttributeChange(db.Model):
+    """
+    An append-only log of every change to a character's attribute ranks
+
+    A rank of None means the character did not hold the attribute. The log is
+    deleted along with its character.
+    """
+
+    __tablename__ = 'attribute_changes'
+    __table_args__ = (
+        db.Index('ix_attribute_changes_character_changed', 'character_id', 'changed_on'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
+    attribute_id = db.Column(db.Integer, db.ForeignKey('attributes.id'), nullable=False)
+    attribute = db.relationship("Attribute")
+    old_rank = db.Column(db.Integer)
+    new_rank = db.Column(db.Integer)
+    changed_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    changed_by = db.relationship("User")
+    changed_on = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    comments = db.Column(db.String(1024))
+
+    def __repr__(self):
+        return '<Attribute Change: {0} {1} -> {2}>'.format(self.attribute_id, self.old_rank, self.new_rank)
+
+
+class AttributeSnapshot(db.Model):
+    """
+    A character's attribute ranks at one moment, including every change up to last_change_id
+
+    ranks holds a JSON object of attribute id to rank.
+    """
+
+    __tablename__ = 'attribute_snapshots'
+    __table_args__ = (
+        db.Index('ix_attribute_snapshots_character_taken', 'character_id', 'taken_on'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
+    taken_on = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    last_change_id = db.Column(db.Integer, nullable=False, default=0)
+    ranks = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return '<Attribute Snapshot: {0} at {1}>'.format(self.character_id, self.taken_on)
+
+
 class AdvancementList(db.Model):
     """
     A type of list for character generation / character advancement options.
@@ -280,6 +382,9 @@ class AdvancementListAttribute(db.Model):
     """
 
     __tablename__ = 'advancement_list_attributes'
+    __table_args__ = (
+        db.Index('ix_advancement_list_attributes_list_attribute', 'advancement_list_id', 'attribute_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     advancement_list_id = db.Column(db.Integer, db.ForeignKey("advancement_lists.id"), nullable=False)
@@ -308,24 +413,100 @@ class Bucket(db.Model):
         return "<Bucket: {}>".format(self.name)
 
 
+class TicketStatus(object):
+    """
+    The states of a BucketTicket
+    """
+    OPEN = 0
+    CLAIMED = 1
+    CLOSED = 2
+
+    NAMES = {OPEN: 'Open', CLAIMED: 'Claimed', CLOSED: 'Closed'}
+
+
 class BucketTicket(db.Model):
     """
     A ticket in the queue for staff administration,
     """
 
     __tablename__ = 'bucket_tickets'
+    __table_args__ = (
+        # the queue of a bucket is read by status, oldest first
+        db.Index('ix_bucket_tickets_bucket_status_created', 'bucket_id', 'status', 'created_on'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     bucket_id = db.Column(db.Integer, db.ForeignKey('buckets.id'), nullable=False)
     bucket = db.relationship('Bucket', foreign_keys=bucket_id)
     title = db.Column(db.String(128))
-    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     creator = db.relationship('User', foreign_keys=creator_id)
-    assignee_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    assignee = db.ForeignKey('User', foreign_keys=assignee_id)
-    status = db.Column(db.Integer)
-    created_on = db.Column(db.DateTime)
-    last_modified = db.Column(db.DateTime)
+    assignee_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    assignee = db.relationship('User', foreign_keys=assignee_id)
+    status = db.Column(db.Integer, default=TicketStatus.OPEN)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    last_modified = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
         return "<Ticket: {}>".format(self.title)
+
+
+class DataVersion(db.Model):
+    """
+    A counter bumped whenever a group of tables changes, used to invalidate per-process caches
+    """
+
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Data Version: {0} {1}>'.format(self.name, self.version)
+
+
+class JobStatus(object):
+    """
+    The states of a Job
+    """
+    QUEUED = 0
+    RUNNING = 1
+    SUCCEEDED = 2
+    FAILED = 3
+    CANCELLED = 4
+
+    NAMES = {QUEUED: 'Queued', RUNNING: 'Running', SUCCEEDED: 'Succeeded', FAILED: 'Failed', CANCELLED: 'Cancelled'}
+
+
+class Job(db.Model):
+    """
+    A unit of background work, run by flask run-jobs
+    """
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # workers take the highest priority queued job that is due, oldest first
+        db.Index('ix_jobs_status_priority_run_after', 'status', 'priority', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    # JSON keyword arguments of the task, and what it returned
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    status = db.Column(db.Integer, nullable=False, default=JobStatus.QUEUED)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    locked_until = db.Column(db.DateTime)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_by = db.relationship('User', foreign_keys=created_by_id)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    started_on = db.Column(db.DateTime)
+    finished_on = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Job: {0} {1}>'.format(self.id, self.name)
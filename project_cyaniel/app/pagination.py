@@ -0,0 +1,172 @@
+import base64
+import datetime
+import json
+
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+
+# Keyset (cursor) pagination helpers
+#
+# Pages are addressed by the sort key of the row on their edge instead of an
+# OFFSET, so fetching page N costs the same as fetching page 1 as long as the
+# sort column is indexed.
+
+
+class KeysetPage(object):
+    """
+    A single page of rows along with the cursors needed to move around it
+    """
+
+    def __init__(self, items, sort, direction, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.direction = direction
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        for date_format in _DATETIME_FORMATS:
+            try:
+                return datetime.datetime.strptime(value.get('dt'), date_format)
+            except (TypeError, ValueError):
+                pass
+        raise ValueError('Invalid cursor value: {}'.format(value))
+    return value
+
+
+def encode_cursor(value, id):
+    """
+    Pack a (sort value, id) pair into an opaque, URL safe cursor
+    """
+    raw = json.dumps([_encode_value(value), id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Unpack a cursor created by encode_cursor, raising ValueError if it is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+    if not isinstance(id, int) or isinstance(id, bool):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+    return _decode_value(value), id
+
+
+def _check_value(value, sort_column):
+    # a value of another type than the column, such as a list, would reach the database as a bind parameter
+    python_type = sort_column.type.python_type
+    if not isinstance(value, python_type) or isinstance(value, bool) and python_type is not bool:
+        raise ValueError('Invalid cursor value for {0}: {1!r}'.format(sort_column.key, value))
+    return value
+
+
+def keyset_paginate(query, sort_column, id_column, sort_name, per_page,
+                    after=None, before=None, descending=False):
+    """
+    Return a KeysetPage of query ordered by (sort_column, id_column)
+
+    Only one of after / before should be given. The id column breaks ties so the
+    ordering is total even when the sort column is not unique. The sort column
+    must be NOT NULL: a cursor on a NULL value matches no row past it.
+    """
+    sort_attr = sort_column.key
+    id_attr = id_column.key
+    backwards = before is not None
+    cursor = before if backwards else after
+
+    # Walking backwards is the same as walking forwards with the order flipped
+    ascending = descending == backwards
+    if cursor is not None:
+        value, id = decode_cursor(cursor)
+        value = _check_value(value, sort_column)
+        if ascending:
+            query = query.filter(or_(sort_column > value,
+                                     and_(sort_column == value, id_column > id)))
+        else:
+            query = query.filter(or_(sort_column < value,
+                                     and_(sort_column == value, id_column < id)))
+
+    if ascending:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    else:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+
+    # Fetch one extra row to find out whether there is anything beyond this page
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def edge(row):
+        return encode_cursor(getattr(row, sort_attr), getattr(row, id_attr))
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = edge(rows[-1])
+            prev_cursor = edge(rows[0]) if has_more else None
+        else:
+            next_cursor = edge(rows[-1]) if has_more else None
+            prev_cursor = edge(rows[0]) if cursor is not None else None
+
+    return KeysetPage(rows, sort_name, 'desc' if descending else 'asc', per_page,
+                      next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def paginate_request(query, sorts, default_sort, id_column, default_direction='asc'):
+    """
+    Paginate query using the sort, dir, after, before and per_page request arguments
+
+    sorts maps the public sort names accepted from the query string to columns,
+    so only indexed columns can ever be sorted on.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        abort(400)
+    direction = request.args.get('dir', default_direction)
+    if direction not in ('asc', 'desc'):
+        abort(400)
+
+    max_per_page = current_app.config.get('ADMIN_MAX_PAGE_SIZE', 200)
+    per_page = request.args.get('per_page', current_app.config.get('ADMIN_PAGE_SIZE', 50), type=int)
+    per_page = max(1, min(per_page, max_per_page))
+
+    try:
+        return keyset_paginate(query, sorts[sort], id_column, sort, per_page,
+                               after=request.args.get('after'),
+                               before=request.args.get('before'),
+                               descending=direction == 'desc')
+    except ValueError:
+        abort(400)
@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Password hashing
+#
+# Hashes are computed on a small bounded thread pool instead of inline in
+# whichever request thread asked for them. hashlib's pbkdf2 releases the GIL,
+# so the pool size caps how many cores hashing can take while a burst of
+# logins waits in the queue instead of starving every worker.
+
+# longest hash users.password_hash holds, the configured method must fit in it
+PASSWORD_HASH_LENGTH = 255
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the hashing queue is full or a hash did not finish in time
+    """
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords on a bounded worker pool with the configured method and cost
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 16
+        self.timeout = None
+        self.max_queue = 0
+        self._executor = None
+        # (configured method, method prefix werkzeug writes for it, length of its digest)
+        self._resolved = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT')
+        self.max_queue = app.config.get('PASSWORD_HASH_MAX_QUEUE', 0)
+        workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        # a longer hash is truncated or rejected by the database, locking its user out
+        length = self.hash_length()
+        if length > PASSWORD_HASH_LENGTH:
+            raise ValueError('{0} hashes are {1} characters long, users.password_hash holds {2}'.format(
+                self.method, length, PASSWORD_HASH_LENGTH))
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        app.extensions['password_hasher'] = self
+
+    def _timed(self, submitted, function, args):
+        started = time.time()
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            wait = started - submitted
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._run_total += time.time() - started
+
+    def _run(self, function, *args):
+        if self._executor is None:
+            with self._lock:
+                self._queued += 1
+            return self._timed(time.time(), function, args)
+
+        with self._lock:
+            if self.max_queue and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise PasswordHasherBusy('Password hashing queue is full')
+            self._queued += 1
+        future = self._executor.submit(self._timed, time.time(), function, args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._rejected += 1
+                if future.cancel():
+                    self._queued -= 1
+            raise PasswordHasherBusy('Password hashing did not finish in time')
+
+    def hash(self, password):
+        """
+        Hash a password with the configured method and salt length
+        """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        """
+        Check a password against a stored hash
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Whether a stored hash was made with a different method or cost than configured
+        """
+        return pwhash.split('$', 1)[0] != self._resolved_method()
+
+    def hash_length(self):
+        """
+        The length of the hashes the configured method and salt length produce
+        """
+        # method$salt$hash, the sample's one character salt stands in for the configured one
+        return len(self._resolved_method()) + 1 + self.salt_length + 1 + self._resolved[2]
+
+    def _resolved_method(self):
+        # werkzeug fills in the defaults of a method configured without them, such as
+        # scrypt as scrypt:32768:8:1, so compare with what it writes rather than the setting
+        resolved = self._resolved
+        if resolved is None or resolved[0] != self.method:
+            prefix, salt, digest = generate_password_hash('', self.method, 1).split('$')
+            resolved = self._resolved = (self.method, prefix, len(digest))
+        return resolved[1]
+
+    def stats(self):
+        """
+        A snapshot of the queue and timing counters
+        """
+        with self._lock:
+            started = self._completed + self._active
+            return {
+                'method': self.method,
+                'queued': self._queued,
+                'active': self._active,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_avg_ms': self._wait_total / started * 1000 if started else 0.0,
+                'wait_max_ms': self._wait_max * 1000,
+                'run_avg_ms': self._run_total / self._completed * 1000 if self._completed else 0.0,
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,292 @@
+import threading
+
+from .catalog import get_catalog
+
+
+# Prerequisite graph
+#
+# The requirement rows of the advancement lists form a DAG of attributes
+# (Umbral Calculus -> Polymathematics -> Angular Frequency -> ...). The graph
+# is compiled from the cached rules catalog with the full ancestor and
+# descendant closure of every node, so prerequisite questions are answered
+# from in-memory sets. Cached graphs are shared by every request and never
+# change once built. When the catalog changes, the attributes whose
+# requirements differ are updated on a copy, recomputing only the closures
+# they affect, and the copy replaces the cached graph. seed_catalog refuses a
+# catalog with a cycle.
+
+# attributes with changed requirements beyond which a graph is compiled from scratch
+INCREMENTAL_LIMIT = 20
+
+
+class PrerequisiteCycleError(ValueError):
+    """
+    Raised when requirement rows would make an attribute a prerequisite of itself
+    """
+
+    def __init__(self, nodes):
+        self.nodes = sorted(nodes)
+        super(PrerequisiteCycleError, self).__init__(
+            'Prerequisite cycle between attributes: {}'.format(', '.join(str(n) for n in self.nodes)))
+
+
+class PrerequisiteGraph(object):
+    """
+    A compiled attribute prerequisite DAG
+
+    Nodes are attribute ids. An edge (attribute, requirement) means the
+    requirement must be learned before the attribute.
+    """
+
+    def __init__(self, edges=(), names=None):
+        self.names = dict(names or {})
+        self.version = None
+        self.requires = {}
+        self.required_by = {}
+        for attribute_id, requirement_id in edges:
+            self._add_node(attribute_id)
+            self._add_node(requirement_id)
+            self.requires[attribute_id].add(requirement_id)
+            self.required_by[requirement_id].add(attribute_id)
+        self._compile()
+
+    def _add_node(self, node):
+        if node not in self.requires:
+            self.requires[node] = set()
+            self.required_by[node] = set()
+
+    def _sort(self):
+        """
+        Order every node after its requirements, raising PrerequisiteCycleError on a cycle
+        """
+        pending = dict((node, len(reqs)) for node, reqs in self.requires.items())
+        ready = sorted(node for node, count in pending.items() if count == 0)
+        order = []
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for dependent in self.required_by[node]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(pending):
+            raise PrerequisiteCycleError(node for node, count in pending.items() if count)
+        return order
+
+    def _compile(self):
+        self.order = self._sort()
+        self.position = dict((node, i) for i, node in enumerate(self.order))
+        self.ancestors = {}
+        self.descendants = {}
+        self._refresh_ancestors(self.order)
+        self._refresh_descendants(self.order)
+
+    def _refresh_ancestors(self, nodes):
+        for node in sorted(nodes, key=self.position.__getitem__):
+            closure = set(self.requires[node])
+            for requirement in self.requires[node]:
+                closure |= self.ancestors[requirement]
+            self.ancestors[node] = frozenset(closure)
+
+    def _refresh_descendants(self, nodes):
+        for node in sorted(nodes, key=self.position.__getitem__, reverse=True):
+            closure = set(self.required_by[node])
+            for dependent in self.required_by[node]:
+                closure |= self.descendants[dependent]
+            self.descendants[node] = frozenset(closure)
+
+    def __contains__(self, node):
+        return node in self.requires
+
+    def __len__(self):
+        return len(self.requires)
+
+    def name(self, node):
+        return self.names.get(node, node)
+
+    def _ordered(self, nodes):
+        return sorted(nodes, key=self.position.__getitem__)
+
+    def unlocks(self, node):
+        """
+        Every attribute that directly or indirectly requires node
+        """
+        return self.descendants.get(node, frozenset())
+
+    def prerequisites(self, node):
+        """
+        Every attribute node directly or indirectly requires
+        """
+        return self.ancestors.get(node, frozenset())
+
+    def learning_path(self, node):
+        """
+        The full list of attributes needed to learn node, in a learnable order, ending with node
+        """
+        if node not in self:
+            return [node]
+        return self._ordered(self.ancestors[node]) + [node]
+
+    def missing_prerequisites(self, node, known):
+        """
+        The prerequisites of node not yet covered by the known attributes, in a learnable order
+
+        Knowing an attribute implies knowing everything it requires.
+        """
+        covered = set()
+        for attribute_id in known:
+            covered.add(attribute_id)
+            covered |= self.ancestors.get(attribute_id, frozenset())
+        return self._ordered(self.prerequisites(node) - covered)
+
+    def copy(self):
+        """
+        A graph with the same nodes and closures that can be changed without affecting this one
+        """
+        graph = PrerequisiteGraph(names=self.names)
+        graph.version = self.version
+        graph.requires = dict((node, set(requirements)) for node, requirements in self.requires.items())
+        graph.required_by = dict((node, set(dependents)) for node, dependents in self.required_by.items())
+        # closures are frozensets, replaced rather than changed
+        graph.order = list(self.order)
+        graph.position = dict(self.position)
+        graph.ancestors = dict(self.ancestors)
+        graph.descendants = dict(self.descendants)
+        return graph
+
+    def set_requirements(self, node, requirement_ids):
+        """
+        Replace the requirements of one attribute and update the closures in place
+
+        Only the node, its descendants and its old and new ancestors are
+        recomputed. The graph is left unchanged if the new edges would create a
+        cycle. Never called on a cached graph, which other requests may be
+        reading, only on a copy of one.
+        """
+        requirement_ids = set(requirement_ids)
+        for requirement in requirement_ids:
+            if requirement == node or requirement in self.descendants.get(node, ()):
+                raise PrerequisiteCycleError([node, requirement])
+
+        self._add_node(node)
+        old_ancestors = self.ancestors.get(node, frozenset())
+        for requirement in self.requires[node] - requirement_ids:
+            self.required_by[requirement].discard(node)
+        for requirement in requirement_ids - self.requires[node]:
+            self._add_node(requirement)
+            self.required_by[requirement].add(node)
+        self.requires[node] = requirement_ids
+
+        if node not in self.position or any(requirement not in self.position or
+                                            self.position[requirement] > self.position[node]
+                                            for requirement in requirement_ids):
+            # the new edges break the current order, so start over
+            self._compile()
+            return
+
+        self._refresh_ancestors({node} | self.descendants[node])
+        self._refresh_descendants({node} | old_ancestors | self.ancestors[node])
+
+    def add_requirement(self, node, requirement_id):
+        self.set_requirements(node, self.requires.get(node, set()) | {requirement_id})
+
+    def remove_requirement(self, node, requirement_id):
+        self.set_requirements(node, self.requires.get(node, set()) - {requirement_id})
+
+
+def _graph_edges(list_name, catalog):
+    if list_name is None:
+        options = catalog.advancement_options
+    else:
+        advancement_list = catalog.advancement_lists.named(list_name)
+        options = catalog.list_options(advancement_list.id) if advancement_list is not None else ()
+
+    edges = set()
+    for option in options:
+        for requirement in option.requirements:
+            edges.add((option.attribute_id, requirement.attribute_id))
+
+    names = {}
+    for edge in edges:
+        for attribute_id in edge:
+            attribute = catalog.attributes.get(attribute_id)
+            if attribute is not None:
+                names[attribute_id] = attribute.name
+    return edges, names
+
+
+def load_prerequisite_graph(list_name=None, catalog=None):
+    """
+    Compile the prerequisite graph from the requirements of one or all advancement lists
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    edges, names = _graph_edges(list_name, catalog)
+    graph = PrerequisiteGraph(edges, names=names)
+    graph.version = catalog.version
+    return graph
+
+
+def update_prerequisite_graph(graph, list_name=None, catalog=None):
+    """
+    A copy of graph brought up to date with the catalog, updating only the attributes whose requirements changed
+
+    Compiles the graph from scratch when more than INCREMENTAL_LIMIT
+    attributes changed, or when applying the changes one at a time passes
+    through a cycle. graph itself is never changed.
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    edges, names = _graph_edges(list_name, catalog)
+    requires = {}
+    for attribute_id, requirement_id in edges:
+        requires.setdefault(attribute_id, set()).add(requirement_id)
+    changed = sorted(node for node in set(requires) | set(graph.requires)
+                     if requires.get(node, set()) != graph.requires.get(node, set()))
+
+    if len(changed) <= INCREMENTAL_LIMIT:
+        updated = graph.copy()
+        try:
+            for node in changed:
+                updated.set_requirements(node, requires.get(node, ()))
+        except PrerequisiteCycleError:
+            # swapping the direction of an edge cycles halfway through, the full compile decides
+            pass
+        else:
+            updated.names = names
+            updated.version = catalog.version
+            return updated
+
+    graph = PrerequisiteGraph(edges, names=names)
+    graph.version = catalog.version
+    return graph
+
+
+_graph_cache = {}
+_graph_lock = threading.Lock()
+
+
+def get_prerequisite_graph(list_name=None):
+    """
+    Return the prerequisite graph, brought up to date when the catalog changes
+    """
+    catalog = get_catalog()
+    graph = _graph_cache.get(list_name)
+    if graph is not None and graph.version == catalog.version:
+        return graph
+    with _graph_lock:
+        graph = _graph_cache.get(list_name)
+        if graph is None:
+            graph = load_prerequisite_graph(list_name, catalog)
+        elif graph.version != catalog.version:
+            graph = update_prerequisite_graph(graph, list_name, catalog)
+        _graph_cache[list_name] = graph
+    return graph
+
+
+def clear_graph_cache():
+    """
+    Drop compiled graphs so they are rebuilt on next use
+    """
+    with _graph_lock:
+        _graph_cache.clear()
@@ -0,0 +1,234 @@
+import datetime
+import re
+from collections import namedtuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+
+from . import db
+from .awards import character_balances, player_balances
+from .eligibility import character_ranks
+from .history import history_query, ranks_as_of
+from .identity import fetch_identity
+from .instrumentation import count_queries
+from .jobs import due_jobs
+from .models import AdvancementList, AdvancementListAttribute, AttributeChange, AwardLog, AwardType, Bucket, \
+    BucketTicket, Character, Role, User, ticket_access_lists, ticket_comments, user_roles
+from .sheets import load_character_sheet, sheet_stamp
+from .tickets import TicketAccess, queue_query, ticket_permissions
+
+
+# Query plan checks
+#
+# Runs the app's key queries against the current database, captures the SQL
+# they send and EXPLAINs every SELECT. A plan that reads a whole table instead
+# of searching an index fails the check, so a dropped index or a query
+# rewritten around one is caught before it reaches a large database. Key
+# queries need sample rows to run against, so check a seeded database.
+
+
+class QueryPlansUnavailable(Exception):
+    """
+    Raised when the database backend has no supported way to EXPLAIN a query
+    """
+
+
+PlanCheck = namedtuple('PlanCheck', ['query', 'statement', 'plan', 'full_scans'])
+
+# sample name -> primary key column the sample id is taken from
+SAMPLES = {
+    'character': Character.id,
+    'user': User.id,
+    'role': Role.id,
+    'award_type': AwardType.id,
+    'advancement_list': AdvancementList.id,
+    'ticket': BucketTicket.id,
+    'bucket': Bucket.id,
+}
+
+KEY_QUERIES = []
+
+
+def key_query(name, *samples):
+    """
+    Register a function as a key query, called with one sample id per name in samples
+    """
+    def decorator(function):
+        KEY_QUERIES.append((name, samples, function))
+        return function
+    return decorator
+
+
+@key_query('character sheet', 'character')
+def _character_sheet(character_id):
+    load_character_sheet(character_id, 'staff_review')
+
+
+@key_query('character sheet stamp', 'character')
+def _sheet_stamp(character_id):
+    sheet_stamp(character_id)
+
+
+@key_query('character ranks', 'character')
+def _character_ranks(character_id):
+    character_ranks(character_id)
+
+
+@key_query('character ranks as of a date', 'character')
+def _ranks_as_of(character_id):
+    ranks_as_of(character_id, datetime.datetime.utcnow())
+
+
+@key_query('character attribute history', 'character')
+def _attribute_history(character_id):
+    history_query(character_id).order_by(AttributeChange.changed_on.desc(), AttributeChange.id.desc()).limit(50).all()
+
+
+@key_query('character award balances', 'character')
+def _character_balances(character_id):
+    character_balances(character_id)
+
+
+@key_query('character award history', 'character', 'award_type')
+def _character_award_history(character_id, award_type_id):
+    AwardLog.query.filter(AwardLog.character_id == character_id, AwardLog.award_type_id == award_type_id) \
+        .order_by(AwardLog.award_date).all()
+
+
+@key_query('player award balances', 'user')
+def _player_balances(user_id):
+    player_balances(user_id)
+
+
+@key_query('logged-in identity', 'user')
+def _identity(user_id):
+    fetch_identity(user_id)
+
+
+@key_query('user characters', 'user')
+def _user_characters(user_id):
+    Character.query.filter(Character.user_id == user_id).all()
+
+
+@key_query('role member count', 'role')
+def _role_member_count(role_id):
+    db.session.execute(select([func.count()]).where(user_roles.c.role_id == role_id)).scalar()
+
+
+@key_query('advancement list options', 'advancement_list')
+def _list_options(list_id):
+    AdvancementListAttribute.query.options(selectinload(AdvancementListAttribute.requirements)) \
+        .filter(AdvancementListAttribute.advancement_list_id == list_id).all()
+
+
+@key_query('ticket queue', 'bucket')
+def _ticket_queue(bucket_id):
+    queue_query(bucket_id).order_by(BucketTicket.created_on, BucketTicket.id).limit(50).all()
+
+
+@key_query('ticket permissions', 'user')
+def _ticket_permissions(user_id):
+    ticket_permissions(user_id)
+
+
+@key_query('visible tickets', 'user')
+def _visible_tickets(user_id):
+    TicketAccess(user_id).filter(BucketTicket.query).order_by(BucketTicket.created_on.desc()).limit(50).all()
+
+
+@key_query('ticket comments', 'ticket')
+def _ticket_comments(ticket_id):
+    db.session.execute(select([ticket_comments]).where(ticket_comments.c.ticket_id == ticket_id)
+                       .order_by(ticket_comments.c.created_on)).fetchall()
+
+
+@key_query('ticket access', 'ticket', 'user')
+def _ticket_access(ticket_id, user_id):
+    db.session.execute(select([ticket_access_lists]).where((ticket_access_lists.c.ticket_id == ticket_id) &
+                                                           (ticket_access_lists.c.user_id == user_id))).fetchall()
+
+
+@key_query('job queue')
+def _job_queue():
+    db.session.execute(due_jobs(datetime.datetime.utcnow())).fetchall()
+
+
+def sample_ids():
+    """
+    Pick the newest row of every sample table, None where a table is empty
+    """
+    return dict((name, db.session.execute(select([func.max(column)])).scalar())
+                for name, column in SAMPLES.items())
+
+
+_sqlite_scan = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)')
+_sqlite_subquery = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+_postgres_scan = re.compile(r'Seq Scan on (\w+)')
+
+
+def explain(connection, statement, parameters):
+    """
+    Return the plan lines of a statement and the tables it scans in full
+    """
+    dialect = connection.dialect.name
+    cursor = connection.connection.cursor()
+    try:
+        if dialect == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+            # reading back a subquery SQLite already built is not a table scan
+            subqueries = set(match.group(1) for match in map(_sqlite_subquery.match, plan) if match)
+            scans = [match.group(1) for match in map(_sqlite_scan.match, plan)
+                     if match and match.group(1) not in subqueries]
+        elif dialect == 'postgresql':
+            # only fall back to a sequential scan when no index can answer the query
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+            scans = [match.group(1) for match in map(_postgres_scan.search, plan) if match]
+        elif dialect == 'mysql':
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            columns = [column[0].lower() for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            plan = ['{0}: {1} key={2} rows={3} {4}'.format(row['table'], row['type'], row['key'], row['rows'],
+                                                          row['extra'] or '').rstrip() for row in rows]
+            # <derivedN> and <subqueryN> are tables MySQL built itself
+            scans = [row['table'] for row in rows
+                     if row['type'] == 'ALL' and row['table'] and not row['table'].startswith('<')]
+        else:
+            raise QueryPlansUnavailable('Query plan checks are not supported on {}'.format(dialect))
+    finally:
+        cursor.close()
+    return plan, scans
+
+
+def check_query_plans():
+    """
+    EXPLAIN every SELECT issued by the key queries
+
+    Returns a (checks, skipped) pair: a list of PlanCheck and the names of
+    key queries that had no sample rows to run against.
+    """
+    samples = sample_ids()
+    checks = []
+    skipped = []
+    try:
+        for name, sample_names, function in KEY_QUERIES:
+            args = [samples[sample] for sample in sample_names]
+            if None in args:
+                skipped.append(name)
+                continue
+
+            db.session.expunge_all()
+            with count_queries() as counter:
+                function(*args)
+
+            connection = db.session.connection()
+            for statement, parameters, executemany in counter.executions:
+                if executemany or not statement.lstrip().upper().startswith('SELECT'):
+                    continue
+                plan, scans = explain(connection, statement, parameters)
+                checks.append(PlanCheck(name, statement, plan, scans))
+    finally:
+        db.session.rollback()
+    return checks, skipped
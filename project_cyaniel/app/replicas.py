@@ -0,0 +1,250 @@
+import functools
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session as user_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import literal_column, orm, select, text
+
+from .database import EngineConfigError
+
+
+# Read replicas
+#
+# DATABASE_REPLICAS lists replica URIs, registered as replica0, replica1...
+# binds. RoutingSession sends a request's SELECTs to one replica when the
+# request is a GET (or the view is marked @use_replica) and everything else
+# to the primary: flushes, DML, SELECT ... FOR UPDATE, raw connections, text
+# statements, CLI commands and jobs. A raw session.connection() counts as a
+# write, as Core writes go through it; reads outside the ORM use
+# read_connection instead. Once a request has written, its later reads go to
+# the primary too, and so do the user's requests for the next
+# DATABASE_REPLICA_MAX_LAG seconds, so a redirect after a form shows the
+# change. A replica whose lag is over DATABASE_REPLICA_MAX_LAG, or whose lag
+# cannot be read, is skipped until its next check. With no replica left the
+# request reads from the primary.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+BIND_PREFIX = 'replica'
+PRIMARY_UNTIL = '_db_primary_until'
+# stands in for the statements run on a read_connection when choosing its bind
+_READ_ONLY = select([literal_column('1')])
+
+_LAG_QUERIES = {
+    # a replica that has replayed everything it received is current, however old its last replayed commit
+    'postgresql': "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                  "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END",
+    'mysql': 'SHOW SLAVE STATUS',
+}
+
+
+def replica_lag(engine):
+    """
+    Seconds a replica is behind its primary, None when replication is not running
+    """
+    with engine.connect() as connection:
+        query = _LAG_QUERIES.get(connection.dialect.name)
+        if query is None:
+            return 0.0
+        result = connection.execute(text(query))
+        if connection.dialect.name == 'mysql':
+            status = result.mappings().first()
+            if status is None:
+                # not replicating, a copy that only receives scheduled loads
+                return 0.0
+            lag = status.get('Seconds_Behind_Master')
+        else:
+            lag = result.scalar()
+    return float(lag) if lag is not None else None
+
+
+class ReplicaRouter(object):
+    """
+    Tracks the configured replicas of an app and the lag last measured for each
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # bind key -> (checked at, lag or None)
+        self._lag = {}
+
+    def init_app(self, app):
+        app.extensions['replica_router'] = self
+        replicas = app.config.get('DATABASE_REPLICAS') or []
+        if isinstance(replicas, str) or not all(isinstance(uri, str) and uri for uri in replicas):
+            raise EngineConfigError('DATABASE_REPLICAS must be a list of database URIs, got {!r}'.format(replicas))
+        for name in ('DATABASE_REPLICA_MAX_LAG', 'DATABASE_REPLICA_LAG_CHECK'):
+            value = app.config.get(name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise EngineConfigError('{0} must be a number of at least 0, got {1!r}'.format(name, value))
+
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for index, uri in enumerate(replicas):
+            binds['{0}{1}'.format(BIND_PREFIX, index)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        app.config['DATABASE_REPLICA_BINDS'] = ['{0}{1}'.format(BIND_PREFIX, index) for index in range(len(replicas))]
+        if replicas:
+            app.after_request(self._remember_write)
+
+    def _remember_write(self, response):
+        if g.get('db_wrote'):
+            user_session[PRIMARY_UNTIL] = time.time() + current_app.config['DATABASE_REPLICA_MAX_LAG']
+        return response
+
+    def lag(self, app, key):
+        """
+        The lag of one replica, measured again once DATABASE_REPLICA_LAG_CHECK seconds have passed
+        """
+        now = time.time()
+        with self._lock:
+            checked = self._lag.get((app.name, key))
+        if checked is not None and now - checked[0] < app.config['DATABASE_REPLICA_LAG_CHECK']:
+            return checked[1]
+        try:
+            lag = replica_lag(get_state(app).db.get_engine(app, bind=key))
+        except Exception as error:
+            app.logger.warning('Skipping replica %s, its lag could not be read: %s', key, error)
+            lag = None
+        with self._lock:
+            self._lag[(app.name, key)] = (now, lag)
+        return lag
+
+    def healthy_replicas(self, app):
+        """
+        The bind keys of the replicas whose lag is within DATABASE_REPLICA_MAX_LAG
+        """
+        max_lag = app.config['DATABASE_REPLICA_MAX_LAG']
+        healthy = []
+        for key in app.config.get('DATABASE_REPLICA_BINDS', ()):
+            lag = self.lag(app, key)
+            if lag is not None and lag <= max_lag:
+                healthy.append(key)
+        return healthy
+
+    def replica_for_request(self, app):
+        """
+        The bind key this request reads from, picked once per request, None for the primary
+        """
+        if 'db_replica' not in g:
+            healthy = self.healthy_replicas(app)
+            g.db_replica = random.choice(healthy) if healthy else None
+        return g.db_replica
+
+    def status(self, app):
+        """
+        The last measured lag of every replica, for the instrumentation page
+        """
+        max_lag = app.config['DATABASE_REPLICA_MAX_LAG']
+        with self._lock:
+            measured = dict(self._lag)
+        status = []
+        for key in app.config.get('DATABASE_REPLICA_BINDS', ()):
+            checked_at, lag = measured.get((app.name, key), (None, None))
+            status.append({'replica': key, 'lag': lag, 'checked_at': checked_at,
+                           'healthy': lag is not None and lag <= max_lag})
+        return status
+
+
+replica_router = ReplicaRouter()
+
+
+def _pin_to_primary(wrote):
+    if has_request_context():
+        g.db_pinned = True
+        if wrote:
+            g.db_wrote = True
+
+
+def _statement_reads_from_replica(session, clause):
+    """
+    Whether a statement may run on a replica, pinning the request to the primary once it writes
+    """
+    # session.connection() is how Core writes reach the session, read_connection is for reads
+    if session._flushing or clause is None or getattr(clause, 'is_dml', False):
+        _pin_to_primary(wrote=True)
+        return False
+    if getattr(clause, '_for_update_arg', None) is not None:
+        # rows locked for a write
+        _pin_to_primary(wrote=False)
+        return False
+    # text() and other statements may write
+    return getattr(clause, 'is_select', False)
+
+
+def _request_reads_from_replica(app):
+    if not has_request_context() or not app.config.get('DATABASE_REPLICA_BINDS'):
+        return False
+    route = g.get('db_route')
+    if route == 'primary' or g.get('db_pinned'):
+        return False
+    if route != 'replica' and request.method not in SAFE_METHODS:
+        return False
+    # the user wrote recently, and the replicas may not have that change yet
+    return user_session.get(PRIMARY_UNTIL, 0) <= time.time()
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session that reads from a replica when the request allows it
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if _statement_reads_from_replica(self, clause) and _request_reads_from_replica(self.app):
+            key = replica_router.replica_for_request(self.app)
+            if key is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=key)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with RoutingSession as its session class
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_engine():
+    """
+    The engine for reads outside the session, a replica under the same rules as RoutingSession
+    """
+    app = current_app._get_current_object()
+    db = get_state(app).db
+    if _request_reads_from_replica(app):
+        key = replica_router.replica_for_request(app)
+        if key is not None:
+            return db.get_engine(app, bind=key)
+    return db.engine
+
+
+def read_connection(session):
+    """
+    A session connection for SELECTs only, on a replica when the request allows it
+
+    session.connection() always means the primary, since the caller may write on it.
+    """
+    return session.connection(bind_arguments={'clause': _READ_ONLY})
+
+
+def use_replica(view):
+    """
+    Read from a replica in this view whatever the request method, for POSTed reports and searches
+    """
+    @functools.wraps(view)
+    def decorated_view(*args, **kwargs):
+        g.db_route = 'replica'
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def use_primary(view):
+    """
+    Read from the primary in this view, for GET views that write or must see the latest data
+    """
+    @functools.wraps(view)
+    def decorated_view(*args, **kwargs):
+        g.db_route = 'primary'
+        return view(*args, **kwargs)
+    return decorated_view
@@ -0,0 +1,288 @@
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, null, select, text
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Attribute, BucketTicket, Character, CharacterNotes, Items
+from .replicas import read_connection
+
+
+# Full-text search
+#
+# Character names, character notes, items, attributes and ticket titles are
+# copied into one search_index table: an FTS5 virtual table on SQLite, a
+# table with a GIN indexed tsvector on Postgres. Every document has a fixed
+# id of ref_id * 8 + the code of its kind, so a changed row is replaced with
+# two primary key statements. Rows written through the ORM are re-indexed in
+# the same flush; bulk writers and older rows are picked up by
+# flask reindex-search, which can limit itself to rows changed since a date.
+
+SearchKind = namedtuple('SearchKind', ['code', 'name', 'label', 'model', 'title', 'body', 'parent', 'modified'])
+SearchResult = namedtuple('SearchResult', ['kind', 'ref_id', 'parent_id', 'title', 'snippet', 'score'])
+
+KINDS = OrderedDict((kind.name, kind) for kind in (
+    SearchKind(1, 'character', 'Character', Character, 'character_name', None, None, 'last_update'),
+    SearchKind(2, 'note', 'Character note', CharacterNotes, 'title', 'body', 'character_id', None),
+    SearchKind(3, 'item', 'Item', Items, 'item_name', 'description', None, 'last_update'),
+    SearchKind(4, 'attribute', 'Attribute', Attribute, 'attribute_name', 'description', None, None),
+    SearchKind(5, 'ticket', 'Ticket', BucketTicket, 'title', None, 'bucket_id', 'last_modified'),
+))
+KIND_CODES = 8
+BATCH_SIZE = 500
+
+# snippet highlight markers, turned into <mark> tags after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "kind UNINDEXED, ref_id UNINDEXED, parent_id UNINDEXED, title, body, "
+    "tokenize = 'porter unicode61 remove_diacritics 1')",
+)
+_POSTGRES_DDL = (
+    "CREATE TABLE IF NOT EXISTS search_index ("
+    "id BIGINT PRIMARY KEY, kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL, parent_id INTEGER, "
+    "title TEXT, body TEXT, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_parent ON search_index (kind, parent_id)",
+)
+_POSTGRES_DOCUMENT = "setweight(to_tsvector('english', coalesce(:title, '')), 'A') || " \
+                     "setweight(to_tsvector('english', coalesce(:body, '')), 'B')"
+
+# seconds before a database without a search_index table is checked again,
+# so an index created by another process is picked up without a restart
+RECHECK_INTERVAL = 60
+
+# engine -> True once its database has a search_index table, or when it was last found without one
+_available = {}
+
+
+class SearchUnavailable(Exception):
+    """
+    Raised when the database backend has no full-text search support, or its search index was not built
+    """
+
+
+def document_id(kind, ref_id):
+    return ref_id * KIND_CODES + KINDS[kind].code
+
+
+def _dialect(connection):
+    name = connection.dialect.name
+    if name not in ('sqlite', 'postgresql'):
+        raise SearchUnavailable('Full-text search is not supported on {}'.format(name))
+    return name
+
+
+def create_search_index(connection):
+    """
+    Create the search_index table if it does not exist yet
+    """
+    ddl = _SQLITE_DDL if _dialect(connection) == 'sqlite' else _POSTGRES_DDL
+    for statement in ddl:
+        connection.execute(text(statement))
+    _available[connection.engine] = True
+
+
+def search_available(connection):
+    """
+    Whether the database behind connection has a search index to keep in sync
+    """
+    if connection.dialect.name not in ('sqlite', 'postgresql'):
+        return False
+    engine = connection.engine
+    checked = _available.get(engine)
+    if checked is True:
+        return True
+    now = time.time()
+    if checked is not None and now - checked < RECHECK_INTERVAL:
+        return False
+    _available[engine] = True if connection.dialect.has_table(connection, 'search_index') else now
+    return _available[engine] is True
+
+
+def _delete(connection, document_ids):
+    if document_ids:
+        connection.execute(text('DELETE FROM search_index WHERE {} IN ({})'.format(
+            'rowid' if connection.dialect.name == 'sqlite' else 'id', ', '.join(map(str, document_ids)))))
+
+
+def index_documents(connection, kind, ref_ids):
+    """
+    Replace the documents of the given rows of one kind, removing those of rows that no longer exist
+    """
+    search_kind = KINDS[kind]
+    table = search_kind.model.__table__
+    columns = [table.c.id, table.c[search_kind.title],
+               table.c[search_kind.body] if search_kind.body else null(),
+               table.c[search_kind.parent] if search_kind.parent else null()]
+
+    ref_ids = sorted(set(ref_ids))
+    indexed = 0
+    for start in range(0, len(ref_ids), BATCH_SIZE):
+        batch = ref_ids[start:start + BATCH_SIZE]
+        _delete(connection, [document_id(kind, ref_id) for ref_id in batch])
+        rows = [{
+            'id': document_id(kind, row[0]),
+            'kind': kind,
+            'ref_id': row[0],
+            'parent_id': row[3],
+            'title': row[1],
+            'body': row[2],
+        } for row in connection.execute(select(columns).where(table.c.id.in_(batch)))]
+        if not rows:
+            continue
+        if connection.dialect.name == 'sqlite':
+            statement = 'INSERT INTO search_index (rowid, kind, ref_id, parent_id, title, body) ' \
+                        'VALUES (:id, :kind, :ref_id, :parent_id, :title, :body)'
+        else:
+            statement = 'INSERT INTO search_index (id, kind, ref_id, parent_id, title, body, document) ' \
+                        'VALUES (:id, :kind, :ref_id, :parent_id, :title, :body, {})'.format(_POSTGRES_DOCUMENT)
+        connection.execute(text(statement), rows)
+        indexed += len(rows)
+    return indexed
+
+
+def remove_children(connection, kind, parent_ids):
+    """
+    Remove the documents of one kind that belong to deleted parent rows
+    """
+    if parent_ids:
+        connection.execute(text('DELETE FROM search_index WHERE kind = :kind AND parent_id IN ({})'.format(
+            ', '.join(map(str, sorted(parent_ids))))), {'kind': kind})
+
+
+def _incremental(kind):
+    return KINDS[kind].modified is not None or kind == 'note'
+
+
+def _changed_ids(kind, since):
+    search_kind = KINDS[kind]
+    table = search_kind.model.__table__
+    query = select([table.c.id])
+    if since is not None and _incremental(kind):
+        if search_kind.modified:
+            query = query.where(table.c[search_kind.modified] >= since)
+        else:
+            # note changes touch the last_update of their character
+            characters = Character.__table__
+            query = query.where(table.c.character_id.in_(
+                select([characters.c.id]).where(characters.c.last_update >= since)))
+    return query.order_by(table.c.id)
+
+
+def reindex(kinds=None, since=None, batch_size=BATCH_SIZE):
+    """
+    Rebuild the search index, committing after every batch of rows
+
+    With since, only rows changed at or after that datetime are re-indexed;
+    kinds without a change date, such as attributes, are always re-indexed in
+    full. Without since, documents of rows that no longer exist are removed
+    as well. Returns a list of (kind, indexed documents) pairs.
+    """
+    connection = db.session.connection()
+    create_search_index(connection)
+    report = []
+    for kind in kinds or KINDS:
+        query = _changed_ids(kind, since)
+        table = KINDS[kind].model.__table__
+        indexed = 0
+        last_id = 0
+        while True:
+            connection = db.session.connection()
+            batch = [row[0] for row in connection.execute(query.where(table.c.id > last_id).limit(batch_size))]
+            if not batch:
+                break
+            indexed += index_documents(connection, kind, batch)
+            last_id = batch[-1]
+            db.session.commit()
+        if since is None or not _incremental(kind):
+            db.session.execute(text('DELETE FROM search_index WHERE kind = :kind AND ref_id NOT IN '
+                                    '(SELECT id FROM {})'.format(table.name)), {'kind': kind})
+            db.session.commit()
+        report.append((kind, indexed))
+    return report
+
+
+_word = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    return _word.findall(query or '')
+
+
+def search(query, kinds=None, limit=50):
+    """
+    Rank the documents matching every word of query, each word matching as a prefix
+
+    Returns a list of SearchResult, best match first. Title matches count ten
+    times as much as body matches on SQLite and get the higher tsvector weight
+    on Postgres.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+    connection = read_connection(db.session)
+    dialect = _dialect(connection)
+    if not search_available(connection):
+        raise SearchUnavailable('The search index has not been built, run flask reindex-search')
+    kind_filter = 'AND kind IN ({})'.format(', '.join("'{}'".format(kind) for kind in kinds))
+
+    if dialect == 'sqlite':
+        statement = text(
+            "SELECT kind, ref_id, parent_id, title, "
+            "snippet(search_index, -1, :start, :end, '...', 16) AS snippet, "
+            "bm25(search_index, 0, 0, 0, 10.0, 1.0) AS score "
+            "FROM search_index WHERE search_index MATCH :match {} "
+            "ORDER BY score LIMIT :limit".format(kind_filter))
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+    else:
+        statement = text(
+            "SELECT kind, ref_id, parent_id, title, "
+            "ts_headline('english', coalesce(title, '') || ' ' || coalesce(body, ''), query, "
+            "'StartSel=' || :start || ', StopSel=' || :end || ', MaxWords=16, MinWords=6') AS snippet, "
+            "ts_rank_cd(document, query) AS score "
+            "FROM search_index, to_tsquery('english', :match) AS query WHERE document @@ query {} "
+            "ORDER BY score DESC LIMIT :limit".format(kind_filter))
+        match = ' & '.join('{}:*'.format(term) for term in terms)
+
+    rows = connection.execute(statement, {'match': match, 'limit': limit,
+                                          'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END})
+    return [SearchResult(row.kind, row.ref_id, row.parent_id, row.title, row.snippet, row.score) for row in rows]
+
+
+def highlight(snippet):
+    """
+    Escape a result snippet and wrap its matched words in <mark> tags
+    """
+    return Markup(escape(snippet or '').replace(HIGHLIGHT_START, Markup('<mark>'))
+                  .replace(HIGHLIGHT_END, Markup('</mark>')))
+
+
+@event.listens_for(Session, 'after_flush')
+def _index_flushed(session, flush_context):
+    changed = {}
+    removed_characters = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        for kind in KINDS.values():
+            if not isinstance(instance, kind.model):
+                continue
+            if instance in session.dirty and not session.is_modified(instance):
+                continue
+            changed.setdefault(kind.name, set()).add(instance.id)
+            if kind.name == 'character' and instance in session.deleted:
+                removed_characters.add(instance.id)
+
+    if not changed:
+        return
+    connection = session.connection()
+    if not search_available(connection):
+        return
+    for kind, ref_ids in changed.items():
+        index_documents(connection, kind, ref_ids)
+    remove_children(connection, 'note', removed_characters)
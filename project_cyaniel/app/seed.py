@@ -0,0 +1,181 @@
+import json
+import os
+import time
+
+from sqlalchemy import func, select
+
+from . import db
+from .catalog import CATALOG_VERSION
+from .models import AdvancementList, AdvancementListAttribute, Attribute, AttributeType, \
+    advancement_list_requirements
+from .prerequisites import PrerequisiteCycleError, PrerequisiteGraph
+from .versions import bump_version
+
+
+# Catalog seeding
+#
+# Loads the game catalog from a declarative JSON file. Every stage reads what
+# already exists, inserts only what is missing with a single executemany, and
+# the whole seed runs in one transaction, so running it twice is harmless.
+
+DEFAULT_CATALOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'catalog.json')
+
+
+class SeedError(Exception):
+    """
+    Raised when the catalog file refers to something it does not define, or its requirements form a cycle
+    """
+
+
+def load_catalog_file(path=DEFAULT_CATALOG_FILE):
+    with open(path) as catalog_file:
+        return json.load(catalog_file)
+
+
+def _names_to_ids(table, name_column):
+    rows = db.session.execute(select([table.c.id, name_column]))
+    return dict((name, id) for id, name in rows)
+
+
+def _insert_missing(table, name_column, rows):
+    """
+    Insert the rows whose name is not in the table yet and return the name -> id map
+    """
+    existing = _names_to_ids(table, name_column)
+    missing = []
+    for row in rows:
+        if row[name_column.key] not in existing:
+            missing.append(row)
+            existing[row[name_column.key]] = None
+    if missing:
+        db.session.execute(table.insert(), missing)
+        existing = _names_to_ids(table, name_column)
+    return existing, len(missing)
+
+
+def _next_id(table):
+    return (db.session.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+
+
+def sync_sequence(table):
+    """
+    Move a Postgres id sequence past explicitly inserted ids
+    """
+    if db.session.connection().dialect.name == 'postgresql':
+        db.session.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                           "(SELECT MAX(id) FROM {0}))".format(table.name))
+
+
+def _option_spec(option):
+    if isinstance(option, dict):
+        return option['attribute'], tuple(option.get('requires', ()))
+    return option, ()
+
+
+def seed_catalog(data, commit=True):
+    """
+    Seed attribute types, attributes, advancement lists and their options from catalog data
+
+    Returns a list of (stage, inserted rows, seconds) tuples.
+    """
+    report = []
+
+    def timed(stage, started, count):
+        report.append((stage, count, time.time() - started))
+
+    # attribute types
+    started = time.time()
+    type_table = AttributeType.__table__
+    type_ids, count = _insert_missing(type_table, type_table.c.name,
+                                      [{'name': group['name']} for group in data['attribute_types']])
+    timed('attribute types', started, count)
+
+    # attributes
+    started = time.time()
+    attribute_table = Attribute.__table__
+    rows = []
+    for group in data['attribute_types']:
+        for name in group['attributes']:
+            rows.append({'attribute_name': name, 'attribute_type_id': type_ids[group['name']]})
+    attribute_ids, count = _insert_missing(attribute_table, attribute_table.c.attribute_name, rows)
+    timed('attributes', started, count)
+
+    # advancement lists
+    started = time.time()
+    list_table = AdvancementList.__table__
+    list_ids, count = _insert_missing(list_table, list_table.c.name,
+                                      [{'name': advancement_list['name'],
+                                        'is_chargen_only': advancement_list.get('is_chargen_only', False),
+                                        'is_staff_only': advancement_list.get('is_staff_only', False)}
+                                       for advancement_list in data['advancement_lists']])
+    timed('advancement lists', started, count)
+
+    # advancement list options and their requirements, keyed on
+    # (list, attribute, requirements) since a skill can be offered more than
+    # once in a list behind different requirements
+    started = time.time()
+    option_table = AdvancementListAttribute.__table__
+    requirement_table = advancement_list_requirements
+
+    requirements = {}
+    for option_id, attribute_id in db.session.execute(select([requirement_table.c.advancement_list_attribute_id,
+                                                              requirement_table.c.attribute_requirement_id])):
+        requirements.setdefault(option_id, set()).add(attribute_id)
+    existing = set()
+    for option_id, list_id, attribute_id in db.session.execute(select([option_table.c.id,
+                                                                       option_table.c.advancement_list_id,
+                                                                       option_table.c.attribute_id])):
+        existing.add((list_id, attribute_id, frozenset(requirements.get(option_id, ()))))
+
+    def attribute_id(name):
+        if name not in attribute_ids:
+            raise SeedError('Unknown attribute: {}'.format(name))
+        return attribute_ids[name]
+
+    next_id = _next_id(option_table)
+    option_rows = []
+    requirement_rows = []
+    for advancement_list in data['advancement_lists']:
+        list_id = list_ids[advancement_list['name']]
+        for option in advancement_list['options']:
+            name, required = _option_spec(option)
+            key = (list_id, attribute_id(name), frozenset(attribute_id(req) for req in required))
+            if key in existing:
+                continue
+            existing.add(key)
+            # explicit ids let the requirement rows reference options inserted in the same batch
+            option_rows.append({'id': next_id, 'advancement_list_id': list_id, 'attribute_id': key[1],
+                                'is_staff_only': False, 'is_free_with_requirements': False})
+            requirement_rows.extend({'advancement_list_attribute_id': next_id,
+                                     'attribute_requirement_id': requirement_id,
+                                     'requirement_rank': None} for requirement_id in key[2])
+            next_id += 1
+
+    if option_rows:
+        db.session.execute(option_table.insert(), option_rows)
+        sync_sequence(option_table)
+    timed('advancement options', started, len(option_rows))
+
+    started = time.time()
+    if requirement_rows:
+        db.session.execute(requirement_table.insert(), requirement_rows)
+    timed('advancement requirements', started, len(requirement_rows))
+
+    # a cycle would only surface once a page asks for prerequisites
+    edges = select([option_table.c.attribute_id, requirement_table.c.attribute_requirement_id]) \
+        .select_from(requirement_table.join(
+            option_table, option_table.c.id == requirement_table.c.advancement_list_attribute_id)) \
+        .where(requirement_table.c.attribute_requirement_id.isnot(None))
+    try:
+        PrerequisiteGraph(db.session.execute(edges).fetchall())
+    except PrerequisiteCycleError as error:
+        if commit:
+            db.session.rollback()
+        raise SeedError(str(error))
+
+    if any(count for stage, count, seconds in report):
+        bump_version(CATALOG_VERSION)
+
+    if commit:
+        db.session.commit()
+    return report
@@ -0,0 +1,204 @@
+import datetime
+from collections import namedtuple
+
+from flask import abort, current_app
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from . import db
+from .catalog import CATALOG_VERSION
+from .instrumentation import query_budget
+from .models import Attribute, AwardBalance, AwardLog, Character, CharacterNotes, DataVersion, Inventory, User, \
+    character_attributes
+
+
+# Character sheet repository
+#
+# Each loading profile names the relationships a page needs and how many
+# queries loading them may take. Everything a profile renders is loaded up
+# front so templates never trigger lazy loads.
+
+
+class LoadProfile(object):
+    """
+    A named set of eager loading options with a fixed query budget
+    """
+
+    def __init__(self, name, options, budget, with_ranks=False, with_rank_details=False):
+        self.name = name
+        self.options = options
+        self.budget = budget
+        self.with_ranks = with_ranks
+        self.with_rank_details = with_rank_details
+
+
+class CharacterAttribute(object):
+    """
+    An attribute held by a character along with its rank
+    """
+
+    def __init__(self, attribute, rank, last_modified=None, comments=None):
+        self.attribute = attribute
+        self.rank = rank
+        self.last_modified = last_modified
+        self.comments = comments
+
+
+class CharacterSheet(object):
+    """
+    A fully loaded character and its ranked attributes
+    """
+
+    def __init__(self, character, profile, attributes=None):
+        self.character = character
+        self.profile = profile
+        self.attributes = attributes or []
+
+    def ranks(self):
+        """
+        Map attribute id to rank
+        """
+        return dict((entry.attribute.id, entry.rank) for entry in self.attributes)
+
+
+def _sheet_options(user_option=None):
+    return [
+        user_option or joinedload(Character.user),
+        selectinload(Character.awards).joinedload(AwardLog.award_type),
+        selectinload(Character.items).joinedload(Inventory.item),
+        selectinload(Character.notes),
+    ]
+
+
+LOAD_PROFILES = {
+    # character and owner only: one joined query
+    'summary': LoadProfile('summary', [joinedload(Character.user)], budget=1),
+    # character, awards, items, notes and ranked attributes
+    'full_sheet': LoadProfile('full_sheet', _sheet_options(), budget=5, with_ranks=True),
+    # full sheet plus the owner's roles and attribute audit columns
+    'staff_review': LoadProfile('staff_review',
+                                _sheet_options(joinedload(Character.user).selectinload(User.roles)),
+                                budget=6, with_ranks=True, with_rank_details=True),
+}
+
+
+def _load_attributes(character_id, with_details):
+    """
+    Load a character's attributes, their types and ranks in a single query
+    """
+    columns = [Attribute, character_attributes.c.rank]
+    if with_details:
+        columns += [character_attributes.c.last_modified, character_attributes.c.comments]
+
+    rows = db.session.query(*columns) \
+        .join(character_attributes, character_attributes.c.attribute_id == Attribute.id) \
+        .options(joinedload(Attribute.attribute_type)) \
+        .filter(character_attributes.c.character_id == character_id) \
+        .order_by(Attribute.attribute_type_id, Attribute.attribute_name) \
+        .all()
+
+    return [CharacterAttribute(*row) for row in rows]
+
+
+def load_character_sheet(character_id, profile='full_sheet'):
+    """
+    Load a character using the named profile, or return None if it does not exist
+
+    Raises QueryBudgetExceeded when the profile goes over its query budget and
+    ENFORCE_QUERY_BUDGETS is set, otherwise the overrun is only logged.
+    """
+    load_profile = LOAD_PROFILES[profile]
+    name = 'character sheet profile "{}"'.format(profile)
+    enforce = current_app.config.get('ENFORCE_QUERY_BUDGETS', False)
+
+    sheet = None
+    with query_budget(name, load_profile.budget, enforce) as counter:
+        character = Character.query.options(*load_profile.options) \
+            .filter(Character.id == character_id) \
+            .first()
+        if character is not None:
+            sheet = CharacterSheet(character, profile)
+            if load_profile.with_ranks:
+                sheet.attributes = _load_attributes(character_id, load_profile.with_rank_details)
+
+    if counter.count > load_profile.budget:
+        current_app.logger.warning('%s issued %d queries, budget is %d', name, counter.count, load_profile.budget)
+
+    return sheet
+
+
+def get_sheet_or_404(character_id, profile='full_sheet'):
+    """
+    Load a character sheet or abort with a 404
+    """
+    sheet = load_character_sheet(character_id, profile)
+    if sheet is None:
+        abort(404)
+    return sheet
+
+
+# Sheet stamps
+#
+# A sheet changes when the character, its owner, its ranks, its award
+# balances or the catalog behind its names change. The stamp reads all of
+# those timestamps in one query, so clients can be told a sheet is unchanged
+# without loading it. Inventory and notes have no timestamp of their own;
+# changing them, or the character's attribute collection, touches
+# Character.last_update instead.
+
+SheetStamp = namedtuple('SheetStamp', ['character_id', 'user_id', 'character_update', 'owner_update',
+                                       'ranks_update', 'awards_update', 'catalog_version'])
+
+
+def sheet_stamp(character_id):
+    """
+    Read the change markers of a character sheet, or return None if the character does not exist
+    """
+    characters = Character.__table__
+    users = User.__table__
+    ranks_update = select([func.max(character_attributes.c.last_modified)]) \
+        .where(character_attributes.c.character_id == characters.c.id).as_scalar()
+    awards_update = select([func.max(AwardBalance.__table__.c.last_update)]) \
+        .where(AwardBalance.__table__.c.character_id == characters.c.id).as_scalar()
+    catalog_version = select([DataVersion.__table__.c.version]) \
+        .where(DataVersion.__table__.c.name == CATALOG_VERSION).as_scalar()
+
+    row = db.session.execute(select([characters.c.id, characters.c.user_id, characters.c.last_update,
+                                     users.c.last_update, ranks_update, awards_update, catalog_version])
+                             .select_from(characters.join(users, users.c.id == characters.c.user_id))
+                             .where(characters.c.id == character_id)).first()
+    if row is None:
+        return None
+    return SheetStamp(*row)
+
+
+def stamp_last_modified(stamp):
+    """
+    The newest timestamp in a sheet stamp
+    """
+    dates = [date for date in (stamp.character_update, stamp.owner_update, stamp.ranks_update,
+                               stamp.awards_update) if date is not None]
+    return max(dates) if dates else None
+
+
+def _character_ids(instance):
+    state = inspect(instance)
+    history = state.attrs.character_id.history
+    return set(id for id in list(history.deleted) + [instance.character_id] if id is not None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _touch_characters(session, flush_context):
+    character_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, (Inventory, CharacterNotes)):
+            character_ids |= _character_ids(instance)
+        elif isinstance(instance, Character) and instance not in session.new and instance not in session.deleted:
+            if inspect(instance).attrs.attributes.history.has_changes():
+                character_ids.add(instance.id)
+
+    if character_ids:
+        characters = Character.__table__
+        session.connection().execute(characters.update()
+                                     .where(characters.c.id.in_(sorted(character_ids)))
+                                     .values(last_update=datetime.datetime.utcnow()))
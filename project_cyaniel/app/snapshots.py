@@ -0,0 +1,278 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, MetaData, String, Table, Text, create_engine, \
+    select
+
+from .catalog import CATALOG_VERSION
+from .models import Attribute, AttributeType, Character, CharacterNotes, Inventory, Items, User, \
+    character_attributes
+from .replicas import read_engine
+from .versions import get_version
+
+
+# Event-day snapshots
+#
+# Check-in devices at sites without connectivity work from a self-contained
+# SQLite file holding players, characters, their attributes, inventory and
+# notes, and the rules catalog. Password hashes, birth dates and awards are
+# left out. A delta has the same layout but only carries the players and
+# characters changed since the device's snapshot, the full sheet of every
+# changed character, the catalog only when its data version moved, and the
+# ids of every live player and character so deletions can be applied. Sheet
+# changes touch characters.last_update, so last_update alone decides what a
+# delta carries. apply_delta only needs the sqlite3 module.
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 1000
+# deltas start this long before the base snapshot, for rows committed by transactions still open at the time
+SYNC_OVERLAP = datetime.timedelta(minutes=5)
+
+snapshot_metadata = MetaData()
+
+snapshot_info = Table('snapshot_info', snapshot_metadata,
+                      Column('key', String(32), primary_key=True),
+                      Column('value', String(64)))
+
+snapshot_users = Table('users', snapshot_metadata,
+                       Column('id', Integer, primary_key=True),
+                       Column('email', String(60)),
+                       Column('user_name', String(200)),
+                       Column('first_name', String(60)),
+                       Column('last_name', String(60)),
+                       Column('phone', String(20)),
+                       Column('emergency_contact_name', String(60)),
+                       Column('emergency_contact_number', String(20)),
+                       Column('is_admin', Boolean),
+                       Column('last_update', DateTime))
+
+snapshot_attribute_types = Table('attribute_types', snapshot_metadata,
+                                 Column('id', Integer, primary_key=True),
+                                 Column('name', String(200)))
+
+snapshot_attributes = Table('attributes', snapshot_metadata,
+                            Column('id', Integer, primary_key=True),
+                            Column('attribute_name', String(200)),
+                            Column('description', String(200)),
+                            Column('attribute_type_id', Integer))
+
+snapshot_items = Table('items', snapshot_metadata,
+                       Column('id', Integer, primary_key=True),
+                       Column('item_name', String(200)),
+                       Column('description', Text),
+                       Column('item_attr', Text),
+                       Column('last_update', DateTime))
+
+snapshot_characters = Table('characters', snapshot_metadata,
+                            Column('id', Integer, primary_key=True),
+                            Column('character_name', String(60)),
+                            Column('user_id', Integer, index=True),
+                            Column('create_date', DateTime),
+                            Column('last_update', DateTime))
+
+snapshot_character_attributes = Table('character_attributes', snapshot_metadata,
+                                      Column('character_id', Integer),
+                                      Column('attribute_id', Integer),
+                                      Column('rank', Integer),
+                                      Column('last_modified', DateTime),
+                                      Index('ix_character_attributes_character_id', 'character_id'))
+
+snapshot_inventory = Table('inventory', snapshot_metadata,
+                           Column('id', Integer, primary_key=True),
+                           Column('character_id', Integer, index=True),
+                           Column('item_id', Integer),
+                           Column('quantity', Integer))
+
+snapshot_notes = Table('character_notes', snapshot_metadata,
+                       Column('id', Integer, primary_key=True),
+                       Column('character_id', Integer, index=True),
+                       Column('title', String(200)),
+                       Column('body', Text))
+
+# ids of every live row, only present in deltas
+snapshot_live_users = Table('live_users', snapshot_metadata, Column('id', Integer, primary_key=True))
+snapshot_live_characters = Table('live_characters', snapshot_metadata, Column('id', Integer, primary_key=True))
+
+CATALOG_TABLES = ('attribute_types', 'attributes', 'items')
+SHEET_TABLES = ('character_attributes', 'inventory', 'character_notes')
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot file cannot be read or a delta does not fit it
+    """
+
+
+def _source_queries(since, include_catalog):
+    """
+    List (target table, select) pairs for a full snapshot, or a delta when since is given
+    """
+    users = User.__table__
+    characters = Character.__table__
+    changed_users = select([users.c[column.name] for column in snapshot_users.columns])
+    changed_characters = select([characters.c[column.name] for column in snapshot_characters.columns])
+    character_ids = select([characters.c.id])
+    if since is not None:
+        changed_users = changed_users.where(users.c.last_update >= since)
+        changed_characters = changed_characters.where(characters.c.last_update >= since)
+        character_ids = character_ids.where(characters.c.last_update >= since)
+
+    queries = [(snapshot_users, changed_users.order_by(users.c.id)),
+               (snapshot_characters, changed_characters.order_by(characters.c.id))]
+    for target, source in ((snapshot_character_attributes, character_attributes),
+                           (snapshot_inventory, Inventory.__table__),
+                           (snapshot_notes, CharacterNotes.__table__)):
+        query = select([source.c[column.name] for column in target.columns])
+        if since is not None:
+            query = query.where(source.c.character_id.in_(character_ids))
+        queries.append((target, query.order_by(source.c.character_id)))
+    if include_catalog:
+        for target, source in ((snapshot_attribute_types, AttributeType.__table__),
+                               (snapshot_attributes, Attribute.__table__),
+                               (snapshot_items, Items.__table__)):
+            queries.append((target, select([source.c[column.name] for column in target.columns])
+                            .order_by(source.c.id)))
+    if since is not None:
+        queries.append((snapshot_live_users, select([users.c.id]).order_by(users.c.id)))
+        queries.append((snapshot_live_characters, select([characters.c.id]).order_by(characters.c.id)))
+    return queries
+
+
+def _copy(source, target, table, query, chunk_size):
+    result = source.execution_options(stream_results=True).execute(query)
+    count = 0
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            target.execute(table.insert(), [dict(row._mapping) for row in rows])
+            count += len(rows)
+    finally:
+        result.close()
+    return count
+
+
+def read_info(path):
+    """
+    Read the snapshot_info table of a snapshot or delta file as a dict
+    """
+    if not os.path.exists(path):
+        raise SnapshotError('No snapshot at {}'.format(path))
+    connection = sqlite3.connect(path)
+    try:
+        info = dict(connection.execute('SELECT key, value FROM snapshot_info'))
+    except sqlite3.DatabaseError as error:
+        raise SnapshotError('{} is not a snapshot: {}'.format(path, error))
+    finally:
+        connection.close()
+    if int(info.get('format_version', 0)) != FORMAT_VERSION:
+        raise SnapshotError('{} has snapshot format {}, expected {}'.format(
+            path, info.get('format_version'), FORMAT_VERSION))
+    return info
+
+
+def delta_base(info):
+    """
+    The (since, catalog_version) arguments of write_snapshot for a delta on top of a snapshot's info
+    """
+    generated_at = datetime.datetime.strptime(info['generated_at'], '%Y-%m-%dT%H:%M:%S.%f')
+    return generated_at - SYNC_OVERLAP, int(info['catalog_version'])
+
+
+def write_snapshot(path, since=None, catalog_version=None, chunk_size=CHUNK_SIZE):
+    """
+    Write a full snapshot to path, or a delta of the rows changed since a datetime
+
+    A delta only includes the catalog when the current catalog version differs
+    from catalog_version. Every table is read in one transaction and streamed
+    into the file in chunks, from a replica when the request allows it. The
+    file is written next to path and renamed into place. Returns a list of
+    (table, rows) pairs.
+    """
+    report = []
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(suffix='.sqlite', dir=directory)
+    os.close(descriptor)
+    target_engine = create_engine('sqlite:///' + temporary)
+    try:
+        source = read_engine().connect()
+        if source.dialect.name != 'sqlite':
+            # see every table as of the same moment
+            source = source.execution_options(isolation_level='REPEATABLE READ')
+        try:
+            with source.begin():
+                generated_at = datetime.datetime.utcnow()
+                current_catalog = get_version(CATALOG_VERSION, source)
+                include_catalog = since is None or catalog_version != current_catalog
+                snapshot_metadata.create_all(target_engine)
+                with target_engine.begin() as target:
+                    for table, query in _source_queries(since, include_catalog):
+                        report.append((table.name, _copy(source, target, table, query, chunk_size)))
+                    target.execute(snapshot_info.insert(), [
+                        {'key': 'format_version', 'value': str(FORMAT_VERSION)},
+                        {'key': 'kind', 'value': 'full' if since is None else 'delta'},
+                        {'key': 'generated_at', 'value': generated_at.isoformat(timespec='microseconds')},
+                        {'key': 'since', 'value': since.isoformat() if since else ''},
+                        {'key': 'catalog_version', 'value': str(current_catalog)},
+                        {'key': 'has_catalog', 'value': '1' if include_catalog else '0'},
+                    ])
+        finally:
+            source.close()
+        with target_engine.connect() as target:
+            target.exec_driver_sql('VACUUM')
+        target_engine.dispose()
+        os.replace(temporary, path)
+    except Exception:
+        target_engine.dispose()
+        os.remove(temporary)
+        raise
+    return report
+
+
+def apply_delta(snapshot_path, delta_path):
+    """
+    Bring a snapshot file up to date with a delta in one transaction, using only sqlite3
+
+    Changed players and characters replace their rows, a changed character's
+    attributes, inventory and notes replace all of its rows, and players and
+    characters missing from the delta's live ids are deleted.
+    """
+    info = read_info(snapshot_path)
+    delta = read_info(delta_path)
+    if delta['kind'] != 'delta':
+        raise SnapshotError('{} is a full snapshot, not a delta'.format(delta_path))
+    if delta['since'] > info['generated_at']:
+        raise SnapshotError('The delta starts at {}, after the snapshot was taken at {}'.format(
+            delta['since'], info['generated_at']))
+
+    connection = sqlite3.connect(snapshot_path, isolation_level=None)
+    try:
+        connection.execute('ATTACH DATABASE ? AS delta', (delta_path,))
+        connection.execute('BEGIN')
+        for table in SHEET_TABLES:
+            connection.execute('DELETE FROM main.{0} WHERE character_id IN (SELECT id FROM delta.characters) '
+                               'OR character_id NOT IN (SELECT id FROM delta.live_characters)'.format(table))
+        connection.execute('DELETE FROM main.characters WHERE id NOT IN (SELECT id FROM delta.live_characters)')
+        connection.execute('DELETE FROM main.users WHERE id NOT IN (SELECT id FROM delta.live_users)')
+        for table in ('users', 'characters'):
+            connection.execute('INSERT OR REPLACE INTO main.{0} SELECT * FROM delta.{0}'.format(table))
+        for table in SHEET_TABLES:
+            connection.execute('INSERT INTO main.{0} SELECT * FROM delta.{0}'.format(table))
+        if delta['has_catalog'] == '1':
+            for table in CATALOG_TABLES:
+                connection.execute('DELETE FROM main.{}'.format(table))
+                connection.execute('INSERT INTO main.{0} SELECT * FROM delta.{0}'.format(table))
+        for key in ('generated_at', 'catalog_version'):
+            connection.execute('UPDATE main.snapshot_info SET value = ? WHERE key = ?', (delta[key], key))
+        connection.execute('COMMIT')
+        connection.execute('DETACH DATABASE delta')
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+    return delta
@@ -0,0 +1,230 @@
+import datetime
+import random
+import time
+
+from sqlalchemy import func, select
+
+from . import db
+from .awards import apply_award_deltas
+from .catalog import CATALOG_VERSION
+from .fragments import CHARACTERS_VERSION, ROLES_VERSION, USERS_VERSION
+from .models import Attribute, AwardLog, AwardType, Bucket, BucketTicket, Character, Inventory, Items, Role, \
+    TicketStatus, User, character_attributes, ticket_access_lists, ticket_comments, user_roles
+from .passwords import password_hasher
+from .seed import sync_sequence
+from .versions import bump_version
+
+
+# Synthetic data
+#
+# Fills a local database with generated players, characters and their
+# history so the app can be measured at realistic volumes. Per-row counts
+# follow a Pareto distribution around the requested mean: most characters
+# have a modest sheet, a few veterans have hundreds of skills and awards.
+# Every table is written with batched executemany inserts.
+
+BATCH_SIZE = 5000
+SKEW = 1.5
+DEFAULT_PASSWORD = 'synthetic'
+AWARD_TYPES = ('Experience', 'Glory')
+BUCKETS = ('Rules', 'Plot', 'Logistics', 'Character Review')
+ROLES = ('Staff', 'Plot Writer', 'Rules Marshal')
+
+
+class SyntheticDataError(Exception):
+    """
+    Raised when the database is missing data the generator builds on
+    """
+
+
+def skewed_count(rng, mean, maximum=None):
+    """
+    A Pareto distributed count whose expected value is roughly mean
+    """
+    if mean <= 0:
+        return 0
+    count = int(mean * (SKEW - 1) / SKEW * rng.paretovariate(SKEW))
+    return count if maximum is None else min(count, maximum)
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def _ids(column, after=0):
+    return [row[0] for row in db.session.execute(select([column]).where(column > after).order_by(column))]
+
+
+def _max_id(column):
+    return db.session.execute(select([func.max(column)])).scalar() or 0
+
+
+def _ensure_named(table, column, names):
+    """
+    Insert the names missing from a lookup table and return the name -> id map
+    """
+    existing = set(row[0] for row in db.session.execute(select([column])))
+    missing = [{column.key: name} for name in names if name not in existing]
+    if missing:
+        _insert(table, missing)
+    return dict((name, id) for id, name in db.session.execute(select([table.c.id, column])))
+
+
+def generate_data(users=200, characters=500, skills=40, awards=30, items=10, tickets=300, comments=4,
+                  catalog_items=100, seed=None, commit=True):
+    """
+    Add generated rows on top of whatever the database already holds
+
+    users and characters are totals, skills, awards, items and comments are
+    per-character or per-ticket means. The seeded catalog must already be
+    loaded. Returns a list of (table, inserted rows, seconds) tuples.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    report = []
+
+    def random_date(days=730):
+        return now - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+
+    def timed(table, started, count):
+        report.append((table, count, time.time() - started))
+
+    attribute_ids = _ids(Attribute.id)
+    if not attribute_ids:
+        raise SyntheticDataError('No attributes found, run flask seed-catalog first')
+
+    # users, the first of each run being an admin
+    started = time.time()
+    first_user = _max_id(User.id) + 1
+    password_hash = password_hasher.hash(DEFAULT_PASSWORD)
+    _insert(User.__table__, [{
+        'id': first_user + n,
+        'email': 'player{}@example.com'.format(first_user + n),
+        'user_name': 'player{}'.format(first_user + n),
+        'first_name': 'Player',
+        'last_name': str(first_user + n),
+        'join_date': random_date(),
+        'password_hash': password_hash,
+        'is_admin': n == 0,
+    } for n in range(users)])
+    sync_sequence(User.__table__)
+    user_ids = _ids(User.id, first_user - 1)
+    timed('users', started, len(user_ids))
+
+    started = time.time()
+    role_ids = list(_ensure_named(Role.__table__, Role.__table__.c.name, ROLES).values())
+    if user_ids:
+        rows = [{'user_id': user_id, 'role_id': role_id}
+                for user_id in user_ids
+                for role_id in rng.sample(role_ids, min(len(role_ids), skewed_count(rng, 1, len(role_ids))))]
+        _insert(user_roles, rows)
+        timed('user roles', started, len(rows))
+
+    # characters, with a few players owning many of them
+    started = time.time()
+    owners = user_ids or _ids(User.id)
+    if characters and not owners:
+        raise SyntheticDataError('No users to own the characters')
+    weights = [rng.paretovariate(SKEW) for owner in owners]
+    first_character = _max_id(Character.id) + 1
+    owned_by = rng.choices(owners, weights=weights, k=characters) if characters else []
+    _insert(Character.__table__, [{
+        'id': first_character + n,
+        'character_name': 'Character {}'.format(first_character + n),
+        'create_date': random_date(),
+        'last_update': now,
+        'user_id': owner,
+    } for n, owner in enumerate(owned_by)])
+    sync_sequence(Character.__table__)
+    character_ids = _ids(Character.id, first_character - 1)
+    owner_of = dict(zip(character_ids, owned_by))
+    timed('characters', started, len(character_ids))
+
+    started = time.time()
+    rows = []
+    for character_id in character_ids:
+        for attribute_id in rng.sample(attribute_ids, skewed_count(rng, skills, len(attribute_ids))):
+            rows.append({'character_id': character_id, 'attribute_id': attribute_id,
+                         'rank': rng.randint(1, 5), 'last_modified': random_date(), 'comments': None})
+    _insert(character_attributes, rows)
+    timed('character attributes', started, len(rows))
+
+    # awards, kept in step with award_balances
+    started = time.time()
+    award_type_ids = _ensure_named(AwardType.__table__, AwardType.__table__.c.name, AWARD_TYPES)
+    rows = []
+    deltas = {}
+    for character_id in character_ids:
+        for n in range(skewed_count(rng, awards)):
+            row = {'user_id': owner_of[character_id], 'character_id': character_id,
+                   'award_type_id': award_type_ids['Experience'], 'award_date': random_date(),
+                   'amount': rng.randint(1, 10), 'reason': 'Event attendance'}
+            rows.append(row)
+            key = (row['user_id'], character_id, row['award_type_id'])
+            deltas[key] = deltas.get(key, 0) + row['amount']
+    for user_id in user_ids:
+        if rng.random() < 0.5:
+            row = {'user_id': user_id, 'character_id': None, 'award_type_id': award_type_ids['Glory'],
+                   'award_date': random_date(), 'amount': rng.randint(1, 3), 'reason': 'Volunteering'}
+            rows.append(row)
+            key = (user_id, None, row['award_type_id'])
+            deltas[key] = deltas.get(key, 0) + row['amount']
+    _insert(AwardLog.__table__, rows)
+    apply_award_deltas(db.session.connection(), deltas)
+    timed('award logs', started, len(rows))
+
+    # inventory
+    started = time.time()
+    item_ids = _ids(Items.id)
+    if len(item_ids) < catalog_items:
+        first_item = _max_id(Items.id) + 1
+        _insert(Items.__table__, [{'item_name': 'Synthetic item {}'.format(first_item + n), 'last_update': now}
+                                  for n in range(catalog_items - len(item_ids))])
+        bump_version(CATALOG_VERSION)
+        item_ids = _ids(Items.id)
+    rows = []
+    for character_id in character_ids:
+        for item_id in rng.sample(item_ids, skewed_count(rng, items, len(item_ids))):
+            rows.append({'character_id': character_id, 'item_id': item_id, 'quantity': rng.randint(1, 20)})
+    _insert(Inventory.__table__, rows)
+    timed('inventory', started, len(rows))
+
+    # tickets, their comments and access lists
+    started = time.time()
+    bucket_ids = list(_ensure_named(Bucket.__table__, Bucket.__table__.c.name, BUCKETS).values())
+    staff = [user_id for user_id in owners if rng.random() < 0.05] or owners[:1]
+    first_ticket = _max_id(BucketTicket.id) + 1
+    ticket_rows = []
+    for n in range(tickets if owners else 0):
+        created_on = random_date(365)
+        assignee_id = rng.choice(staff) if rng.random() < 0.6 else None
+        status = rng.choice((TicketStatus.CLAIMED, TicketStatus.CLOSED)) if assignee_id else TicketStatus.OPEN
+        ticket_rows.append({'id': first_ticket + n, 'bucket_id': rng.choice(bucket_ids),
+                            'title': 'Ticket {}'.format(first_ticket + n), 'creator_id': rng.choice(owners),
+                            'assignee_id': assignee_id, 'status': status, 'created_on': created_on,
+                            'last_modified': created_on})
+    _insert(BucketTicket.__table__, ticket_rows)
+    sync_sequence(BucketTicket.__table__)
+    timed('tickets', started, len(ticket_rows))
+
+    started = time.time()
+    comment_rows = []
+    access_rows = []
+    for ticket in ticket_rows:
+        for n in range(skewed_count(rng, comments)):
+            comment_rows.append({'ticket_id': ticket['id'], 'author_id': rng.choice([ticket['creator_id']] + staff),
+                                 'comment': 'Comment {}'.format(n), 'created_on': random_date(365)})
+        for user_id in set(rng.sample(owners, min(len(owners), skewed_count(rng, 1)))):
+            access_rows.append({'ticket_id': ticket['id'], 'user_id': user_id,
+                                'can_read': True, 'can_write': rng.random() < 0.3})
+    _insert(ticket_comments, comment_rows)
+    _insert(ticket_access_lists, access_rows)
+    timed('ticket comments and access', started, len(comment_rows) + len(access_rows))
+
+    # the inserts above bypass the ORM, so cached fragments are invalidated by hand
+    bump_version(CHARACTERS_VERSION, ROLES_VERSION, USERS_VERSION)
+
+    if commit:
+        db.session.commit()
+    return report
@@ -0,0 +1,195 @@
+import datetime
+
+from flask import g
+from flask_login import current_user
+from sqlalchemy import func, literal, select, union, union_all
+from sqlalchemy.orm import joinedload
+
+from . import db
+from .models import BucketTicket, TicketStatus, ticket_access_lists
+
+
+# Staff ticket queue
+#
+# Each bucket is a queue of tickets read oldest first through
+# ix_bucket_tickets_bucket_status_created. Claiming the next ticket locks
+# the candidate row with FOR UPDATE SKIP LOCKED where the backend supports
+# it, so concurrent staff skip each other's rows instead of waiting on them.
+# The assignment itself is a compare-and-set UPDATE that only succeeds on a
+# still open, unassigned ticket, which keeps backends without row locks,
+# such as SQLite, from handing the same ticket out twice.
+
+CLAIM_CANDIDATES = 5
+
+
+def bucket_counts():
+    """
+    Map bucket id to a {status: ticket count} dict in one grouped query
+    """
+    tickets = BucketTicket.__table__
+    counts = {}
+    for bucket_id, status, count in db.session.execute(
+            select([tickets.c.bucket_id, tickets.c.status, func.count()])
+            .group_by(tickets.c.bucket_id, tickets.c.status)):
+        counts.setdefault(bucket_id, {})[status] = count
+    return counts
+
+
+def queue_query(bucket_id, status=TicketStatus.OPEN):
+    """
+    The tickets of a bucket in one status, for paginating oldest first
+    """
+    return BucketTicket.query \
+        .options(joinedload(BucketTicket.creator), joinedload(BucketTicket.assignee)) \
+        .filter(BucketTicket.bucket_id == bucket_id, BucketTicket.status == status)
+
+
+def _claim(connection, ticket_id, user_id, now):
+    tickets = BucketTicket.__table__
+    result = connection.execute(tickets.update()
+                                .where((tickets.c.id == ticket_id) &
+                                       (tickets.c.status == TicketStatus.OPEN) &
+                                       tickets.c.assignee_id.is_(None))
+                                .values(assignee_id=user_id, status=TicketStatus.CLAIMED, last_modified=now))
+    return result.rowcount == 1
+
+
+def claim_next_ticket(bucket_id, user_id, commit=True):
+    """
+    Assign the oldest open ticket of a bucket to a user and return its id, or None if the queue is empty
+    """
+    tickets = BucketTicket.__table__
+    candidates = select([tickets.c.id]) \
+        .where((tickets.c.bucket_id == bucket_id) &
+               (tickets.c.status == TicketStatus.OPEN) &
+               tickets.c.assignee_id.is_(None)) \
+        .order_by(tickets.c.created_on, tickets.c.id) \
+        .limit(CLAIM_CANDIDATES) \
+        .with_for_update(skip_locked=True)
+
+    claimed = None
+    while claimed is None:
+        connection = db.session.connection()
+        ticket_ids = [row[0] for row in connection.execute(candidates)]
+        if not ticket_ids:
+            break
+        now = datetime.datetime.utcnow()
+        for ticket_id in ticket_ids:
+            if _claim(connection, ticket_id, user_id, now):
+                claimed = ticket_id
+                break
+
+    if commit:
+        db.session.commit()
+    return claimed
+
+
+def release_ticket(ticket_id, user_id, commit=True):
+    """
+    Put a ticket claimed by user_id back into its queue, returning whether it was released
+    """
+    tickets = BucketTicket.__table__
+    result = db.session.execute(tickets.update()
+                                .where((tickets.c.id == ticket_id) &
+                                       (tickets.c.status == TicketStatus.CLAIMED) &
+                                       (tickets.c.assignee_id == user_id))
+                                .values(assignee_id=None, status=TicketStatus.OPEN,
+                                        last_modified=datetime.datetime.utcnow()))
+    if commit:
+        db.session.commit()
+    return result.rowcount == 1
+
+
+def close_ticket(ticket_id, user_id, commit=True):
+    """
+    Close a ticket claimed by user_id, returning whether it was closed
+    """
+    tickets = BucketTicket.__table__
+    result = db.session.execute(tickets.update()
+                                .where((tickets.c.id == ticket_id) &
+                                       (tickets.c.status == TicketStatus.CLAIMED) &
+                                       (tickets.c.assignee_id == user_id))
+                                .values(status=TicketStatus.CLOSED, last_modified=datetime.datetime.utcnow()))
+    if commit:
+        db.session.commit()
+    return result.rowcount == 1
+
+
+# Ticket access
+#
+# A user may read the tickets they created, are assigned to or hold a
+# can_read row for in ticket_access_lists, and write to those they created,
+# are assigned to or hold can_write for. Admins may do both on every ticket.
+# Each source is an indexed lookup, combined with UNION ALL into a single
+# query that runs at most once per request. Lists filter in SQL with
+# visible_ticket_ids instead of checking tickets one by one.
+
+class TicketAccess(object):
+    """
+    The tickets one user may read and write
+    """
+
+    def __init__(self, user_id, is_admin=False, permissions=None):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        # ticket id -> (can_read, can_write)
+        self.permissions = permissions or {}
+
+    def can_read(self, ticket_id):
+        return self.is_admin or self.permissions.get(ticket_id, (False, False))[0]
+
+    def can_write(self, ticket_id):
+        return self.is_admin or self.permissions.get(ticket_id, (False, False))[1]
+
+    def filter(self, query):
+        """
+        Restrict a BucketTicket query to the tickets this user may read
+        """
+        if self.is_admin:
+            return query
+        return query.filter(BucketTicket.id.in_(visible_ticket_ids(self.user_id)))
+
+
+def visible_ticket_ids(user_id):
+    """
+    A SELECT of the ids of the tickets a user may read, for use in IN clauses
+    """
+    tickets = BucketTicket.__table__
+    access = ticket_access_lists
+    return union(select([tickets.c.id]).where(tickets.c.creator_id == user_id),
+                 select([tickets.c.id]).where(tickets.c.assignee_id == user_id),
+                 select([access.c.ticket_id]).where((access.c.user_id == user_id) &
+                                                    (access.c.can_read.is_(True) | access.c.can_write.is_(True))))
+
+
+def ticket_permissions(user_id):
+    """
+    Map the id of every ticket a user may read to a (can_read, can_write) pair in one query
+    """
+    tickets = BucketTicket.__table__
+    access = ticket_access_lists
+    rows = db.session.execute(union_all(
+        select([tickets.c.id, literal(True), literal(True)]).where(tickets.c.creator_id == user_id),
+        select([tickets.c.id, literal(True), literal(True)]).where(tickets.c.assignee_id == user_id),
+        select([access.c.ticket_id, access.c.can_read, access.c.can_write]).where(access.c.user_id == user_id)))
+
+    permissions = {}
+    for ticket_id, can_read, can_write in rows:
+        read, write = permissions.get(ticket_id, (False, False))
+        # write access implies read access
+        permissions[ticket_id] = (read or bool(can_read) or bool(can_write), write or bool(can_write))
+    return dict((ticket_id, flags) for ticket_id, flags in permissions.items() if flags[0])
+
+
+def get_ticket_access():
+    """
+    The TicketAccess of the current user, computed once per request
+    """
+    access = g.get('ticket_access')
+    if access is None or access.user_id != current_user.id:
+        if current_user.is_admin:
+            access = TicketAccess(current_user.id, is_admin=True)
+        else:
+            access = TicketAccess(current_user.id, permissions=ticket_permissions(current_user.id))
+        g.ticket_access = access
+    return access
@@ -0,0 +1,100 @@
+from sqlalchemy import event, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import DataVersion
+
+
+# Data versions
+#
+# Every group of tables cached in-process has a counter row in data_versions.
+# Flushing a change to one of the tracked models bumps its counter in the same
+# transaction, so every worker notices the change with one primary key read.
+
+# model class -> names of the versions it belongs to
+_tracked = {}
+
+
+def track_versions(model, *names):
+    """
+    Bump the named versions whenever instances of model are inserted, updated or deleted
+    """
+    _tracked.setdefault(model, set()).update(names)
+
+
+def _upsert(connection, table):
+    # two transactions creating the same counter both bump it, neither fails
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+        return insert.on_conflict_do_update(index_elements=[table.c.name],
+                                            set_={'version': table.c.version + 1})
+    if dialect == 'mysql':
+        return mysql.insert(table).on_duplicate_key_update(version=table.c.version + 1)
+    return None
+
+
+def bump_versions(connection, names):
+    """
+    Increment the named versions using connection, creating missing counters
+    """
+    table = DataVersion.__table__
+    # sorted so concurrent bumps lock the same rows in the same order
+    names = sorted(names)
+    statement = _upsert(connection, table)
+    if statement is not None:
+        connection.execute(statement, [{'name': name, 'version': 1} for name in names])
+        return
+    # other databases: a racing insert of a new counter fails on the primary key
+    for name in names:
+        result = connection.execute(table.update()
+                                    .where(table.c.name == name)
+                                    .values(version=table.c.version + 1))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(name=name, version=1))
+
+
+def bump_version(*names):
+    """
+    Bump versions from code that writes with bulk statements instead of the ORM
+    """
+    bump_versions(db.session.connection(), names)
+
+
+def get_version(name, connection=None):
+    """
+    Read the current value of one version, 0 if it was never bumped
+    """
+    table = DataVersion.__table__
+    executor = connection if connection is not None else db.session
+    version = executor.execute(select([table.c.version]).where(table.c.name == name)).scalar()
+    return version or 0
+
+
+def get_versions(names):
+    """
+    Read several versions in one query as a name -> version dict
+    """
+    table = DataVersion.__table__
+    rows = db.session.execute(table.select().where(table.c.name.in_(list(names))))
+    versions = dict.fromkeys(names, 0)
+    versions.update((row.name, row.version) for row in rows)
+    return versions
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_versions(session, flush_context):
+    if not _tracked:
+        return
+
+    names = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        for model, model_names in _tracked.items():
+            if isinstance(instance, model):
+                if instance in session.dirty and not session.is_modified(instance):
+                    continue
+                names |= model_names
+
+    if names:
+        bump_versions(session.connection(), names)
@@ -5,6 +5,76 @@ class Config(object):
 
     # Put any configurations here that are common across all environments
 
+    # Admin list views are keyset paginated; per_page requests are capped at the max
+    ADMIN_PAGE_SIZE = 50
+    ADMIN_MAX_PAGE_SIZE = 200
+
+    # Raise instead of logging when a loading profile goes over its query budget
+    ENFORCE_QUERY_BUDGETS = False
+
+    # Seconds a worker may reuse its rules catalog before re-reading the catalog version
+    CATALOG_CHECK_INTERVAL = 0
+
+    # Seconds the logged-in user's identity and roles are served from the per-process cache, 0 disables it
+    IDENTITY_CACHE_TTL = 60
+    IDENTITY_CACHE_SIZE = 10000
+
+    # Password hashing; stored hashes made with other parameters are upgraded on login.
+    # Hashing runs on PASSWORD_HASH_WORKERS threads (0 hashes inline), and requests give
+    # up with a "busy" message when more than PASSWORD_HASH_MAX_QUEUE hashes are waiting
+    # or one takes longer than PASSWORD_HASH_TIMEOUT seconds.
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 4
+    PASSWORD_HASH_MAX_QUEUE = 200
+    PASSWORD_HASH_TIMEOUT = 10
+
+    # Per-request SQL metrics, shown to admins at /admin/instrumentation. A statement
+    # repeated SQL_REPEAT_THRESHOLD times in one request is reported as a possible N+1.
+    SQL_INSTRUMENTATION = False
+    SQL_INSTRUMENTATION_SAMPLES = 500
+    SQL_REPEAT_THRESHOLD = 5
+
+    # Rendered template fragments kept per process, keyed by data versions; 0 disables the cache
+    FRAGMENT_CACHE_SIZE = 2000
+
+    # Serve the fingerprinted, precompressed copies written by flask build-assets when a build exists
+    USE_ASSET_MANIFEST = True
+
+    # Database engine and connection pool, validated by create_app. Connections idle for
+    # DATABASE_POOL_RECYCLE seconds are replaced (-1 never), pre-ping tests each checkout,
+    # and Postgres and MySQL cancel statements running over DATABASE_STATEMENT_TIMEOUT
+    # seconds (0 disables it). SQLite gets DATABASE_SQLITE_PRAGMAS on every connection.
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_RECYCLE = 3600
+    DATABASE_POOL_PRE_PING = True
+    DATABASE_STATEMENT_TIMEOUT = 30
+    DATABASE_SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'temp_store': 'memory',
+    }
+
+    # Read replica URIs, empty to read from the primary. GET requests and @use_replica views read
+    # from a replica that is at most DATABASE_REPLICA_MAX_LAG seconds behind, measured every
+    # DATABASE_REPLICA_LAG_CHECK seconds. After a write the user's requests read from the primary
+    # for DATABASE_REPLICA_MAX_LAG seconds.
+    DATABASE_REPLICAS = []
+    DATABASE_REPLICA_MAX_LAG = 10
+    DATABASE_REPLICA_LAG_CHECK = 5
+
+    # Background jobs run by flask run-jobs. Workers poll every JOB_POLL_INTERVAL seconds and
+    # renew the lease of a running job, which is requeued once JOB_LEASE seconds pass without a
+    # renewal. Failed jobs retry after JOB_RETRY_DELAY seconds, doubling with each attempt.
+    JOB_WORKER_THREADS = 2
+    JOB_POLL_INTERVAL = 2
+    JOB_LEASE = 300
+    JOB_RETRY_DELAY = 30
+
 
 class DevelopmentConfig(Config):
     """
@@ -13,6 +83,14 @@ class DevelopmentConfig(Config):
 
     DEBUG = True
     SQLALCHEMY_ECHO = True
+    ENFORCE_QUERY_BUDGETS = True
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
+    SQL_INSTRUMENTATION = True
+    USE_ASSET_MANIFEST = False
+    DATABASE_POOL_SIZE = 2
+    DATABASE_MAX_OVERFLOW = 5
+    DATABASE_POOL_PRE_PING = False
+    DATABASE_STATEMENT_TIMEOUT = 10
 
 
 class TestConfig(Config):
@@ -22,6 +100,15 @@ class TestConfig(Config):
 
     DEBUG = True
     SQLALCHEMY_ECHO = True
+    ENFORCE_QUERY_BUDGETS = True
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    DATABASE_POOL_SIZE = 1
+    DATABASE_MAX_OVERFLOW = 2
+    DATABASE_POOL_TIMEOUT = 5
+    DATABASE_POOL_PRE_PING = False
+    # benchmarks and generated data load whole tables
+    DATABASE_STATEMENT_TIMEOUT = 0
 
 
 class ProductionConfig(Config):
@@ -30,6 +117,11 @@ class ProductionConfig(Config):
     """
 
     DEBUG = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+    DATABASE_POOL_SIZE = 10
+    DATABASE_MAX_OVERFLOW = 20
+    # below the MySQL and most proxies' idle timeouts
+    DATABASE_POOL_RECYCLE = 1800
 
 app_config = {
     'development': DevelopmentConfig,
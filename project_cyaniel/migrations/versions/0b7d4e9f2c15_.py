@@ -0,0 +1,26 @@
+"""add ticket creator and assignee indexes
+
+Revision ID: 0b7d4e9f2c15
+Revises: f2a6c3e1d8b7
+Create Date: 2026-10-18 15:58:03.117420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7d4e9f2c15'
+down_revision = 'f2a6c3e1d8b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_bucket_tickets_creator_id'), 'bucket_tickets', ['creator_id'], unique=False)
+    op.create_index(op.f('ix_bucket_tickets_assignee_id'), 'bucket_tickets', ['assignee_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_bucket_tickets_assignee_id'), table_name='bucket_tickets')
+    op.drop_index(op.f('ix_bucket_tickets_creator_id'), table_name='bucket_tickets')
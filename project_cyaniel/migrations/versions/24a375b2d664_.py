@@ -0,0 +1,36 @@
+"""non-null ticket and job creation dates and character names
+
+Revision ID: 24a375b2d664
+Revises: b8f3d6a1c472
+Create Date: 2026-10-18 23:58:02.417935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '24a375b2d664'
+down_revision = 'b8f3d6a1c472'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # all three are keyset pagination sort keys, where a NULL would end the page walk
+    op.execute("UPDATE bucket_tickets SET created_on = COALESCE(last_modified, '1970-01-01 00:00:00') "
+               "WHERE created_on IS NULL")
+    op.execute('UPDATE jobs SET created_on = run_after WHERE created_on IS NULL')
+    characters = sa.table('characters', sa.column('id', sa.Integer), sa.column('character_name', sa.String))
+    op.execute(characters.update()
+               .where(characters.c.character_name.is_(None))
+               .values(character_name=sa.literal('Character ') + sa.cast(characters.c.id, sa.String)))
+    op.alter_column('bucket_tickets', 'created_on', existing_type=sa.DateTime(), nullable=False)
+    op.alter_column('jobs', 'created_on', existing_type=sa.DateTime(), nullable=False)
+    op.alter_column('characters', 'character_name', existing_type=sa.String(length=60), nullable=False)
+
+
+def downgrade():
+    op.alter_column('characters', 'character_name', existing_type=sa.String(length=60), nullable=True)
+    op.alter_column('jobs', 'created_on', existing_type=sa.DateTime(), nullable=True)
+    op.alter_column('bucket_tickets', 'created_on', existing_type=sa.DateTime(), nullable=True)
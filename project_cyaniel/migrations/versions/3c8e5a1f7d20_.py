@@ -0,0 +1,42 @@
+"""add full-text search index
+
+Revision ID: 3c8e5a1f7d20
+Revises: 0b7d4e9f2c15
+Create Date: 2026-10-18 16:42:19.504837
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e5a1f7d20'
+down_revision = '0b7d4e9f2c15'
+branch_labels = None
+depends_on = None
+
+
+# The index is only created on backends with full-text search support; fill it with flask reindex-search
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "kind UNINDEXED, ref_id UNINDEXED, parent_id UNINDEXED, title, body, "
+    "tokenize = 'porter unicode61 remove_diacritics 1')",
+)
+POSTGRES_DDL = (
+    "CREATE TABLE IF NOT EXISTS search_index ("
+    "id BIGINT PRIMARY KEY, kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL, parent_id INTEGER, "
+    "title TEXT, body TEXT, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_parent ON search_index (kind, parent_id)",
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for statement in {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}.get(dialect, ()):
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE IF EXISTS search_index')
@@ -0,0 +1,53 @@
+"""add attribute change history
+
+Revision ID: 6a4f2d9e8b31
+Revises: 3c8e5a1f7d20
+Create Date: 2026-10-18 17:20:44.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a4f2d9e8b31'
+down_revision = '3c8e5a1f7d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('attribute_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('character_id', sa.Integer(), nullable=False),
+    sa.Column('attribute_id', sa.Integer(), nullable=False),
+    sa.Column('old_rank', sa.Integer(), nullable=True),
+    sa.Column('new_rank', sa.Integer(), nullable=True),
+    sa.Column('changed_by_id', sa.Integer(), nullable=True),
+    sa.Column('changed_on', sa.DateTime(), nullable=False),
+    sa.Column('comments', sa.String(length=1024), nullable=True),
+    sa.ForeignKeyConstraint(['attribute_id'], ['attributes.id'], ),
+    sa.ForeignKeyConstraint(['changed_by_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['character_id'], ['characters.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_attribute_changes_character_changed', 'attribute_changes',
+                    ['character_id', 'changed_on'], unique=False)
+    op.create_table('attribute_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('character_id', sa.Integer(), nullable=False),
+    sa.Column('taken_on', sa.DateTime(), nullable=False),
+    sa.Column('last_change_id', sa.Integer(), nullable=False),
+    sa.Column('ranks', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['character_id'], ['characters.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_attribute_snapshots_character_taken', 'attribute_snapshots',
+                    ['character_id', 'taken_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_attribute_snapshots_character_taken', table_name='attribute_snapshots')
+    op.drop_table('attribute_snapshots')
+    op.drop_index('ix_attribute_changes_character_changed', table_name='attribute_changes')
+    op.drop_table('attribute_changes')
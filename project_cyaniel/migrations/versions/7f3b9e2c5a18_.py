@@ -0,0 +1,27 @@
+"""widen password hashes
+
+Revision ID: 7f3b9e2c5a18
+Revises: 24a375b2d664
+Create Date: 2026-10-19 14:06:52.733410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3b9e2c5a18'
+down_revision = '24a375b2d664'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # scrypt and pbkdf2:sha512 hashes are longer than 128 characters
+    op.alter_column('users', 'password_hash', existing_type=sa.String(length=128), type_=sa.String(length=255),
+                    existing_nullable=True)
+
+
+def downgrade():
+    op.alter_column('users', 'password_hash', existing_type=sa.String(length=255), type_=sa.String(length=128),
+                    existing_nullable=True)
@@ -0,0 +1,45 @@
+"""add background jobs
+
+Revision ID: 9d1e7c4b5a62
+Revises: 6a4f2d9e8b31
+Create Date: 2026-10-18 21:05:12.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d1e7c4b5a62'
+down_revision = '6a4f2d9e8b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(length=64), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('created_by_id', sa.Integer(), nullable=True),
+    sa.Column('created_on', sa.DateTime(), nullable=True),
+    sa.Column('started_on', sa.DateTime(), nullable=True),
+    sa.Column('finished_on', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_status_priority_run_after', 'jobs', ['status', 'priority', 'run_after'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_status_priority_run_after', table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,36 @@
+"""unique player-wide award balances
+
+Revision ID: b8f3d6a1c472
+Revises: 9d1e7c4b5a62
+Create Date: 2026-10-18 23:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f3d6a1c472'
+down_revision = '9d1e7c4b5a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('award_balances', sa.Column('character_key', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE award_balances SET character_key = character_id WHERE character_id IS NOT NULL')
+    # the old index let player-wide balances be duplicated, rebuild them from the ledger
+    op.execute('DELETE FROM award_balances WHERE character_id IS NULL')
+    op.execute('INSERT INTO award_balances (user_id, character_id, character_key, award_type_id, balance, last_update) '
+               'SELECT user_id, NULL, 0, award_type_id, SUM(amount), MAX(award_date) FROM award_logs '
+               'WHERE character_id IS NULL GROUP BY user_id, award_type_id')
+    op.drop_index('ix_award_balances_user_character_type', table_name='award_balances')
+    op.create_index('ix_award_balances_user_character_key_type', 'award_balances',
+                    ['user_id', 'character_key', 'award_type_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_award_balances_user_character_key_type', table_name='award_balances')
+    op.create_index('ix_award_balances_user_character_type', 'award_balances',
+                    ['user_id', 'character_id', 'award_type_id'], unique=True)
+    op.drop_column('award_balances', 'character_key')
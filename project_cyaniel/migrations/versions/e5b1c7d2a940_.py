@@ -0,0 +1,60 @@
+"""add foreign key indexes
+
+Revision ID: e5b1c7d2a940
+Revises: d47a0c93e615
+Create Date: 2026-10-18 13:52:10.284116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1c7d2a940'
+down_revision = 'd47a0c93e615'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns). Award log and ticket tables were created
+# outside of migrations on some databases, so indexes on tables that do not
+# exist are skipped rather than failing the upgrade.
+INDEXES = [
+    ('ix_character_attributes_character_attribute', 'character_attributes', ['character_id', 'attribute_id']),
+    ('ix_user_roles_user_role', 'user_roles', ['user_id', 'role_id']),
+    ('ix_user_roles_role_id', 'user_roles', ['role_id']),
+    ('ix_advancement_list_requirements_option_attribute', 'advancement_list_requirements',
+     ['advancement_list_attribute_id', 'attribute_requirement_id']),
+    ('ix_advancement_list_requirements_attribute_id', 'advancement_list_requirements',
+     ['attribute_requirement_id']),
+    ('ix_advancement_list_attributes_list_attribute', 'advancement_list_attributes',
+     ['advancement_list_id', 'attribute_id']),
+    ('ix_characters_user_id', 'characters', ['user_id']),
+    ('ix_inventory_character_id', 'inventory', ['character_id']),
+    ('ix_character_notes_character_id', 'character_notes', ['character_id']),
+    ('ix_award_logs_character_type_date', 'award_logs', ['character_id', 'award_type_id', 'award_date']),
+    ('ix_award_logs_user_type_date', 'award_logs', ['user_id', 'award_type_id', 'award_date']),
+    ('ix_ticket_comments_ticket_created', 'ticket_comments', ['ticket_id', 'created_on']),
+    ('ix_ticket_access_lists_ticket_user', 'ticket_access_lists', ['ticket_id', 'user_id']),
+    ('ix_ticket_access_lists_user_id', 'ticket_access_lists', ['user_id']),
+]
+
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    return dict((table, set(index['name'] for index in inspector.get_indexes(table))) for table in tables)
+
+
+def upgrade():
+    existing = _existing_indexes()
+    for name, table, columns in INDEXES:
+        if table in existing and name not in existing[table]:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    existing = _existing_indexes()
+    for name, table, columns in reversed(INDEXES):
+        if name in existing.get(table, ()):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,25 @@
+"""add ticket queue index
+
+Revision ID: f2a6c3e1d8b7
+Revises: c4e8a2d6f913
+Create Date: 2026-10-18 15:12:41.902334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6c3e1d8b7'
+down_revision = 'c4e8a2d6f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bucket_tickets_bucket_status_created', 'bucket_tickets',
+                    ['bucket_id', 'status', 'created_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bucket_tickets_bucket_status_created', table_name='bucket_tickets')
@@ -0,0 +1,22 @@
+import pytest
+
+from app import create_app, database, db, seed, synthetic
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """
+    The test app on a SQLite file of its own, seeded with the catalog and a few generated players
+    """
+    app = create_app('test')
+    # instance/config.py points at the developer's own database
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path_factory.mktemp('db') / 'cyaniel.db')
+    app.config['SQLALCHEMY_ECHO'] = False
+    database.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        seed.seed_catalog(seed.load_catalog_file())
+        synthetic.generate_data(users=5, characters=20, seed=1)
+        yield app
+        db.session.remove()
@@ -0,0 +1,99 @@
+import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from app import db
+from app.awards import BulkAwardError, character_balance, character_balances, grant_bulk_award, \
+    reconcile_award_balances
+from app.models import AwardBalance, AwardLog, AwardType, Character, User
+
+
+def _balances(user_id, character_id):
+    return dict((balance.award_type_id, balance.balance) for balance in
+                AwardBalance.query.filter_by(user_id=user_id, character_id=character_id))
+
+
+def test_delete_character_with_awards(app):
+    # SQLite only checks foreign keys when asked to, per connection
+    db.session.execute('PRAGMA foreign_keys = ON')
+    user_id = User.query.first().id
+    award_type_id = AwardType.query.first().id
+    character = Character(character_name='Ephemeral', user_id=user_id)
+    db.session.add(character)
+    db.session.add(AwardLog(user_id=user_id, character=character, award_type_id=award_type_id, amount=7,
+                            award_date=datetime.datetime.utcnow()))
+    db.session.commit()
+    character_id = character.id
+    before = _balances(user_id, None).get(award_type_id, 0)
+    assert character_balances(character_id) == {award_type_id: 7}
+
+    db.session.delete(character)
+    db.session.commit()
+    assert AwardBalance.query.filter_by(character_id=character_id).count() == 0
+    # the award logs stay with the player
+    assert _balances(user_id, None)[award_type_id] == before + 7
+    db.session.execute('PRAGMA foreign_keys = OFF')
+
+
+def test_character_balances_across_players(app):
+    users = User.query.order_by(User.id).limit(2).all()
+    award_type_id = AwardType.query.first().id
+    character = Character(character_name='Handed Down', user_id=users[0].id)
+    db.session.add(character)
+    for user, amount in zip(users, (3, 4)):
+        db.session.add(AwardLog(user_id=user.id, character=character, award_type_id=award_type_id, amount=amount,
+                                award_date=datetime.datetime.utcnow()))
+    db.session.commit()
+
+    assert character_balances(character.id) == {award_type_id: 7}
+
+
+def test_bulk_award(app):
+    character_ids = [character.id for character in Character.query.order_by(Character.id).limit(3)]
+    award_type_id = AwardType.query.first().id
+    before = dict((character_id, character_balance(character_id, award_type_id)) for character_id in character_ids)
+    logs = AwardLog.query.count()
+
+    roster = character_ids + character_ids[:1]
+    preview = grant_bulk_award(roster, award_type_id, 5, 'Dry run', dry_run=True)
+    assert [grant.character_id for grant in preview.grants] == character_ids
+    assert AwardLog.query.count() == logs
+
+    with pytest.raises(BulkAwardError):
+        grant_bulk_award(character_ids + [0], award_type_id, 5, 'Unknown character')
+    assert AwardLog.query.count() == logs
+
+    result = grant_bulk_award(roster, award_type_id, 5, 'Event 12')
+    assert result.duplicates == character_ids[:1]
+    assert [grant.character_id for grant in result.grants] == character_ids
+    # a character listed twice is awarded once
+    assert AwardLog.query.count() == logs + len(character_ids)
+    for character_id in character_ids:
+        assert character_balance(character_id, award_type_id) == before[character_id] + 5
+
+
+def _log_totals():
+    logs = AwardLog.__table__
+    return dict(((user_id, character_id, award_type_id), total) for user_id, character_id, award_type_id, total
+                in db.session.execute(select([logs.c.user_id, logs.c.character_id, logs.c.award_type_id,
+                                              func.sum(logs.c.amount)])
+                                      .group_by(logs.c.user_id, logs.c.character_id, logs.c.award_type_id)))
+
+
+def _balance_rows():
+    return dict(((balance.user_id, balance.character_id, balance.award_type_id), balance.balance)
+                for balance in AwardBalance.query)
+
+
+def test_reconcile_award_balances(app):
+    assert _balance_rows() == _log_totals()
+
+    balances = AwardBalance.query.order_by(AwardBalance.id).limit(2).all()
+    balances[0].balance += 1000
+    db.session.delete(balances[1])
+    db.session.commit()
+    assert _balance_rows() != _log_totals()
+
+    assert reconcile_award_balances() == len(_log_totals())
+    assert _balance_rows() == _log_totals()
@@ -0,0 +1,79 @@
+import datetime
+import json
+
+import pytest
+
+from app import db
+from app.history import SNAPSHOT_INTERVAL, current_ranks, ranks_as_of, set_attribute_rank, snapshot_all
+from app.models import Attribute, AttributeChange, AttributeSnapshot, Character, User
+
+
+@pytest.fixture
+def character_id(app):
+    """
+    A new character without attributes or history
+    """
+    character = Character(character_name='Historian', user_id=User.query.first().id)
+    db.session.add(character)
+    db.session.commit()
+    return character.id
+
+
+def _snapshots(character_id):
+    return AttributeSnapshot.query.filter_by(character_id=character_id).order_by(AttributeSnapshot.id).all()
+
+
+def test_ranks_as_of(character_id):
+    attribute_ids = [attribute.id for attribute in Attribute.query.order_by(Attribute.id).limit(3)]
+    started = datetime.datetime.utcnow()
+
+    # (time, ranks the character held then) after every change
+    expected = []
+    ranks = {}
+    for change in range(SNAPSHOT_INTERVAL + 10):
+        attribute_id = attribute_ids[change % len(attribute_ids)]
+        # every fifth change removes the attribute again
+        rank = None if change % 5 == 4 and attribute_id in ranks else change // len(attribute_ids) + 1
+        if rank is None:
+            del ranks[attribute_id]
+        else:
+            ranks[attribute_id] = rank
+        set_attribute_rank(character_id, attribute_id, rank)
+        expected.append((datetime.datetime.utcnow(), dict(ranks)))
+
+    snapshots = _snapshots(character_id)
+    assert len(snapshots) == 2
+    assert json.loads(snapshots[0].ranks) == {}
+    # the points before and after the second snapshot rebuild from different snapshots
+    assert expected[0][0] < snapshots[1].taken_on < expected[-1][0]
+    assert any(rank is None for rank in (change.new_rank for change in
+                                         AttributeChange.query.filter_by(character_id=character_id)))
+
+    assert ranks_as_of(character_id, started) is None
+    for when, ranks in expected:
+        assert ranks_as_of(character_id, when) == ranks
+    assert ranks_as_of(character_id, datetime.datetime.utcnow()) == current_ranks(character_id)
+
+
+def test_snapshot_all(character_id):
+    set_attribute_rank(character_id, Attribute.query.first().id, 3)
+    taken = snapshot_all()
+
+    characters = Character.query.order_by(Character.id).all()
+    assert taken == len(characters)
+    for character in characters:
+        snapshot = _snapshots(character.id)[-1]
+        ranks = dict((int(attribute_id), rank) for attribute_id, rank in json.loads(snapshot.ranks).items())
+        assert ranks == current_ranks(character.id)
+        assert ranks_as_of(character.id, snapshot.taken_on) == ranks
+
+
+def test_delete_character_with_history(character_id):
+    set_attribute_rank(character_id, Attribute.query.first().id, 2)
+    # SQLite only checks the foreign keys of the history rows when asked to
+    db.session.execute('PRAGMA foreign_keys = ON')
+    db.session.delete(Character.query.get(character_id))
+    db.session.commit()
+    db.session.execute('PRAGMA foreign_keys = OFF')
+    assert AttributeChange.query.filter_by(character_id=character_id).count() == 0
+    assert _snapshots(character_id) == []
@@ -0,0 +1,140 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from app import db
+from app.jobs import JobError, Worker, claim_next_job, enqueue, export_path, requeue_expired, run_job, task
+from app.models import Bucket, Job, JobStatus
+from app.snapshots import read_info
+
+
+@task('test_record', max_attempts=2)
+def record_task(job, name):
+    """
+    Write a bucket named after the job, standing in for a task's work
+    """
+    db.session.add(Bucket(name='{0} {1}'.format(name, job.id)))
+    return {'name': name}
+
+
+@task('test_broken', max_attempts=2)
+def broken_task(job, retryable=True):
+    """
+    Fail after writing, so the write must be rolled back
+    """
+    db.session.add(Bucket(name='broken {}'.format(job.id)))
+    db.session.flush()
+    raise (RuntimeError if retryable else JobError)('broken')
+
+
+@pytest.fixture
+def queue(app):
+    """
+    An empty job queue
+    """
+    Job.query.delete()
+    db.session.commit()
+    yield
+    db.session.rollback()
+    Job.query.delete()
+    db.session.commit()
+
+
+def _expire(job_id):
+    Job.query.filter_by(id=job_id).update({'locked_until': datetime.datetime.utcnow() - datetime.timedelta(1)})
+    db.session.commit()
+
+
+def _bucket_names(prefix):
+    return [bucket.name for bucket in Bucket.query.filter(Bucket.name.like(prefix + ' %'))]
+
+
+def test_job_claimed_once(queue):
+    job_id = enqueue('test_record', {'name': 'once'})
+    assert claim_next_job('worker-a') == job_id
+    assert claim_next_job('worker-b') is None
+
+    job = Job.query.get(job_id)
+    assert (job.status, job.locked_by, job.attempts) == (JobStatus.RUNNING, 'worker-a', 1)
+    assert run_job(job_id, 'worker-a') == JobStatus.SUCCEEDED
+    assert _bucket_names('once') == ['once {}'.format(job_id)]
+
+
+def test_worker_threads_run_each_job_once(app, queue):
+    job_ids = [enqueue('test_record', {'name': 'threaded'}) for _ in range(12)]
+    finished = Worker(app, threads=4, once=True).run()
+
+    ran = [job_id for job_id, status in finished]
+    assert len(ran) == len(set(ran))
+    # a thread that lost a race for SQLite's write lock stops early with once, its jobs stay queued
+    queued = [job.id for job in Job.query.filter_by(status=JobStatus.QUEUED)]
+    assert sorted(ran + queued) == job_ids
+    assert sorted(_bucket_names('threaded')) == sorted('threaded {}'.format(job_id) for job_id in ran)
+
+
+def test_lost_lease_rolls_back(queue):
+    job_id = enqueue('test_record', {'name': 'lost'})
+    assert claim_next_job('worker-a') == job_id
+    # worker-a stalls past its lease and worker-b takes the job over
+    _expire(job_id)
+    assert requeue_expired() == 1
+    assert claim_next_job('worker-b') == job_id
+
+    assert run_job(job_id, 'worker-a') is None
+    assert _bucket_names('lost') == []
+    job = Job.query.get(job_id)
+    assert (job.status, job.locked_by, job.attempts) == (JobStatus.RUNNING, 'worker-b', 2)
+
+    assert run_job(job_id, 'worker-b') == JobStatus.SUCCEEDED
+    assert _bucket_names('lost') == ['lost {}'.format(job_id)]
+
+
+def test_expired_lease_requeued_until_out_of_attempts(queue):
+    job_id = enqueue('test_record', {'name': 'expired'})
+    for attempt, status in ((1, JobStatus.QUEUED), (2, JobStatus.FAILED)):
+        assert claim_next_job('worker-a') == job_id
+        _expire(job_id)
+        assert requeue_expired() == 1
+        job = Job.query.get(job_id)
+        assert (job.status, job.attempts, job.locked_by) == (status, attempt, None)
+    assert claim_next_job('worker-a') is None
+
+
+def test_failed_job_retried_then_failed(queue):
+    job_id = enqueue('test_broken')
+    assert claim_next_job('worker-a') == job_id
+    assert run_job(job_id, 'worker-a') == JobStatus.QUEUED
+    assert _bucket_names('broken') == []
+
+    # the retry waits out its backoff
+    assert claim_next_job('worker-a') is None
+    Job.query.filter_by(id=job_id).update({'run_after': datetime.datetime.utcnow()})
+    db.session.commit()
+    assert claim_next_job('worker-a') == job_id
+    assert run_job(job_id, 'worker-a') == JobStatus.FAILED
+    assert 'RuntimeError: broken' in Job.query.get(job_id).error
+
+
+def test_job_error_not_retried(queue):
+    job_id = enqueue('test_broken', {'retryable': False})
+    assert claim_next_job('worker-a') == job_id
+    assert run_job(job_id, 'worker-a') == JobStatus.FAILED
+    assert Job.query.get(job_id).attempts == 1
+
+
+def test_snapshot_job(app, queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    job_id = enqueue('write_snapshot')
+    assert claim_next_job('worker-a') == job_id
+    assert run_job(job_id, 'worker-a') == JobStatus.SUCCEEDED
+    info = read_info(export_path(Job.query.get(job_id)))
+
+    job_id = enqueue('write_snapshot', {'generated_at': info['generated_at'],
+                                        'catalog_version': info['catalog_version']})
+    assert claim_next_job('worker-a') == job_id
+    assert run_job(job_id, 'worker-a') == JobStatus.SUCCEEDED
+    job = Job.query.get(job_id)
+    assert os.path.basename(export_path(job)) == 'delta-{}.sqlite'.format(job_id)
+    assert json.loads(job.result)['delta']
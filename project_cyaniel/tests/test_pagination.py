@@ -0,0 +1,34 @@
+import datetime
+
+import pytest
+
+from app.models import Character, Job
+from app.pagination import encode_cursor, keyset_paginate
+
+
+def _names(after=None):
+    return keyset_paginate(Character.query, Character.character_name, Character.id, 'name', 5, after=after)
+
+
+def test_walk_pages(app):
+    names = []
+    page = _names()
+    while True:
+        names.extend((character.character_name, character.id) for character in page)
+        if not page.has_next:
+            break
+        page = _names(page.next_cursor)
+    assert names == sorted((character.character_name, character.id) for character in Character.query)
+
+
+@pytest.mark.parametrize('value', [[1, 2], {'a': 1}, 3, True, None])
+def test_mistyped_cursor(app, value):
+    with pytest.raises(ValueError):
+        _names(encode_cursor(value, 3))
+
+
+def test_datetime_cursor(app):
+    cursor = encode_cursor(datetime.datetime(2020, 1, 1), 1)
+    keyset_paginate(Job.query, Job.created_on, Job.id, 'created', 5, after=cursor)
+    with pytest.raises(ValueError):
+        keyset_paginate(Job.query, Job.created_on, Job.id, 'created', 5, after=encode_cursor('2020-01-01', 1))
@@ -0,0 +1,18 @@
+import pytest
+from flask import Flask
+
+from app.passwords import PASSWORD_HASH_LENGTH, PasswordHasher
+
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256:1000', 'pbkdf2:sha512:1000', 'scrypt:1024:8:1'])
+def test_hash_length(method):
+    hasher = PasswordHasher()
+    hasher.method = method
+    assert hasher.hash_length() == len(hasher.hash('secret')) <= PASSWORD_HASH_LENGTH
+
+
+def test_hash_longer_than_column():
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_METHOD='pbkdf2:sha512:1000', PASSWORD_SALT_LENGTH=128)
+    with pytest.raises(ValueError):
+        PasswordHasher(app)
@@ -0,0 +1,70 @@
+import pytest
+
+from app.catalog import get_catalog
+from app.prerequisites import PrerequisiteCycleError, PrerequisiteGraph, load_prerequisite_graph, \
+    update_prerequisite_graph
+
+
+# 4 requires 3 and 2, which both require 1; 5 requires 4
+EDGES = [(2, 1), (3, 1), (4, 2), (4, 3), (5, 4)]
+
+
+def _closures(graph):
+    return dict((node, (graph.prerequisites(node), graph.unlocks(node))) for node in graph.requires)
+
+
+def test_closures():
+    graph = PrerequisiteGraph(EDGES)
+    assert graph.prerequisites(5) == {1, 2, 3, 4}
+    assert graph.prerequisites(1) == set()
+    assert graph.unlocks(1) == {2, 3, 4, 5}
+    assert graph.unlocks(5) == set()
+    assert graph.learning_path(4)[0] == 1
+    assert graph.learning_path(4)[-1] == 4
+    # knowing 2 implies knowing 1
+    assert graph.missing_prerequisites(5, [2]) == [3, 4]
+    assert graph.missing_prerequisites(5, [4]) == []
+
+
+def test_cycle():
+    with pytest.raises(PrerequisiteCycleError):
+        PrerequisiteGraph(EDGES + [(1, 5)])
+
+    graph = PrerequisiteGraph(EDGES)
+    before = _closures(graph)
+    with pytest.raises(PrerequisiteCycleError):
+        graph.add_requirement(1, 5)
+    with pytest.raises(PrerequisiteCycleError):
+        graph.set_requirements(6, [6])
+    assert _closures(graph) == before
+    assert 6 not in graph
+
+
+def test_single_edge_update():
+    graph = PrerequisiteGraph(EDGES)
+    updated = graph.copy()
+    updated.remove_requirement(4, 3)
+    assert updated.prerequisites(5) == {1, 2, 4}
+    assert updated.unlocks(3) == set()
+    assert _closures(updated) == _closures(PrerequisiteGraph([(2, 1), (3, 1), (4, 2), (5, 4)]))
+    # the original graph is untouched
+    assert graph.prerequisites(5) == {1, 2, 3, 4}
+
+    updated.add_requirement(3, 2)
+    assert updated.prerequisites(3) == {1, 2}
+    assert updated.unlocks(2) == {3, 4, 5}
+
+
+def test_update_from_catalog(app):
+    with app.app_context():
+        catalog = get_catalog()
+        current = load_prerequisite_graph(catalog=catalog)
+        node = next(node for node, requirements in sorted(current.requires.items()) if requirements)
+        stale = current.copy()
+        stale.remove_requirement(node, min(current.requires[node]))
+        stale.version = None
+
+        updated = update_prerequisite_graph(stale, catalog=catalog)
+        assert updated.version == catalog.version
+        assert _closures(updated) == _closures(current)
+        assert stale.requires[node] != current.requires[node]
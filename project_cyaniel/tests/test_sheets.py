@@ -0,0 +1,58 @@
+import pytest
+
+from app import db
+from app.instrumentation import count_queries
+from app.models import Character, CharacterNotes
+from app.sheets import LOAD_PROFILES, load_character_sheet
+
+
+@pytest.fixture(scope='module')
+def character_id(app):
+    """
+    A generated character with attributes, awards and items, given a note so every loaded relationship has rows
+    """
+    character = next(character for character in Character.query.order_by(Character.id)
+                     if character.attributes and character.awards and character.items)
+    db.session.add(CharacterNotes(title='Backstory', body='Raised by wolves.', character=character))
+    db.session.commit()
+    character_id = character.id
+    db.session.remove()
+    return character_id
+
+
+def _render(sheet):
+    # everything a page shows for the profile, none of which may lazy load
+    character = sheet.character
+    character.user.user_name
+    if sheet.profile == 'summary':
+        return
+    [award.award_type.name for award in character.awards]
+    [entry.item.item_name for entry in character.items]
+    [note.title for note in character.notes]
+    [(entry.attribute.attribute_type.id, entry.rank) for entry in sheet.attributes]
+    if sheet.profile == 'staff_review':
+        [role.id for role in character.user.roles]
+
+
+@pytest.mark.parametrize('profile', sorted(LOAD_PROFILES))
+def test_load_profile_stays_within_budget(app, character_id, profile):
+    db.session.remove()
+    with count_queries() as loading:
+        sheet = load_character_sheet(character_id, profile)
+    with count_queries() as rendering:
+        _render(sheet)
+    db.session.remove()
+
+    assert sheet.character.id == character_id
+    assert loading.count <= LOAD_PROFILES[profile].budget, '\n'.join(loading.statements)
+    assert rendering.count == 0, '\n'.join(rendering.statements)
+
+
+@pytest.mark.parametrize('profile', ['full_sheet', 'staff_review'])
+def test_ranked_profiles_load_attributes(app, character_id, profile):
+    sheet = load_character_sheet(character_id, profile)
+    held = Character.query.get(character_id).attributes
+    db.session.remove()
+
+    assert sorted(sheet.ranks()) == sorted(attribute.id for attribute in held)
+    assert all(entry.rank for entry in sheet.attributes)
@@ -0,0 +1,116 @@
+import datetime
+import threading
+
+import pytest
+
+from app import db, tickets
+from app.models import Bucket, BucketTicket, TicketStatus, User
+from app.tickets import claim_next_ticket, close_ticket, release_ticket
+
+
+@pytest.fixture
+def bucket(app):
+    """
+    A bucket of its own, with a few open tickets oldest first
+    """
+    bucket = Bucket(name='Claims')
+    db.session.add(bucket)
+    db.session.flush()
+    creator_id = User.query.first().id
+    created_on = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    for number in range(8):
+        db.session.add(BucketTicket(bucket_id=bucket.id, title='Ticket {}'.format(number), creator_id=creator_id,
+                                    status=TicketStatus.OPEN,
+                                    created_on=created_on + datetime.timedelta(minutes=number)))
+    db.session.commit()
+    bucket_id = bucket.id
+    yield bucket_id
+    db.session.rollback()
+    BucketTicket.query.filter_by(bucket_id=bucket_id).delete()
+    Bucket.query.filter_by(id=bucket_id).delete()
+    db.session.commit()
+
+
+def _ticket_ids(bucket_id):
+    return [ticket.id for ticket in BucketTicket.query.filter_by(bucket_id=bucket_id)
+            .order_by(BucketTicket.created_on)]
+
+
+def _user_ids():
+    return [user.id for user in User.query.order_by(User.id).limit(2)]
+
+
+def test_claim_oldest_first(bucket):
+    ticket_ids = _ticket_ids(bucket)
+    first, second = _user_ids()
+    assert claim_next_ticket(bucket, first) == ticket_ids[0]
+    assert claim_next_ticket(bucket, second) == ticket_ids[1]
+
+    ticket = BucketTicket.query.get(ticket_ids[0])
+    assert (ticket.status, ticket.assignee_id) == (TicketStatus.CLAIMED, first)
+
+
+def test_claim_empty_queue(bucket):
+    user_id = _user_ids()[0]
+    claimed = [claim_next_ticket(bucket, user_id) for _ in _ticket_ids(bucket)]
+    assert claimed == _ticket_ids(bucket)
+    assert claim_next_ticket(bucket, user_id) is None
+
+
+def test_claim_skips_ticket_taken_meanwhile(bucket, monkeypatch):
+    ticket_ids = _ticket_ids(bucket)
+    first, second = _user_ids()
+    claim = tickets._claim
+
+    def racing_claim(connection, ticket_id, user_id, now):
+        # first claims the oldest ticket between second reading it and claiming it
+        if ticket_id == ticket_ids[0] and user_id == second:
+            assert claim(connection, ticket_id, first, now)
+        return claim(connection, ticket_id, user_id, now)
+
+    monkeypatch.setattr(tickets, '_claim', racing_claim)
+    assert claim_next_ticket(bucket, second) == ticket_ids[1]
+    assert BucketTicket.query.get(ticket_ids[0]).assignee_id == first
+
+
+def test_concurrent_claims_take_each_ticket_once(app, bucket):
+    user_ids = _user_ids()
+    claimed = []
+
+    def claim(user_id):
+        with app.app_context():
+            while True:
+                ticket_id = claim_next_ticket(bucket, user_id)
+                if ticket_id is None:
+                    break
+                claimed.append((ticket_id, user_id))
+            db.session.remove()
+
+    threads = [threading.Thread(target=claim, args=(user_ids[index % 2],)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(ticket_id for ticket_id, user_id in claimed) == _ticket_ids(bucket)
+    db.session.expire_all()
+    for ticket_id, user_id in claimed:
+        assert BucketTicket.query.get(ticket_id).assignee_id == user_id
+
+
+def test_release_and_close_only_by_assignee(bucket):
+    assignee, other = _user_ids()
+    ticket_id = claim_next_ticket(bucket, assignee)
+
+    assert not release_ticket(ticket_id, other)
+    assert not close_ticket(ticket_id, other)
+    assert release_ticket(ticket_id, assignee)
+    ticket = BucketTicket.query.get(ticket_id)
+    assert (ticket.status, ticket.assignee_id) == (TicketStatus.OPEN, None)
+    # a released ticket is back at the head of the queue
+    assert claim_next_ticket(bucket, other) == ticket_id
+    assert not close_ticket(ticket_id, assignee)
+    assert close_ticket(ticket_id, other)
+    assert not release_ticket(ticket_id, other)
+    assert not close_ticket(ticket_id, other)
+    assert BucketTicket.query.get(ticket_id).status == TicketStatus.CLOSED